@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+loading the procs of an app with many procs, an AppContext built for
+every proc against one AppContext shared by all the procs, as LainConf does
+
+    python benchmarks/bench_app_context.py [number of procs] [number of domains]
+"""
+
+import sys
+
+from common import rate, report
+from fixtures import corpus
+
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.parser import AppContext, Proc, is_section
+
+APPNAME = 'a.b.hello'
+
+
+def load_alone(procs, domains):
+    for key, meta in procs:
+        Proc().load(key, meta, APPNAME, corpus.META_VERSION, None, domains=domains)
+
+
+def load_shared(procs, domains):
+    context = AppContext(APPNAME, corpus.META_VERSION, None, domains=domains)
+    for key, meta in procs:
+        Proc().load(key, meta, APPNAME, corpus.META_VERSION, None, app_context=context)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    domains_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    meta = backend.safe_load(corpus.sized_meta(procs=count, mountpoints=1, appname=APPNAME))
+    procs = [(key, section) for key, section in sorted(meta.items()) if is_section(key, Proc)]
+    domains = ['d%d.lain.local' % i for i in range(domains_count)]
+    rows = [
+        ('context per proc', rate(lambda: load_alone(procs, domains), min_time=1)),
+        ('shared context', rate(lambda: load_shared(procs, domains), min_time=1)),
+    ]
+    report('%d procs, %d domains, apps loaded per second' % (count, domains_count),
+           rows, ['', 'per second'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+matching the filters of procs to nodes, parsing the filter strings and
+checking every node per proc against NodeIndex
+
+    python benchmarks/bench_filters.py [number of procs] [number of nodes]
+"""
+
+import re
+import sys
+import random
+from fnmatch import fnmatchcase
+
+from common import rate, report
+
+from lain_sdk.yaml.filters import FILTER_PATTERN, NodeIndex
+
+GROUPS = ['default', 'db', 'cache', 'batch']
+ZONES = ['bj-a', 'bj-b', 'sh-a', 'sh-b']
+FILTERS = [
+    [],
+    ['constraint:disk==ssd'],
+    ['constraint:zone==bj-*'],
+    ['constraint:zone==/^sh-/', 'constraint:disk!=hdd'],
+    ['affinity:image!=~redis*'],
+]
+
+
+def gen_nodes(count, rng):
+    return dict(('node%d' % i, {'group': rng.choice(GROUPS), 'zone': rng.choice(ZONES),
+                                'disk': rng.choice(['ssd', 'hdd']),
+                                'image': ['img%d' % rng.randint(0, 50) for _ in range(5)]})
+                for i in range(count))
+
+
+def gen_procs(count, rng):
+    return [('proc%d' % i, rng.choice(FILTERS) + ['constraint:group==%s' % rng.choice(GROUPS)])
+            for i in range(count)]
+
+
+def _node_match(labels, name, key, value):
+    values = labels.get(key, [])
+    if key == 'node':
+        values = [name]
+    elif not isinstance(values, list):
+        values = [values]
+    for v in values:
+        if value.startswith('/') and value.endswith('/'):
+            if re.search(value[1:-1], v):
+                return True
+        elif fnmatchcase(v, value):
+            return True
+    return False
+
+
+def naive_match(nodes, procs):
+    # what a scheduler does without an index: parse the filters, check every node
+    matched = {}
+    for procname, filters in procs:
+        candidates = sorted(nodes)
+        parsed = [FILTER_PATTERN.match(f).groups() for f in filters]
+        for soft in (False, True):
+            for kind, key, op, value in parsed:
+                if value.startswith('~') != soft:
+                    continue
+                value = value.lstrip('~')
+                narrowed = [n for n in candidates
+                            if _node_match(nodes[n], n, key, value) == (op == '==')]
+                if narrowed or not soft:
+                    candidates = narrowed
+        matched[procname] = frozenset(candidates)
+    return matched
+
+
+def main():
+    procs_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nodes_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = random.Random(0)
+    nodes = gen_nodes(nodes_count, rng)
+    procs = gen_procs(procs_count, rng)
+    assert naive_match(nodes, procs) == NodeIndex(nodes).match_procs(procs)
+    rows = [
+        ('scan every node', rate(lambda: naive_match(nodes, procs), min_time=1)),
+        ('NodeIndex, built every time', rate(lambda: NodeIndex(nodes).match_procs(procs))),
+    ]
+    index = NodeIndex(nodes)
+
+    def match_uncached():
+        index._cache.clear()
+        index.match_procs(procs)
+    rows.append(('NodeIndex, match only', rate(match_uncached)))
+    report('%d procs x %d nodes, matchings per second' % (procs_count, nodes_count),
+           rows, ['', 'per second'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+apps per second of load_many at 1, 2, 4 and 8 workers
+
+    python benchmarks/bench_load_many.py [number of apps]
+"""
+
+import sys
+import time
+
+from common import load_fixtures, report
+
+from lain_sdk.yaml.batch import load_many
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+CLUSTER_CONFIG = {'registry': 'registry.lain.local', 'domains': ['lain.local']}
+
+
+def main():
+    apps = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    fixtures = load_fixtures().values()
+    items = [(fixtures[i % len(fixtures)], META_VERSION, CLUSTER_CONFIG)
+             for i in range(apps)]
+    rows = []
+    for workers in (1, 2, 4, 8):
+        for chunksize in (1, 16):
+            start = time.time()
+            failed = sum(1 for r in load_many(items, processes=workers, chunksize=chunksize)
+                         if r.errors)
+            elapsed = time.time() - start
+            rows.append((workers, chunksize, apps / elapsed, failed))
+    report('load_many on %s apps' % apps, rows,
+           ['workers', 'chunksize', 'apps/s', 'failed'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+validating and loading lain.yaml on fixtures/data, with the yaml loaded
+twice (validate then LainConf.load) against parse_and_validate
+
+    python benchmarks/bench_parse_and_validate.py
+"""
+
+from common import load_fixtures, rate, report
+
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.parser import LainConf
+from lain_sdk.yaml.validator import validate, parse_and_validate
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def validate_then_load(text):
+    valid, msg = validate(backend.safe_load(text))
+    if not valid:
+        return None, msg
+    conf = LainConf()
+    conf.load(text, META_VERSION, None)
+    return conf, []
+
+
+def main():
+    rows = []
+    for name, text in load_fixtures().items():
+        assert parse_and_validate(text, META_VERSION)[1] == []
+        rows.append((
+            name,
+            rate(lambda: validate_then_load(text)),
+            rate(lambda: parse_and_validate(text, META_VERSION)),
+        ))
+    report('lain.yaml per second', rows,
+           ['fixture', 'validate then load', 'parse_and_validate'])
+
+
+if __name__ == '__main__':
+    main()
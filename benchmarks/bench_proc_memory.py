@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+memory held by a corpus of parsed procs
+
+    python benchmarks/bench_proc_memory.py [number of procs]
+"""
+
+import gc
+import sys
+import resource
+
+import common  # noqa
+
+from lain_sdk.yaml.parser import LainConf
+
+PROCS_PER_APP = 50
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def gen_meta(appname, procs):
+    lines = ['appname: %s' % appname, 'build:', '  base: golang',
+             '  script:', '    - go build']
+    for i in range(procs):
+        lines += ['worker.w%d:' % i, '  cmd: worker %d' % i, '  memory: 64m',
+                  '  env:', '    - INDEX=%d' % i]
+    return '\n'.join(lines)
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def main():
+    procs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    metas = [gen_meta('app%d' % i, PROCS_PER_APP)
+             for i in range(procs // PROCS_PER_APP)]
+    gc.collect()
+    before = rss()
+    confs = []
+    for meta in metas:
+        conf = LainConf()
+        conf.load(meta, META_VERSION, None)
+        confs.append(conf)
+    gc.collect()
+    held = rss() - before
+    total = sum(len(c.procs) for c in confs)
+    print('%d procs held in %.1f MiB, %.0f bytes per proc' % (
+        total, held / 1024.0 / 1024, float(held) / total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+round trips to the registry of a typical build, with a fresh request per
+call as before against RegistryClient, on a local stand-in registry
+
+A build checks the login, looks up the shared prepare images, looks up
+the release tags once the image is pushed and logs out.
+
+    python benchmarks/bench_registry.py [number of builds]
+"""
+
+import sys
+import time
+
+import requests
+from requests.auth import HTTPBasicAuth
+
+from common import report
+from fixtures.registry import StandInRegistry
+
+from lain_sdk.registry import RegistryClient, _get_registry_auth_url
+
+CREDENTIALS = ('lain', 'secret')
+TIMEOUT = (3, 5)
+
+
+class FreshRequests(object):
+    # the registry helpers before RegistryClient
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def challenge(self):
+        r = requests.get('http://%s/v2' % self.registry, timeout=TIMEOUT)
+        if r.status_code == 401:
+            return True, _get_registry_auth_url(r)
+        return False, ''
+
+    def tag_list(self, repository):
+        need_auth, auth_url = self.challenge()
+        headers = None
+        if need_auth:
+            url = '%s?service=lain.local&scope=repository:%s:push,pull&account=%s' % (
+                auth_url, repository, CREDENTIALS[0])
+            token = requests.get(url, auth=HTTPBasicAuth(*CREDENTIALS)).json()['token']
+            headers = {'Authorization': 'Bearer %s' % token}
+        r = requests.get('http://%s/v2/%s/tags/list' % (self.registry, repository),
+                         headers=headers, timeout=TIMEOUT)
+        return r.json()['tags']
+
+
+def build(client, appname):
+    client.challenge()
+    client.tag_list(appname)
+    client.tag_list(appname)
+    client.challenge()
+
+
+def measure(registry, client, builds):
+    registry.reset_counts()
+    start = time.time()
+    for i in range(builds):
+        build(client, 'app%d' % (i % 3))
+    return len(registry.requests), registry.connections, time.time() - start
+
+
+def main():
+    builds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    repositories = dict(('app%d' % i, ['release-%d' % j for j in range(50)]) for i in range(3))
+    with StandInRegistry(repositories, credentials=CREDENTIALS) as registry:
+        rows = []
+        for name, client in [('fresh requests', FreshRequests(registry.address)),
+                             ('RegistryClient', RegistryClient(registry.address, CREDENTIALS))]:
+            requests_count, connections, elapsed = measure(registry, client, builds)
+            if isinstance(client, RegistryClient):
+                client.close()
+            rows.append((name, requests_count, connections, requests_count / float(builds),
+                         elapsed * 1000 / builds))
+    report('%d builds of 3 apps in one process' % builds, rows,
+           ['', 'round trips', 'connections', 'per build', 'ms per build'])
+
+
+if __name__ == '__main__':
+    main()
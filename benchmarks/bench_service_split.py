@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+loading service heavy apps, splitting every service.* section into its
+worker and portal by deepcopy as before against the shallow split of
+LainConf, and the memory held by the loaded confs
+
+    python benchmarks/bench_service_split.py [number of services] [length of env and volumes]
+"""
+
+import gc
+import os
+import copy
+import sys
+import resource
+
+from common import rate, report
+from fixtures import corpus
+
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.parser import LainConf
+
+CONFS = 20
+
+
+class DeepcopyLainConf(LainConf):
+    # the splits before LainConf kept from copying user input
+
+    def _load_proc_section(self, key, meta, *args, **kwargs):
+        if not key.startswith('service.'):
+            return LainConf._load_proc_section(self, key, meta, *args, **kwargs)
+        name = key.split('.')[1]
+        worker = copy.deepcopy(meta)
+        portal = worker.pop('portal')
+        portal['service_name'] = name
+        return (LainConf._load_proc_section(self, 'proc.%s' % name, worker, *args, **kwargs) +
+                LainConf._load_proc_section(self, 'portal.portal-%s' % name, portal,
+                                            *args, **kwargs))
+
+    def _load_use_resources(self, meta):
+        use_resources = {}
+        for k, v in meta.iteritems():
+            tmp_v = copy.deepcopy(v)
+            use_resources[k] = {'services': tmp_v.pop('services')}
+            use_resources[k]['context'] = tmp_v
+        return use_resources
+
+
+def load(conf_class, meta):
+    conf = conf_class()
+    conf.load_meta(meta, corpus.META_VERSION, None)
+    return conf
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def held(load, metas):
+    # measured in a child process, memory freed by a previous measurement
+    # would be reused without growing the rss
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        gc.collect()
+        before = rss()
+        kept = [load(meta) for meta in metas]
+        gc.collect()
+        os.write(write_end, '%d %d' % (len(kept), rss() - before))
+        os._exit(0)
+    os.close(write_end)
+    size = int(os.read(read_end, 64).split()[1])
+    os.close(read_end)
+    os.waitpid(pid, 0)
+    return size / 1024.0 / 1024
+
+
+def main():
+    services = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    metas = [backend.safe_load(corpus.sized_meta(
+        services=services, resources=services, env=length, volumes=length, seed=seed))
+        for seed in range(CONFS)]
+    meta = metas[0]
+    rows = [
+        ('deepcopy split', rate(lambda: load(DeepcopyLainConf, meta), min_time=1)),
+        ('shallow split', rate(lambda: load(LainConf, meta), min_time=1)),
+    ]
+    report('%d services, %d env and volumes each, loads per second' % (services, length),
+           rows, ['', 'per second'])
+
+    rows = [
+        ('deepcopy split', held(lambda meta: load(DeepcopyLainConf, meta), metas)),
+        ('shallow split', held(lambda meta: load(LainConf, meta), metas)),
+    ]
+    report('rss MB held by %d loaded apps' % CONFS, rows, ['', 'MB'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+lain.yaml validations per second on fixtures/data: jsonschema.validate
+building the validator on every call, the jsonschema validator built once,
+and the validator compiled by codegen
+
+    python benchmarks/bench_validator.py
+"""
+
+from common import load_fixtures, rate, report
+
+import jsonschema
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.validator import validate, validate_all, validate_many, validator
+from lain_sdk.yaml.validator.schema import schema
+
+BATCH_SIZE = 100
+
+
+def jsonschema_validate(source_data):
+    try:
+        jsonschema.validate(source_data, schema)
+        return True, 'ok'
+    except Exception as e:
+        return False, str(e)
+
+
+def prebuilt_validate(source_data):
+    for error in validator.iter_errors(source_data):
+        return False, str(error)
+    return True, 'ok'
+
+
+def main():
+    rows = []
+    for name, text in load_fixtures().items():
+        data = backend.safe_load(text)
+        assert jsonschema_validate(data) == prebuilt_validate(data) == validate(data)
+        batch = [data] * BATCH_SIZE
+        rows.append((
+            name,
+            rate(lambda: jsonschema_validate(data)),
+            rate(lambda: prebuilt_validate(data)),
+            rate(lambda: validate(data)),
+            rate(lambda: validate_all(data)),
+            rate(lambda: validate_many(batch)) * BATCH_SIZE,
+        ))
+    report('validations per second', rows,
+           ['fixture', 'jsonschema.validate', 'prebuilt', 'validate', 'validate_all',
+            'validate_many'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+round trip of parsed LainConf through the wire formats against parsing
+lain.yaml again, on fixtures/data
+
+    python benchmarks/bench_wire_format.py
+"""
+
+from common import load_fixtures, rate, report
+
+from lain_sdk.yaml import wire
+from lain_sdk.yaml.parser import LainConf
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def parse(text):
+    conf = LainConf()
+    conf.load(text, META_VERSION, None)
+    return conf
+
+
+def main():
+    msgpack = wire.msgpack is not None
+    print('msgpack available: %s\n' % msgpack)
+    rows, sizes = [], []
+    for name, text in load_fixtures().items():
+        conf = parse(text)
+        data = conf.to_dict()
+        json_data = wire.dumps_json(conf)
+        assert wire.loads_json(json_data).to_dict() == data
+        row = [name, rate(lambda: parse(text)),
+               rate(lambda: wire.dumps_json(conf)),
+               rate(lambda: wire.loads_json(json_data))]
+        size = [name, len(text), len(json_data)]
+        if msgpack:
+            msgpack_data = wire.dumps_msgpack(conf)
+            assert wire.loads_msgpack(msgpack_data).to_dict() == data
+            row += [rate(lambda: wire.dumps_msgpack(conf)),
+                    rate(lambda: wire.loads_msgpack(msgpack_data))]
+            size.append(len(msgpack_data))
+        rows.append(row)
+        sizes.append(size)
+
+    columns = ['fixture', 'yaml parse', 'json dump', 'json load']
+    size_columns = ['fixture', 'yaml', 'json']
+    if msgpack:
+        columns += ['msgpack dump', 'msgpack load']
+        size_columns.append('msgpack')
+    report('operations per second', rows, columns)
+    report('encoded size in bytes', sizes, size_columns)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+parse and dump throughput of the yaml backend on fixtures/data
+
+    python benchmarks/bench_yaml_backend.py
+"""
+
+from common import load_fixtures, rate, report
+
+import yaml
+from lain_sdk.yaml import backend
+
+
+def main():
+    print('libyaml available: %s\n' % backend.LIBYAML)
+    rows = []
+    for name, text in load_fixtures().items():
+        data = yaml.load(text, Loader=yaml.SafeLoader)
+        assert backend.safe_load(text) == data
+        rows.append((
+            name,
+            rate(lambda: yaml.load(text, Loader=yaml.SafeLoader)),
+            rate(lambda: backend.safe_load(text)),
+            rate(lambda: yaml.dump(data, Dumper=yaml.Dumper, default_flow_style=False)),
+            rate(lambda: backend.dump(data, default_flow_style=False)),
+        ))
+    report('yaml operations per second', rows,
+           ['fixture', 'pure load', 'backend load', 'pure dump', 'backend dump'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import glob
+import json
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+FIXTURE_DATA_PATH = os.path.join(ROOT_DIR, 'fixtures', 'data')
+
+# benchmarks run from a checkout, make lain_sdk importable without installing
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+def load_fixtures():
+    """return {fixture name: lain.yaml text} of fixtures/data"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DATA_PATH, '*.yaml'))):
+        with open(path) as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+
+def measure(fn, number=None, min_time=0.2):
+    """
+    call `fn` `number` times, or repeat until `min_time` seconds passed
+    if `number` is None, return (calls, seconds)
+    """
+    calls, start = 0, time.time()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.time() - start
+        if number is not None:
+            if calls >= number:
+                return calls, elapsed
+        elif elapsed >= min_time:
+            return calls, elapsed
+
+
+def rate(fn, number=None, min_time=0.2):
+    calls, elapsed = measure(fn, number, min_time)
+    return calls / elapsed if elapsed > 0 else float('inf')
+
+
+def report(title, rows, columns):
+    print(title)
+    cells = [[('%.1f' % v) if isinstance(v, float) else str(v) for v in row]
+             for row in rows]
+    widths = [max([len(str(c))] + [len(r[i]) for r in cells])
+              for i, c in enumerate(columns)]
+    print('  '.join(str(c).rjust(w) for c, w in zip(columns, widths)))
+    for row in cells:
+        print('  '.join(v.rjust(w) for v, w in zip(row, widths)))
+    print('')
+
+
+def dump_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
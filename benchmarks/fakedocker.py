@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+stand-in for the docker daemon and registry used by LainYaml, so its
+orchestration can be measured without docker
+"""
+
+import sys
+from contextlib import contextmanager
+
+from lain_sdk import lain_yaml, mydocker
+
+REGISTRY = 'registry.lain.local'
+
+
+class FakeImage(object):
+
+    short_id = 'sha256:0123456789'
+
+
+class FakeDocker(object):
+    """
+    every docker command succeeds, `tags` is the tag list of the app both
+    in the registry and the docker daemon
+    """
+
+    def __init__(self, tags=()):
+        self.tags = list(tags)
+        self.calls = []
+
+    def _docker(self, args, cwd=None, env=None, capture_output=False, print_stdout=True):
+        self.calls.append(args[0])
+        return '' if capture_output else 0
+
+    def get_image(self, image_name):
+        return FakeImage()
+
+    def get_tag_list(self, registry, appname):
+        return list(self.tags)
+
+
+class _Null(object):
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+@contextmanager
+def fake_docker(tags=()):
+    """patch mydocker with a FakeDocker and silence the build log"""
+    fake = FakeDocker(tags)
+    patches = [
+        (mydocker, '_docker', fake._docker),
+        (mydocker, 'get_image', fake.get_image),
+        (mydocker, 'get_tag_list_in_registry', fake.get_tag_list),
+        (mydocker, 'get_tag_list_in_docker_daemon', fake.get_tag_list),
+        (lain_yaml, 'PRIVATE_REGISTRY', REGISTRY),
+    ]
+    saved = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    stdout = sys.stdout
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        sys.stdout = _Null()
+        yield fake
+    finally:
+        sys.stdout = stdout
+        for module, name, value in saved:
+            setattr(module, name, value)
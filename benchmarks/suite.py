@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+benchmark suite of the hot paths on synthetic corpora, results are written
+as json so two commits can be compared
+
+    python benchmarks/suite.py [--quick] [--filter NAME] [--output FILE]
+                               [--compare BASE_FILE] [--threshold 0.1]
+
+every case is measured over a grid of corpus sizes, `--quick` runs the
+smaller sizes only. With `--compare`, results are compared to a previous
+run and the exit code is 1 if any case got slower than the threshold.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from common import ROOT_DIR, measure, report, dump_json
+from fakedocker import fake_docker
+from fixtures import corpus
+
+import lain_sdk
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.batch import render_resource_instances
+from lain_sdk.yaml.parser import LainConf, render_resource_instance_meta
+from lain_sdk.yaml.validator import validate
+from lain_sdk.yaml.watch import PathWatcher
+
+# name: (setup, full grid, quick grid), setup(**params) returns
+# (function to measure, cleanup function or None)
+CASES = {}
+
+
+def case(name, grid, quick_grid=None):
+    def register(setup):
+        CASES[name] = (setup, grid, quick_grid or grid[:2])
+        return setup
+    return register
+
+
+def scale(base, **axes):
+    """grid varying one axis at a time from `base`"""
+    grid = [dict(base)]
+    for axis, values in sorted(axes.items()):
+        grid.extend(dict(base, **{axis: v}) for v in values if v != base.get(axis))
+    return grid
+
+
+PROCS = (1, 10, 100, 1000)
+LOAD_GRID = scale({'procs': 10, 'mountpoints': 0, 'domains': 1, 'ports': 0},
+                  procs=PROCS, mountpoints=(10, 100), domains=(10, 50), ports=(10, 100))
+LOAD_QUICK = scale({'procs': 10, 'mountpoints': 0, 'domains': 1, 'ports': 0},
+                   procs=(1,), mountpoints=(10,), domains=(10,), ports=(10,))
+
+
+def load_conf(text, domains):
+    conf = LainConf()
+    conf.load(text, corpus.META_VERSION, None, registry=corpus.REGISTRY,
+              domains=corpus.gen_domains(domains))
+    return conf
+
+
+@case('lain_conf_load', LOAD_GRID, LOAD_QUICK)
+def lain_conf_load(procs, mountpoints, domains, ports):
+    text = corpus.sized_meta(procs=procs, mountpoints=mountpoints, ports=ports)
+    return (lambda: load_conf(text, domains)), None
+
+
+@case('validate', scale({'procs': 1}, procs=PROCS))
+def validate_meta(procs):
+    data = backend.safe_load(corpus.sized_meta(procs=procs, mountpoints=2, ports=2, volumes=2))
+    assert validate(data)[0]
+    return (lambda: validate(data)), None
+
+
+@case('proc_annotation', LOAD_GRID, LOAD_QUICK)
+def proc_annotation(procs, mountpoints, domains, ports):
+    conf = load_conf(corpus.sized_meta(procs=procs, mountpoints=mountpoints, ports=ports),
+                     domains)
+    procs = list(conf.procs.values())
+    return (lambda: [proc.annotation for proc in procs]), None
+
+
+CLIENTS = scale({'clients': 1}, clients=(10, 100, 1000))
+
+
+@case('render_resource_instances', CLIENTS)
+def render_resource_many(clients):
+    clients = corpus.gen_clients(clients)
+    domains = corpus.gen_domains(1)
+
+    def render():
+        for _ in render_resource_instances(
+                'redis', corpus.META_VERSION, corpus.RESOURCE_META, clients,
+                corpus.REGISTRY, domains):
+            pass
+    return render, None
+
+
+@case('render_resource_instance_meta', CLIENTS)
+def render_resource_one_by_one(clients):
+    clients = corpus.gen_clients(clients)
+    domains = corpus.gen_domains(1)
+
+    def render():
+        for client_appname, context in clients:
+            render_resource_instance_meta(
+                'redis', corpus.META_VERSION, corpus.RESOURCE_META, client_appname,
+                context, corpus.REGISTRY, domains)
+    return render, None
+
+
+@case('path_watcher_update', scale({'files': 10}, files=(100, 1000)))
+def path_watcher_update(files):
+    root = tempfile.mkdtemp(prefix='lain-bench-')
+    corpus.gen_tree(root, files)
+    cwd = os.getcwd()
+    # PathWatcher hashes the files relative to the current directory
+    os.chdir(root)
+    watcher = PathWatcher(root)
+
+    def cleanup():
+        watcher.refresh()
+        os.chdir(cwd)
+        shutil.rmtree(root)
+    return watcher.update, cleanup
+
+
+@case('lain_yaml_build', scale({'procs': 1, 'tags': 0}, procs=(10, 100), tags=(100, 1000)),
+      scale({'procs': 1, 'tags': 0}, tags=(100,)))
+def lain_yaml_build(procs, tags):
+    root = tempfile.mkdtemp(prefix='lain-bench-')
+    corpus.gen_app_repo(root, corpus.sized_meta(procs=procs, prepare=True))
+    # shared prepare images in the registry, the other tags are releases
+    tags = ['prepare-0-%d' % (1500000000 + i) if i % 10 == 0 else
+            'release-%d-%040x' % (1500000000 + i, i) for i in range(tags)]
+    path = os.path.join(root, 'lain.yaml')
+
+    def build():
+        with fake_docker(tags):
+            conf = LainYaml(path, use_build_cache=False)
+            assert conf.build_release()[0]
+            assert conf.build_test()[0]
+            assert conf.build_meta()[0]
+    return build, lambda: shutil.rmtree(root)
+
+
+def case_id(name, params):
+    return '%s[%s]' % (name, ','.join('%s=%s' % kv for kv in sorted(params.items())))
+
+
+def run(names, quick, min_time):
+    results = []
+    for name in names:
+        setup, grid, quick_grid = CASES[name]
+        rows = []
+        for params in (quick_grid if quick else grid):
+            fn, cleanup = setup(**params)
+            try:
+                calls, elapsed = measure(fn, min_time=min_time)
+            finally:
+                if cleanup is not None:
+                    cleanup()
+            per_second = calls / elapsed if elapsed > 0 else float('inf')
+            results.append({'case': name, 'params': params, 'id': case_id(name, params),
+                            'calls': calls, 'seconds': elapsed, 'per_second': per_second})
+            rows.append((case_id('', params)[1:-1], calls, per_second))
+        report(name, rows, ['params', 'calls', 'per second'])
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'lain_sdk': lain_sdk.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'libyaml': backend.LIBYAML,
+        'time': int(time.time()),
+    }
+
+
+def compare(base, head, threshold):
+    """report the change of every case in both runs, return ids of the regressed ones"""
+    base_rates = dict((r['id'], r['per_second']) for r in base['results'])
+    rows, regressed = [], []
+    for result in head['results']:
+        if result['id'] not in base_rates:
+            continue
+        change = result['per_second'] / base_rates[result['id']] - 1
+        if change < -threshold:
+            regressed.append(result['id'])
+        rows.append((result['id'], base_rates[result['id']], result['per_second'],
+                     '%+.1f%%' % (change * 100)))
+    report('compared to %s' % (base['environment']['commit'] or 'base'), rows,
+           ['case', 'base', 'head', 'change'])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='lain_sdk benchmark suite')
+    parser.add_argument('--quick', action='store_true', help='run the smaller sizes only')
+    parser.add_argument('--filter', action='append', default=[],
+                        help='run the cases whose name contains FILTER')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to measure every case for')
+    parser.add_argument('--output', default='benchmark.json', help='result file')
+    parser.add_argument('--compare', metavar='BASE_FILE',
+                        help='result file of a previous run to compare to')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    names = sorted(n for n in CASES if not args.filter or any(f in n for f in args.filter))
+    data = {'environment': environment(),
+            'results': run(names, args.quick, args.min_time)}
+    dump_json(args.output, data)
+    print('results written to %s' % args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)
+        regressed = compare(base, data, args.threshold)
+        if regressed:
+            print('regressed: %s' % ', '.join(regressed))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+"""
+Seeded generator of synthetic lain.yaml for load testing the parser and
+the validator
+
+The build, release, test and notify sections and the basic settings of the
+procs are drawn from the shapes in fixtures/data, the generator adds procs,
+services with portals, use_services, use_resources, mountpoints, ports,
+labels and filters, persistent dirs with backup policies and cloud volumes
+on top of them. Invalid documents are valid ones with one mutation applied,
+which breaks them at a known stage:
+
+- yaml: the text is not yaml
+- schema: rejected by the validator
+- load: accepted by the validator, rejected by LainConf.load
+
+The same seed, index and knobs always give the same document.
+
+sized_meta and the gen_* helpers build the inputs of the benchmark suite,
+whose sizes are exact rather than drawn.
+
+    python -m fixtures.corpus DIRECTORY [COUNT] [SEED]
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import random
+import subprocess
+from collections import namedtuple
+
+from lain_sdk.yaml import backend
+
+PWD = os.path.dirname(os.path.realpath(__file__))
+FIXTURE_DATA_PATH = os.path.join(PWD, 'data')
+
+# name: name of the document
+# text: lain.yaml text
+# stage: None if the document is valid, otherwise the stage it fails at,
+#        one of STAGES
+# mutation: name of the mutation making the document invalid, None if valid
+CorpusDocument = namedtuple('CorpusDocument', 'name text stage mutation')
+
+STAGES = ('yaml', 'schema', 'load')
+
+# settings of fixture procs reused by the generated procs
+PROC_SEED_KEYS = ('cmd', 'memory', 'num_instances', 'env', 'setup_time',
+                  'kill_timeout', 'stateful', 'user', 'workdir', 'secret_files')
+
+# src port of the proc `ports` mapping must be between 9500 and 10000
+MIN_SRC_PORT = 9500
+MAX_SRC_PORT = 10000
+
+STREAM_SEPARATOR = re.compile(r'^--- # corpus (\S+) (\S+) (\S+)$')
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+REGISTRY = 'registry.lain.local'
+
+
+def load_shapes(fixture_path=FIXTURE_DATA_PATH):
+    """{section name: [section of a fixture]} of the lain.yaml under `fixture_path`"""
+    shapes = {'build': [], 'release': [], 'test': [], 'notify': [], 'proc': []}
+    for path in sorted(glob.glob(os.path.join(fixture_path, '*.yaml'))):
+        with open(path) as f:
+            meta = backend.safe_load(f.read())
+        for key, value in sorted(meta.items()):
+            if key in shapes:
+                shapes[key].append(value)
+            elif key.split('.')[0] in ('web', 'worker', 'proc', 'service'):
+                shapes['proc'].append(dict((k, v) for k, v in value.items()
+                                           if k in PROC_SEED_KEYS))
+    return shapes
+
+
+class CorpusGenerator(object):
+    """
+    Generate lain.yaml documents
+
+    Every knob but `invalid_ratio` is an inclusive (min, max) range, each
+    document draws its own size from it:
+
+    - procs: number of procs other than `web`
+    - services: number of `service.*` sections, each one with a portal
+    - resources: number of `use_resources` and `use_services` entries
+    - mountpoints: mountpoints of every web proc
+    - ports: `ports` mappings of every proc
+    - volumes: persistent dirs of every proc, some of them are backed up
+    - env: env entries added to every proc and portal
+
+    `invalid_ratio` is the share of invalid documents.
+    """
+
+    def __init__(self, seed=0, procs=(0, 8), services=(0, 2), resources=(0, 2),
+                 mountpoints=(0, 3), ports=(0, 3), volumes=(0, 3), env=(0, 0),
+                 invalid_ratio=0.0, fixture_path=FIXTURE_DATA_PATH):
+        self.seed = seed
+        self.procs = procs
+        self.services = services
+        self.resources = resources
+        self.mountpoints = mountpoints
+        self.ports = ports
+        self.volumes = volumes
+        self.env = env
+        self.invalid_ratio = invalid_ratio
+        self.shapes = load_shapes(fixture_path)
+
+    def document(self, index):
+        rng = random.Random('%s-%s' % (self.seed, index))
+        appname = 'app%d' % index
+        meta = self.meta(rng, appname)
+        name = '%05d-%s' % (index, appname)
+        if rng.random() >= self.invalid_ratio:
+            return CorpusDocument(name, self.dump(meta), None, None)
+        mutation, stage, mutate = rng.choice(MUTATIONS)
+        text = mutate(meta, rng)
+        if text is None:
+            text = self.dump(meta)
+        return CorpusDocument(name, text, stage, mutation)
+
+    def generate(self, count, start=0):
+        for index in range(start, start + count):
+            yield self.document(index)
+
+    def write_files(self, directory, count, start=0):
+        """write every document to `directory`/<name>.yaml, return the paths"""
+        paths = []
+        for doc in self.generate(count, start):
+            path = os.path.join(directory, '%s.yaml' % doc.name)
+            with open(path, 'w') as f:
+                f.write(doc.text)
+            paths.append(path)
+        return paths
+
+    def write_stream(self, stream, count, start=0):
+        """write the documents to a file like `stream`, read them back by iter_stream"""
+        for doc in self.generate(count, start):
+            stream.write('--- # corpus %s %s %s\n' % (doc.name, doc.stage, doc.mutation))
+            stream.write(doc.text)
+            if not doc.text.endswith('\n'):
+                stream.write('\n')
+
+    @staticmethod
+    def dump(meta):
+        return backend.safe_dump(meta, default_flow_style=False)
+
+    def meta(self, rng, appname):
+        meta = {
+            'appname': appname,
+            'build': dict(rng.choice(self.shapes['build'])),
+            'test': dict(rng.choice(self.shapes['test'])),
+            'notify': dict(rng.choice(self.shapes['notify'])),
+        }
+        # build.volumes does not work with release.script
+        release = rng.choice(self.shapes['release'] + [None])
+        if release is not None:
+            meta['release'] = dict(release)
+            meta['build'].pop('volumes', None)
+
+        meta['web'] = self.proc(rng, appname, 'web', web=True)
+        for i in range(_draw(rng, self.procs)):
+            kind = rng.choice(('web', 'worker', 'oneshot', 'proc'))
+            key = '%s.%s%d' % (kind, kind, i)
+            proc = self.proc(rng, appname, key, web=(kind == 'web'))
+            if kind == 'proc':
+                proc['type'] = rng.choice(('worker', 'oneshot'))
+            meta[key] = proc
+
+        for i in range(_draw(rng, self.services)):
+            service = self.proc(rng, appname, 'service.s%d' % i)
+            service['port'] = 1000 + i
+            service['portal'] = {
+                'allow_clients': rng.choice(('**', '%s-client' % appname)),
+                'cmd': './proxy -p %d' % (1000 + i),
+                'port': 4000 + i,
+                'memory': '32m',
+            }
+            env = self.gen_env(rng)
+            if env:
+                service['portal']['env'] = env
+            meta['service.s%d' % i] = service
+
+        resources = _draw(rng, self.resources)
+        if resources:
+            meta['use_resources'] = dict(
+                ('resource%d' % i, {'services': ['redis%d' % i],
+                                    'memory': '%dM' % (64 << rng.randint(0, 3)),
+                                    'num_instances': rng.randint(1, 3)})
+                for i in range(resources))
+            meta['use_services'] = dict(
+                ('service%d' % i, ['s%d' % j for j in range(rng.randint(1, 2))])
+                for i in range(resources))
+        return meta
+
+    def gen_env(self, rng):
+        # the default knob draws nothing, documents of the other knobs stay the same
+        if self.env == (0, 0):
+            return []
+        return ['KEY%d=%s' % (i, 'v' * 64) for i in range(_draw(rng, self.env))]
+
+    def proc(self, rng, appname, key, web=False):
+        proc = dict(rng.choice(self.shapes['proc']))
+        proc.setdefault('cmd', './%s' % key)
+        proc.setdefault('memory', '64m')
+        env = self.gen_env(rng)
+        if env:
+            proc['env'] = list(proc.get('env') or []) + env
+
+        if web:
+            proc['port'] = rng.choice((80, 8000, 8080))
+            proc['healthcheck'] = '/health'
+            proc['https_only'] = rng.random() < 0.5
+            mountpoints = ['/%s/v%d' % (key.replace('.', '-'), i)
+                           for i in range(_draw(rng, self.mountpoints))]
+            if key != 'web' or rng.random() < 0.5:
+                # procs named other than web must have their own domain
+                mountpoints.append('%s.%s.com' % (key.replace('.', '-'), appname))
+            if mountpoints:
+                proc['mountpoint'] = mountpoints
+
+        ports = rng.sample(range(MIN_SRC_PORT, MAX_SRC_PORT + 1), _draw(rng, self.ports))
+        if ports:
+            proc['ports'] = dict(('%d:%d/%s' % (p, p - 1000, rng.choice(('tcp', 'udp'))), {})
+                                 for p in ports)
+        if rng.random() < 0.5:
+            proc['labels'] = ['tier:%s' % rng.choice(('front', 'back'))]
+            proc['filters'] = ['constraint:group==default',
+                               'affinity:container!=~%s*' % appname]
+
+        dirs = []
+        for i in range(_draw(rng, self.volumes)):
+            path = '/data/%s/%d' % (key.replace('.', '-'), i)
+            policy = rng.choice((None, 'backup_full', 'backup_increment'))
+            if policy is None:
+                dirs.append(path)
+            else:
+                dirs.append({path: {policy: {
+                    'schedule': '0 %d * * *' % rng.randint(0, 23),
+                    'expire': '%dd' % rng.randint(1, 30),
+                    'pre_run': 'backup.sh',
+                }}})
+        if dirs:
+            proc['persistent_dirs'] = dirs
+        if rng.random() < 0.3:
+            proc['cloud_volumes'] = {'type': rng.choice(('multi', 'single')),
+                                     'dirs': ['/cloud/%s' % key.replace('.', '-')]}
+        proc['logs'] = ['%s.log' % key.replace('.', '-')]
+        return proc
+
+
+def _draw(rng, bounds):
+    low, high = bounds
+    return rng.randint(low, high)
+
+
+def _procs(meta):
+    return sorted(k for k in meta if k.split('.')[0] in ('web', 'worker', 'oneshot', 'proc'))
+
+
+def _break_yaml(meta, rng):
+    return 'appname: %s\nbuild: [\n' % meta['appname']
+
+
+def _drop_build(meta, rng):
+    del meta['build']
+
+
+def _bad_appname(meta, rng):
+    meta['appname'] = '1-%s' % meta['appname']
+
+
+def _bad_memory(meta, rng):
+    meta[rng.choice(_procs(meta))]['memory'] = '256'
+
+
+def _unknown_proc_key(meta, rng):
+    meta[rng.choice(_procs(meta))]['colour'] = 'blue'
+
+
+def _kill_timeout_too_long(meta, rng):
+    meta[rng.choice(_procs(meta))]['kill_timeout'] = 3600
+
+
+def _bad_portal(meta, rng):
+    meta['service.broken'] = {'cmd': './broken', 'portal': {'cmd': './proxy', 'colour': 'blue'}}
+
+
+def _src_port_out_of_range(meta, rng):
+    meta[rng.choice(_procs(meta))]['ports'] = {'80:80/tcp': {}}
+
+
+def _invalid_volume(meta, rng):
+    meta[rng.choice(_procs(meta))]['persistent_dirs'] = ['/lain/app']
+
+
+def _absolute_log(meta, rng):
+    meta[rng.choice(_procs(meta))]['logs'] = ['/var/log/app.log']
+
+
+def _web_without_mountpoint(meta, rng):
+    meta['web.nomountpoint'] = {'cmd': './web', 'port': 80}
+
+
+def _cloud_volume_type(meta, rng):
+    meta[rng.choice(_procs(meta))]['cloud_volumes'] = {'type': 'triple', 'dirs': ['/cloud']}
+
+
+def _bad_filter(meta, rng):
+    meta[rng.choice(_procs(meta))]['filters'] = ['group==default']
+
+
+# (name, stage, function mutating the meta in place or returning the text)
+MUTATIONS = (
+    ('break_yaml', 'yaml', _break_yaml),
+    ('drop_build', 'schema', _drop_build),
+    ('bad_appname', 'schema', _bad_appname),
+    ('bad_memory', 'schema', _bad_memory),
+    ('unknown_proc_key', 'schema', _unknown_proc_key),
+    ('kill_timeout_too_long', 'schema', _kill_timeout_too_long),
+    ('bad_portal', 'schema', _bad_portal),
+    ('src_port_out_of_range', 'load', _src_port_out_of_range),
+    ('invalid_volume', 'load', _invalid_volume),
+    ('absolute_log', 'load', _absolute_log),
+    ('web_without_mountpoint', 'load', _web_without_mountpoint),
+    ('cloud_volume_type', 'load', _cloud_volume_type),
+    ('bad_filter', 'load', _bad_filter),
+)
+
+
+def iter_stream(stream):
+    """yield the CorpusDocument written to `stream` by CorpusGenerator.write_stream"""
+    header, lines = None, []
+    for line in stream:
+        matched = STREAM_SEPARATOR.match(line.rstrip('\n'))
+        if matched is None:
+            lines.append(line)
+            continue
+        if header is not None:
+            yield _stream_document(header, lines)
+        header, lines = matched.groups(), []
+    if header is not None:
+        yield _stream_document(header, lines)
+
+
+def _stream_document(header, lines):
+    name, stage, mutation = header
+    return CorpusDocument(name, ''.join(lines),
+                          None if stage == 'None' else stage,
+                          None if mutation == 'None' else mutation)
+
+
+def sized_meta(procs=1, mountpoints=0, ports=0, volumes=0, prepare=False,
+               services=0, resources=0, env=0, appname='bench', seed=0):
+    """
+    valid lain.yaml text of `procs` procs, `web` included, and `services`
+    services with a portal each, every web proc has `mountpoints` path
+    mountpoints, every proc maps `ports` ports, has `volumes` persistent
+    dirs and `env` more env entries. There are `resources` use_resources
+    and use_services entries. build.prepare is kept only if `prepare`.
+    """
+    generator = CorpusGenerator(seed, procs=(procs - 1, procs - 1),
+                                services=(services, services),
+                                resources=(resources, resources),
+                                mountpoints=(mountpoints, mountpoints),
+                                ports=(ports, ports), volumes=(volumes, volumes),
+                                env=(env, env))
+    meta = generator.meta(random.Random('%s-sized' % seed), appname)
+    if not prepare:
+        meta['build'].pop('prepare', None)
+    return generator.dump(meta)
+
+
+def gen_domains(domains):
+    return ['lain%d.local' % i for i in range(max(domains, 1))]
+
+
+RESOURCE_META = '''
+appname: redis
+apptype: resource
+build:
+  base: golang
+  script:
+    - go build -o redis
+service.redis:
+  cmd: redis -p 3333
+  port: 3333
+  memory: "{{ memory|default('64M') }}"
+  num_instances: "{{ num_instances|default(1)|int(1) }}"
+  env:
+    - CLIENT={{ client|default('none') }}
+  portal:
+    image: registry.lain.local/proxy:release-1234567-abc
+    cmd: ./proxy
+'''
+
+
+def gen_clients(clients):
+    """(client_appname, context) of `clients` clients of RESOURCE_META"""
+    return [('client%d' % i, {'memory': '%dM' % (64 + i % 4 * 64),
+                              'num_instances': str(1 + i % 3),
+                              'client': 'client%d' % i})
+            for i in range(clients)]
+
+
+def gen_tree(root, files, dirs=10, size=256):
+    """write `files` files spread over `dirs` directories under `root`"""
+    for d in range(dirs):
+        os.makedirs(os.path.join(root, 'd%d' % d))
+    for i in range(files):
+        with open(os.path.join(root, 'd%d' % (i % dirs), 'f%d' % i), 'w') as f:
+            f.write(json.dumps(i).ljust(size))
+
+
+def gen_app_repo(root, meta):
+    """an app checkout with `meta` as lain.yaml, committed to git"""
+    with open(os.path.join(root, 'lain.yaml'), 'w') as f:
+        f.write(meta)
+    with open(os.path.join(root, '.gitignore'), 'w') as f:
+        f.write('*.o\n')
+    with open(os.devnull, 'w') as devnull:
+        for cmd in (['init', '-q'], ['add', '.'],
+                    ['-c', 'user.name=bench', '-c', 'user.email=bench@lain.local',
+                     'commit', '-q', '-m', 'init']):
+            subprocess.check_call(['git'] + cmd, cwd=root, stdout=devnull,
+                                  stderr=devnull)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(1)
+    directory = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    paths = CorpusGenerator(seed, invalid_ratio=0.1).write_files(directory, count)
+    print('%d documents written to %s' % (len(paths), directory))
+
+
+if __name__ == '__main__':
+    main()
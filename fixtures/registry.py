@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in of a docker registry v2 with a token auth server, for
+testing and measuring RegistryClient without a real registry
+
+    with StandInRegistry({'hello': ['release-1', 'prepare-0-1']}) as registry:
+        RegistryClient(registry.address, ('user', 'pass')).tag_list('hello')
+        registry.requests  # [path of every request]
+"""
+
+import json
+import base64
+import threading
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, every response has a Content-Length
+    protocol_version = 'HTTP/1.1'
+    # headers are written one by one, without this nagle delays every response
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.registry._count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=()):
+        data = json.dumps(body if body is not None else {})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        registry = self.server.registry
+        url = urlparse(self.path)
+        registry._record(url.path)
+        if url.path == '/token':
+            return self._token(registry, parse_qs(url.query))
+        if not url.path.startswith('/v2'):
+            return self._send(404)
+        if registry.auth and not registry._valid(self.headers.get('Authorization', '')):
+            challenge = 'Bearer realm="%s/token",service="lain.local"' % registry.url
+            return self._send(401, {'errors': [{'code': 'UNAUTHORIZED'}]},
+                              [('WWW-Authenticate', challenge)])
+        parts = url.path.strip('/').split('/')
+        if len(parts) >= 4 and parts[-2:] == ['tags', 'list']:
+            repository = '/'.join(parts[1:-2])
+            if repository not in registry.repositories:
+                return self._send(404, {'errors': [{'code': 'NAME_UNKNOWN'}]})
+            return self._send(200, {'name': repository,
+                                    'tags': registry.repositories[repository]})
+        self._send(200)
+
+    def _token(self, registry, query):
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic ') or \
+                base64.b64decode(header[len('Basic '):]) != '%s:%s' % registry.credentials:
+            return self._send(401)
+        token = registry._issue(query.get('scope', [''])[0])
+        body = {'token': token}
+        if registry.expires_in is not None:
+            body['expires_in'] = registry.expires_in
+        self._send(200, body)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInRegistry(object):
+    """
+    registry listening on 127.0.0.1, `repositories` is {name: [tag]}
+
+    Requests to /v2 need a token from /token if `auth` is set, tokens are
+    issued for `credentials` and stay valid until revoke_tokens().
+    """
+
+    def __init__(self, repositories=None, auth=True, credentials=('lain', 'secret'),
+                 expires_in=300):
+        self.repositories = dict(repositories or {})
+        self.auth = auth
+        self.credentials = credentials
+        self.expires_in = expires_in
+        # [path] of every request, in order
+        self.requests = []
+        self.connections = 0
+        self._tokens = set()
+        self._issued = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _record(self, path):
+        with self._lock:
+            self.requests.append(path)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _issue(self, scope):
+        with self._lock:
+            self._issued += 1
+            token = 'token-%d-%s' % (self._issued, scope)
+            self._tokens.add(token)
+        return token
+
+    def _valid(self, header):
+        with self._lock:
+            return header.startswith('Bearer ') and header[len('Bearer '):] in self._tokens
+
+    def revoke_tokens(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = []
+            self.connections = 0
+
+    @property
+    def address(self):
+        """host:port, the registry name of the image names"""
+        return '%s:%d' % self._server.server_address
+
+    @property
+    def url(self):
+        return 'http://%s' % self.address
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.registry = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+        return False
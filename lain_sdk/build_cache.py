@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import stat
+import fnmatch
+import hashlib
+import time
+import tempfile
+import threading
+
+from lain_sdk import __version__
+from .util import mkdir_p
+
+BUILD_CACHE_INDEX = 'build_cache.json'
+# files written into the context by mydocker.build itself
+GENERATED_FILES = ('Dockerfile', '.dockerignore.backup')
+# a file modified this many seconds before it was hashed or later may be
+# modified again without changing its mtime, which has a coarse granularity
+# on some filesystems (2 seconds on FAT), so it is hashed again next time
+RACY_SECONDS = 2
+
+
+class BuildCache(object):
+    """
+    Content-addressed index of built images
+
+    Entries are keyed by the digest of everything `docker build` depends on:
+    the base image id, the rendered Dockerfile, the build args and the
+    content of the build context. A key maps to the id of the image built
+    last time, if it still exists the build is skipped and the image is
+    tagged instead.
+
+    The index is kept as json in `cache_dir` (e.g. the LAIN_CACHE_DIR of
+    the app), with the digests of context files by path, size, mtime,
+    ctime and inode so unchanged files are not read again. Like the racy
+    entries of the git index, the digest of a file modified shortly before
+    it was hashed is not trusted, see RACY_SECONDS.
+    """
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, BUILD_CACHE_INDEX)
+        self._lock = threading.Lock()
+        self._images, self._files = self._read()
+        # names of the images which were cached
+        self.hits = []
+        self.misses = 0
+
+    @staticmethod
+    def key(base_id, dockerfile, build_args, context_digest):
+        payload = json.dumps([__version__, base_id, dockerfile, sorted(build_args),
+                              context_digest])
+        return hashlib.sha256(payload).hexdigest()
+
+    def lookup(self, key):
+        """id of the image built for `key` last time, None if there is none"""
+        with self._lock:
+            return self._images.get(key)
+
+    def record(self, key, image_id):
+        with self._lock:
+            self._images[key] = image_id
+            self.misses += 1
+            self._write()
+
+    def hit(self, name):
+        with self._lock:
+            self.hits.append(name)
+
+    def discard(self, key):
+        with self._lock:
+            if self._images.pop(key, None) is not None:
+                self._write()
+
+    def context_digest(self, context, ignore=()):
+        """digest of the paths, modes and contents of the files in `context`"""
+        context = os.path.realpath(context)
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(context):
+            rel_root = os.path.relpath(root, context)
+            if rel_root == '.':
+                rel_root = ''
+            dirs[:] = sorted(d for d in dirs
+                             if not _ignored(os.path.join(rel_root, d), ignore))
+            for name in sorted(files):
+                rel_path = os.path.join(rel_root, name)
+                if _ignored(rel_path, ignore) or rel_path in GENERATED_FILES:
+                    continue
+                digest.update('%s\0%s\0' % (rel_path, self._file_digest(os.path.join(root, name))))
+            for name in dirs:
+                # empty dirs are part of the context too
+                digest.update('%s/\0' % os.path.join(rel_root, name))
+        return digest.hexdigest()
+
+    def _file_digest(self, path):
+        st = os.lstat(path)
+        mode = stat.S_IMODE(st.st_mode)
+        if stat.S_ISLNK(st.st_mode):
+            return 'link:%o:%s' % (mode, os.readlink(path))
+        version = [st.st_size, st.st_mtime, st.st_ctime, st.st_ino]
+        with self._lock:
+            cached = self._files.get(path)
+        # [version, sha1, time it was hashed]
+        if cached is not None and len(cached) == 3 and cached[0] == version and \
+                max(st.st_mtime, st.st_ctime) < cached[2] - RACY_SECONDS:
+            return '%o:%s' % (mode, cached[1])
+        hashed_at = time.time()
+        sha1 = _hash_file(path)
+        with self._lock:
+            self._files[path] = [version, sha1, hashed_at]
+        return '%o:%s' % (mode, sha1)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return data.get('images', {}), data.get('files', {})
+        except (IOError, ValueError, AttributeError):
+            return {}, {}
+
+    def _write(self):
+        # files which are gone, e.g. in removed temp contexts, are dropped
+        self._files = dict((path, v) for path, v in self._files.iteritems()
+                           if os.path.exists(path))
+        data = json.dumps({'images': self._images, 'files': self._files})
+        cache_dir = os.path.dirname(self.path)
+        try:
+            mkdir_p(cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            # rename is atomic, readers never see a partial index
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+
+def _hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _ignored(rel_path, ignore):
+    return any(fnmatch.fnmatch(rel_path, pattern) for pattern in ignore)
@@ -13,12 +13,24 @@ from .yaml.util import load_template
 from .yaml.conf import DOCKER_APP_ROOT, LAIN_CACHE_DIR, PRIVATE_REGISTRY, user_config
 from .yaml.parser import LainConf
 import mydocker
+from . import timing
+from .phases import Phase, run_phases
+from .build_cache import BuildCache
 from .util import (error, warn, info, mkdir_p, rm, file_parent_dir,
-                   meta_version)
+                   meta_version, BackgroundTask)
 from subprocess import call, check_call
 
 DOMAIN_KEY = user_config.domain_key
 
+# {phase: phases whose images it is built on}
+PHASE_REQUIRES = collections.OrderedDict([
+    ('prepare', ()),
+    ('build', ('prepare', )),
+    ('release', ('build', )),
+    ('test', ('build', )),
+    ('meta', ()),
+])
+
 
 class LainYaml(object):
     """
@@ -28,10 +40,15 @@ class LainYaml(object):
     either pass in during __init__, or pass in through init_act(yaml_path)
     """
 
-    def __init__(self, lain_yaml_path=None, ignore_prepare=False):
+    def __init__(self, lain_yaml_path=None, ignore_prepare=False, use_build_cache=True):
         # lazy initialization, if only need to parse, on need to init fields
         # related to actions
         self.act = False
+        # images built already with the same base, Dockerfile and context are
+        # tagged instead of built again, see BuildCache
+        self.use_build_cache = use_build_cache
+        # BackgroundTask of the pushes going on while building
+        self._pushes = []
         self.yaml_path = lain_yaml_path
         if self.yaml_path is None:
             return
@@ -41,9 +58,10 @@ class LainYaml(object):
     def load(self, meta_yaml, meta_version=None):
         parser = LainConf()
         parser.load(meta_yaml, meta_version, None)
-        v = parser.__dict__
-        for k in v:
-            setattr(self, k, v[k])
+        # the public fields only, the reload state of LainConf is left behind
+        for k in parser.__slots__:
+            if not k.startswith('_'):
+                setattr(self, k, getattr(parser, k))
 
     def init_act(self, path, ignore_prepare=False):
         self.yaml_path = p.abspath(path)
@@ -113,18 +131,21 @@ class LainYaml(object):
             image_prefix, prepare_version, timestamp
         )
 
+    @timing.timed('lain_yaml.ensure_proper_shared_image')
     def ensure_proper_shared_image(self):
         # 在 registry 以及本地寻找合适可用的 shared prepare
         # 如果找到则保证本地和 registry 里此 image 均可用
         # 上述行为成功后返回此 prepare image name
         # 两处都没有合适的 image name 则返回 None
-        remote_images = self._get_prepare_shared_image_names(True).items()
+        # registry 和本地 docker 同时查找
+        remote_lookup = BackgroundTask(self._get_prepare_shared_image_names, True)
+        local_images = self._get_prepare_shared_image_names(False).items()
+        remote_images = remote_lookup.result().items()
         if remote_images:
             remote_latest = remote_images[0]
         else:
             remote_latest = None
 
-        local_images = self._get_prepare_shared_image_names(False).items()
         if local_images:
             local_latest = local_images[0]
         else:
@@ -138,8 +159,7 @@ class LainYaml(object):
                     raise Exception("remote prepare fetching failed.")
                 return remote_latest[1]
             elif remote_latest[0] < local_latest[0]:
-                if mydocker.push(local_latest[1]) != 0:
-                    warn("FAILED: docker push {}".format(local_latest[1]))
+                self._push_in_background(local_latest[1])
                 return local_latest[1]
             else:
                 return local_latest[1]
@@ -151,14 +171,28 @@ class LainYaml(object):
             return remote_latest[1]
         if remote_latest is None and local_latest:
             info("found shared prepare image at local.")
-            if mydocker.push(local_latest[1]) != 0:
-                warn("FAILED: docker push {}".format(local_latest[1]))
+            self._push_in_background(local_latest[1])
             return local_latest[1]
         if remote_latest is None and local_latest is None:
             warn(
                 "found no proper shared prepare image neither at local nor remote, rebuild ...")
             return None
 
+    def _push_in_background(self, name):
+        # 构建继续进行，wait_pushes 等待 push 完成
+        def push():
+            if mydocker.push(name) != 0:
+                warn("FAILED: docker push {}".format(name))
+        self._pushes.append(BackgroundTask(push))
+
+    @timing.timed('lain_yaml.wait_pushes')
+    def wait_pushes(self):
+        """wait for the pushes going on in the background"""
+        pushes, self._pushes = self._pushes, []
+        for push in pushes:
+            push.result()
+
+    @timing.timed('lain_yaml.build_prepare')
     def build_prepare(self):
         """
         :return: (True, image_name) or (False, None)
@@ -180,13 +214,12 @@ class LainYaml(object):
                 context=self.ctx, params=params, build_args=[])
             if name is None:
                 return (False, None)
-            if mydocker.push(self.img_names['prepare']) != 0:
-                warn("FAILED: docker push {}".format(
-                    self.img_names['prepare']))
+            self._push_in_background(self.img_names['prepare'])
             return (True, name)
         else:
             return (True, self.img_names['prepare'])
 
+    @timing.timed('lain_yaml.update_prepare')
     def update_prepare(self):
         """
         :return: (True, image_name) or (False, None)
@@ -209,9 +242,7 @@ class LainYaml(object):
                 context=self.ctx, params=params, build_args=[])
             if name is None:
                 return (False, None)
-            if mydocker.push(self.img_names['prepare']) != 0:
-                warn("FAILED: docker push {}".format(
-                    self.img_names['prepare']))
+            self._push_in_background(self.img_names['prepare'])
             return (True, name)
         else:
             params = {
@@ -233,6 +264,7 @@ class LainYaml(object):
 
             return (True, name)
 
+    @timing.timed('lain_yaml.build_base')
     def build_base(self, use_prepare=False):
         """
         :return: (True, image_name) or (False, None)
@@ -271,10 +303,18 @@ class LainYaml(object):
                                                 self.ctx, self.build.volumes, self.build.script)
         return (True, image_name)
 
+    @timing.timed('lain_yaml.build_release')
     def build_release(self, use_prepare=False, use_build=False):
         """
         :return: (True, image_name) or (False, None)
         """
+        try:
+            return self._build_release(use_prepare, use_build)
+        finally:
+            # prepare images pushed in the background
+            self.wait_pushes()
+
+    def _build_release(self, use_prepare, use_build):
         self._prepare_act()
         if (not use_build) and (not self.build_base(use_prepare)[0]):
             return (False, None)
@@ -330,12 +370,13 @@ class LainYaml(object):
             return (False, None)
         return (True, name)
 
-    def build_test(self):
+    @timing.timed('lain_yaml.build_test')
+    def build_test(self, use_build=False):
         """
         :return: (True, image_name) or (False, None)
         """
         self._prepare_act()
-        if not self.build_base(use_prepare=True)[0]:
+        if (not use_build) and (not self.build_base(use_prepare=True)[0]):
             return (False, None)
 
         if self.build.volumes is not None:
@@ -361,6 +402,7 @@ class LainYaml(object):
                                                 self.ctx, self.build.volumes, self.test.script)
         return (True, image_name)
 
+    @timing.timed('lain_yaml.build_meta')
     def build_meta(self):
         """
         :return: (True, image_name) or (False, None)
@@ -380,63 +422,113 @@ class LainYaml(object):
         finally:
             rm(tmp_dir)
 
+    def phase_graph(self, targets, use_prepare=False):
+        """
+        [Phase] building the images of `targets` and the images they are
+        built on, the build image is built once for release and test
+        """
+        # build_test always builds on the prepare image
+        use_prepare = use_prepare or 'test' in targets
+        funcs = {
+            'prepare': self.build_prepare,
+            'build': lambda: self.build_base(use_prepare),
+            'release': lambda: self._build_release(use_prepare, use_build=True),
+            'test': lambda: self.build_test(use_build=True),
+            'meta': self.build_meta,
+        }
+        needed, todo = set(), list(targets)
+        while todo:
+            phase = todo.pop()
+            if phase not in PHASE_REQUIRES:
+                raise Exception('unknown phase %s' % (phase, ))
+            if phase == 'prepare' and self.build.prepare is None:
+                if phase in targets:
+                    raise Exception('build.prepare not found in lain.yaml')
+                continue
+            if phase == 'prepare' and phase not in targets and not use_prepare:
+                continue
+            needed.add(phase)
+            todo.extend(PHASE_REQUIRES[phase])
+        return [Phase(name, funcs[name], tuple(r for r in requires if r in needed))
+                for name, requires in PHASE_REQUIRES.iteritems() if name in needed]
+
+    @timing.timed('lain_yaml.build_phases')
+    def build_phases(self, targets=('release', ), parallel=1, use_prepare=False):
+        """
+        build the images of `targets` in phase_graph order, up to `parallel`
+        phases at a time, the phases built on a failed one are cancelled
+
+        :return: {phase: PhaseResult}
+        """
+        self._prepare_act()
+        try:
+            return run_phases(self.phase_graph(targets, use_prepare), parallel)
+        finally:
+            self.wait_pushes()
+
     def _prepare_act(self, ignore_prepare=False):
         if self.act is True:
             return
 
-        if self.yaml_path is None:
-            raise Exception(
-                'self.yaml_path not set, can not perform action, only fields defined in lain.yaml is accessible')
+        with timing.span('lain_yaml.prepare_act'):
+            if self.yaml_path is None:
+                raise Exception(
+                    'self.yaml_path not set, can not perform action, only fields defined in lain.yaml is accessible')
 
-        if ignore_prepare is False:
-            if mydocker.pull(self.build.base) != 0:
-                raise Exception('docker pull {} failed'.format(self.build.base))
+            if ignore_prepare is False:
+                if mydocker.pull(self.build.base) != 0:
+                    raise Exception('docker pull {} failed'.format(self.build.base))
 
-            self.build_base_image = mydocker.get_image(self.build.base)
+                self.build_base_image = mydocker.get_image(self.build.base)
 
-        self.ctx = file_parent_dir(self.yaml_path)
-        self.workdir = DOCKER_APP_ROOT + '/'  # '/' is need for COPY in Dockefile
+            self.ctx = file_parent_dir(self.yaml_path)
+            self.workdir = DOCKER_APP_ROOT + '/'  # '/' is need for COPY in Dockefile
 
-        self.ignore = ['.git', LAIN_CACHE_DIR, '.vagrant']
+            self.ignore = ['.git', LAIN_CACHE_DIR, '.vagrant']
 
-        self.gen_name = partial(mydocker.gen_image_name, appname=self.appname, meta_version=meta_version(self.ctx))
+            self.gen_name = partial(mydocker.gen_image_name, appname=self.appname, meta_version=meta_version(self.ctx))
 
-        phases = ('prepare', 'build', 'release', 'test', 'meta')
-        self.img_names = {phase: self.gen_name(
-            phase=phase) for phase in phases}
-        if ignore_prepare or self.build.prepare is None:
-            shared_prepare_image_name = None
-            del self.img_names['prepare']
-            phases = filter(lambda x: x != 'prepare', phases)
-        else:
-            shared_prepare_image_name = self.ensure_proper_shared_image()
-            if shared_prepare_image_name is None:
-                if self.build.prepare.version is None:
-                    shared_prepare_image_name = self._gen_prepare_auto_version_image_name()
-                else:
-                    shared_prepare_image_name = self.gen_prepare_shared_image_name()
-
-            self.img_names['prepare'] = shared_prepare_image_name
-
-        j2temps = {
-            'prepare': 'build_dockerfile.j2',
-            'build': 'build_dockerfile.j2',
-            'release': 'release_dockerfile.j2',
-            'test': 'build_dockerfile.j2',
-            'meta': 'meta_dockerfile.j2'
-        }
-        self.img_temps = {phase: load_template(
-            j2temps[phase]) for phase in phases}
+            phases = ('prepare', 'build', 'release', 'test', 'meta')
+            self.img_names = {phase: self.gen_name(
+                phase=phase) for phase in phases}
+            if ignore_prepare or self.build.prepare is None:
+                shared_prepare_image_name = None
+                del self.img_names['prepare']
+                phases = filter(lambda x: x != 'prepare', phases)
+            else:
+                shared_prepare_image_name = self.ensure_proper_shared_image()
+                if shared_prepare_image_name is None:
+                    if self.build.prepare.version is None:
+                        shared_prepare_image_name = self._gen_prepare_auto_version_image_name()
+                    else:
+                        shared_prepare_image_name = self.gen_prepare_shared_image_name()
+
+                self.img_names['prepare'] = shared_prepare_image_name
+
+            j2temps = {
+                'prepare': 'build_dockerfile.j2',
+                'build': 'build_dockerfile.j2',
+                'release': 'release_dockerfile.j2',
+                'test': 'build_dockerfile.j2',
+                'meta': 'meta_dockerfile.j2'
+            }
+            self.img_temps = {phase: load_template(
+                j2temps[phase]) for phase in phases}
 
-        self.img_builders = {
-            phase: partial(mydocker.build, name=self.img_names[phase], ignore=self.ignore, template=self.img_temps[phase])
-            for phase in phases
-        }
+            self.build_cache = None
+            if self.use_build_cache:
+                self.build_cache = BuildCache(p.join(self.ctx, LAIN_CACHE_DIR))
+
+            self.img_builders = {
+                phase: partial(mydocker.build, name=self.img_names[phase], ignore=self.ignore, template=self.img_temps[phase],
+                               build_cache=self.build_cache)
+                for phase in phases
+            }
 
-        self.prepare_updater = partial(
-            mydocker.build, ignore=self.ignore, template=load_template('build_dockerfile.j2'))
+            self.prepare_updater = partial(
+                mydocker.build, ignore=self.ignore, template=load_template('build_dockerfile.j2'))
 
-        self.act = True
+            self.act = True
 
     def repo_meta_version(self, sha1=''):
         return meta_version(self.ctx, sha1)
@@ -9,19 +9,25 @@ import random
 import shutil
 import string
 import tempfile
-import requests
+import threading
 import subprocess
 import docker
 from jinja2 import Template
+from . import timing
 from .util import (info, error,
                    recur_create_file, rm,
-                   parse_registry_auth, get_jwt_for_registry,
-                   REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT)
+                   parse_registry_auth)
+from .registry import get_client
 from .yaml.conf import DOCKER_APP_ROOT, LAIN_CACHE_DIR
 
 
 DOCKER_BASE_URL = os.environ.get('DOCKER_HOST', '')
 
+# {realpath of a build context: lock}, builds write their Dockerfile and
+# cache files into the context, so builds in one context must not overlap
+_context_locks = {}
+_context_locks_lock = threading.Lock()
+
 # Assume `docker` can be run without `sudo`
 
 # docker_reg set through param or env LAIN_DOCKER_REGISTRY
@@ -47,17 +53,19 @@ def _docker(args, cwd=None, env=os.environ, capture_output=False, print_stdout=T
     cmd = ['docker'] + args
     env = dict(env, DOCKER_HOST='')
 
-    if capture_output:
-        try:
-            output = subprocess.check_output(
-                cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            output = e.output
-        return output
-    else:
-        retcode = subprocess.call(cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT,
-                                  stdout=(None if print_stdout else open('/dev/null', 'w')))
-        return retcode
+    with timing.span('docker.%s' % args[0]) as span:
+        if capture_output:
+            try:
+                output = subprocess.check_output(
+                    cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT)
+            except subprocess.CalledProcessError as e:
+                output = e.output
+            return output
+        else:
+            retcode = subprocess.call(cmd, env=env, cwd=cwd, stderr=subprocess.STDOUT,
+                                      stdout=(None if print_stdout else open('/dev/null', 'w')))
+            span.set(retcode=retcode)
+            return retcode
 
 
 def gen_image_name(appname, phase, meta_version=None, docker_reg=None):
@@ -84,7 +92,11 @@ def gen_dockerfile(dockerfile_path, template, dockerfile_params):
     recur_create_file(dockerfile_path)
 
     with open(dockerfile_path, 'w') as f:
-        f.write(Template(template).render(dockerfile_params))
+        f.write(render_dockerfile(template, dockerfile_params))
+
+
+def render_dockerfile(template, dockerfile_params):
+    return Template(template).render(dockerfile_params)
 
 
 def gen_dockerignore(path, ignore):
@@ -113,12 +125,9 @@ def build_image(name, context, build_args, use_cache):
 
     if build_args:
         docker_args = ['build', '-t', name]
-        for arg in build_args:
-            key, val = arg.split('=', 1)
-            if val.startswith('$'):
-                val = os.environ[val[1:]]
+        for arg in resolve_build_args(build_args):
             docker_args.append('--build-arg')
-            docker_args.append('{}={}'.format(key, val))
+            docker_args.append(arg)
         docker_args.append('.')
     retcode = _docker(docker_args, cwd=context)
     if retcode != 0:
@@ -129,24 +138,95 @@ def build_image(name, context, build_args, use_cache):
     return name
 
 
-def build(name, context, ignore, template, params, build_args, use_cache=True):
+def resolve_build_args(build_args):
+    """KEY=VALUE build args, values like $NAME are read from the environment"""
+    resolved = []
+    for arg in build_args:
+        key, val = arg.split('=', 1)
+        if val.startswith('$'):
+            val = os.environ[val[1:]]
+        resolved.append('{}={}'.format(key, val))
+    return resolved
+
+
+def context_lock(context):
+    """the lock held while building in the context dir"""
+    path = os.path.realpath(context)
+    with _context_locks_lock:
+        lock = _context_locks.get(path)
+        if lock is None:
+            lock = _context_locks[path] = threading.RLock()
+    return lock
+
+
+@timing.timed('mydocker.build')
+def build(name, context, ignore, template, params, build_args, use_cache=True,
+          build_cache=None):
+    """
+    build_cache: BuildCache, the build is skipped if the same image was
+    built already, it is not used if use_cache is False
+    """
     dockerfile_path = os.path.join(context, 'Dockerfile')
     dockerignore_path = os.path.join(context, '.dockerignore')
     dockerignore_backup = os.path.join(context, '.dockerignore.backup')
-    try:
-        gen_dockerfile(dockerfile_path, template, params)
-        gen_dockerignore(dockerignore_path, ignore)
-        name = build_image(name, context, build_args, use_cache)
-    finally:
-        for path in [dockerfile_path, dockerignore_path]:
-            if os.path.exists(path):
-                rm(path)
-        if os.path.exists(dockerignore_backup):
-            shutil.move(dockerignore_backup, dockerignore_path)
+    with context_lock(context):
+        cache_key = None
+        if build_cache is not None and use_cache:
+            cache_key = _build_cache_key(build_cache, context, ignore, template, params,
+                                         build_args)
+            if cache_key is not None and _tag_cached(build_cache, cache_key, name):
+                return name
+        try:
+            gen_dockerfile(dockerfile_path, template, params)
+            gen_dockerignore(dockerignore_path, ignore)
+            name = build_image(name, context, build_args, use_cache)
+        finally:
+            for path in [dockerfile_path, dockerignore_path]:
+                if os.path.exists(path):
+                    rm(path)
+            if os.path.exists(dockerignore_backup):
+                shutil.move(dockerignore_backup, dockerignore_path)
+        if name is not None and cache_key is not None:
+            try:
+                build_cache.record(cache_key, get_image(name).id)
+            except Exception as e:
+                info('can not record {} in the build cache: {}'.format(name, e))
     return name
 
 
+def _build_cache_key(build_cache, context, ignore, template, params, build_args):
+    # None if the base image can not be identified
+    base = params.get('base')
+    try:
+        base_id = base if base == 'scratch' else get_image(base).id
+    except Exception:
+        return None
+    with timing.span('mydocker.build_cache_key'):
+        return build_cache.key(base_id, render_dockerfile(template, params),
+                               resolve_build_args(build_args),
+                               build_cache.context_digest(context, ignore))
+
+
+def _tag_cached(build_cache, cache_key, name):
+    image_id = build_cache.lookup(cache_key)
+    if image_id is None:
+        return False
+    if not exist(image_id) or tag(image_id, name) != 0:
+        build_cache.discard(cache_key)
+        return False
+    build_cache.hit(name)
+    timing.event('mydocker.build_cache_hit', image=name)
+    info('build skipped, {} is the cached image {}'.format(name, image_id))
+    return True
+
+
+@timing.timed('mydocker.compile_by_docker')
 def compile_by_docker(build_image_name, base_image_name, context, volumes, script):
+    with context_lock(context):
+        return _compile_by_docker(build_image_name, base_image_name, context, volumes, script)
+
+
+def _compile_by_docker(build_image_name, base_image_name, context, volumes, script):
     info('building image {} ...'.format(build_image_name))
     files = subprocess.check_output(['find', '.', '-maxdepth', '1',
                            '!', '-path', './{}'.format(LAIN_CACHE_DIR),
@@ -192,6 +272,7 @@ def remove_container(container_id):
     _docker(['rm', '-f', container_id])
 
 
+@timing.timed('mydocker.copy_to_host')
 def copy_to_host(image_name, release_copy, host_dir, context=None, volumes=None):
     '''
     release_copy: release.copy in lain.yaml
@@ -343,21 +424,10 @@ def logout(registry=None):
 
 
 def get_tag_list_in_registry(registry, appname):
-    tag_list_url = "http://%s/v2/%s/tags/list" % (registry, appname)
-    need_auth, auth_url = parse_registry_auth(registry)
-    if need_auth:
-        jwt = get_jwt_for_registry(auth_url, registry, appname)
-        headers = {'Authorization': 'Bearer %s' % jwt}
-    else:
-        headers = None
-    try:
-        r = requests.get(tag_list_url, headers=headers,
-                         timeout=(REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT))
-        return r.json()['tags']
-    except:
-        return []
+    return get_client(registry).tag_list(appname)
 
 
+@timing.timed('docker.tag_list')
 def get_tag_list_in_docker_daemon(registry, appname):
     tag_list = []
     c = docker.from_env()
@@ -389,6 +459,7 @@ def get_tag_list_using_by_containers(registry, appname):
     return tag_list
 
 
+@timing.timed('docker.get_image')
 def get_image(image_name):
     c = docker.from_env()
     return c.images.get(image_name)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Running build phases as a dependency graph
+
+    results = run_phases([
+        Phase('build', lambda: lain_yaml.build_base(), ()),
+        Phase('release', lambda: lain_yaml.build_release(use_build=True), ('build', )),
+        Phase('meta', lain_yaml.build_meta, ()),
+    ], parallel=2)
+
+A phase function returns (True, value) or (False, value) like the build_*
+methods of LainYaml. A phase starts once every phase it requires is done,
+at most `parallel` phases run at a time. If a phase fails or raises, the
+phases requiring it are cancelled and the others still run.
+"""
+
+import threading
+from collections import namedtuple
+
+from . import timing
+
+# name: name of the phase
+# func: function without arguments returning (ok, value)
+# requires: names of the phases which must be done before this one starts
+Phase = namedtuple('Phase', 'name func requires')
+
+# status: DONE, FAILED or CANCELLED
+# value: second item returned by the phase function
+# error: the exception raised by the phase function (SystemExit included),
+#        None if it returned
+PhaseResult = namedtuple('PhaseResult', 'name status value error')
+
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def check_phases(phases):
+    """raise if names are duplicated, a required phase is unknown or phases require each other"""
+    names = [phase.name for phase in phases]
+    if len(set(names)) != len(names):
+        raise Exception('duplicated phases in %s' % (names, ))
+    requires = dict((phase.name, tuple(phase.requires)) for phase in phases)
+    for name, deps in requires.iteritems():
+        for dep in deps:
+            if dep not in requires:
+                raise Exception('phase %s requires unknown phase %s' % (name, dep))
+    # remove the phases without requirements left until none is left
+    left = dict(requires)
+    while left:
+        free = [name for name, deps in left.iteritems()
+                if not any(dep in left for dep in deps)]
+        if not free:
+            raise Exception('phases %s require each other' % (sorted(left), ))
+        for name in free:
+            del left[name]
+
+
+def run_phases(phases, parallel=1):
+    """
+    run the phases, started in their order once they are ready
+
+    :return: {phase name: PhaseResult}
+    """
+    if parallel < 1:
+        raise Exception('parallel should be at least 1, not %s' % (parallel, ))
+    check_phases(phases)
+    pending = list(phases)
+    running = set()
+    results = {}
+    cond = threading.Condition()
+
+    def run(phase):
+        try:
+            ok, value = phase.func()
+            result = PhaseResult(phase.name, DONE if ok else FAILED, value, None)
+        except BaseException as e:
+            # SystemExit of exit() too, the phase must leave `running`
+            result = PhaseResult(phase.name, FAILED, None, e)
+        with cond:
+            results[phase.name] = result
+            running.discard(phase.name)
+            cond.notify()
+
+    with timing.span('phases.run', parallel=parallel):
+        with cond:
+            while pending or running:
+                changed = False
+                for phase in list(pending):
+                    statuses = [results[dep].status for dep in phase.requires if dep in results]
+                    if any(status != DONE for status in statuses):
+                        pending.remove(phase)
+                        results[phase.name] = PhaseResult(phase.name, CANCELLED, None, None)
+                        timing.event('phases.cancelled', phase=phase.name)
+                        changed = True
+                    elif len(statuses) == len(phase.requires) and len(running) < parallel:
+                        pending.remove(phase)
+                        running.add(phase.name)
+                        thread = threading.Thread(target=run, args=(phase, ),
+                                                  name='phase-%s' % phase.name)
+                        thread.daemon = True
+                        thread.start()
+                        changed = True
+                if not changed:
+                    # a timeout keeps the wait interruptible by ctrl-c
+                    cond.wait(1)
+    return results
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import requests
+from requests.auth import HTTPBasicAuth
+from docker import auth
+
+from . import timing
+from .util import warn, error, REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT
+
+# only use `lain.local` as service
+TOKEN_SERVICE = 'lain.local'
+# lifetime of a token whose response has no expires_in, as in the docker token spec
+DEFAULT_TOKEN_EXPIRES_IN = 60
+# tokens are renewed this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 5
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class RegistryClient(object):
+    """
+    Client of a docker registry v2
+
+    Connections are kept alive in a requests.Session. Whether the registry
+    needs auth is probed once, tokens are cached per repository and scope
+    until they expire, so listing tags again costs one request.
+
+        client = get_client('registry.lain.local')
+        tags = client.tag_list('hello')
+
+    `round_trips` counts the http requests sent.
+    """
+
+    def __init__(self, registry, credentials=None):
+        """credentials: (username, password), read from the docker config if it is None"""
+        self.registry = registry
+        self.session = requests.Session()
+        self.timeout = (REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT)
+        self.round_trips = 0
+        self._credentials = credentials
+        self._challenge = None
+        # {(repository, scope, auth_url): (token, expire time)}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def _get(self, url, **kwargs):
+        with self._lock:
+            self.round_trips += 1
+        with timing.span('registry.request', registry=self.registry):
+            return self.session.get(url, timeout=self.timeout, **kwargs)
+
+    def challenge(self):
+        """(need_auth, auth_url) of the registry, it is probed only once"""
+        if self._challenge is not None:
+            return self._challenge
+        try:
+            r = self._get("http://%s/v2" % self.registry)
+        except Exception:
+            warn("can not access registry : %s" % self.registry)
+            # an unreachable registry is not probed again by this client
+            self._challenge = (False, '')
+            return self._challenge
+        need_auth = r.status_code == 401
+        self._challenge = (need_auth, _get_registry_auth_url(r) if need_auth else '')
+        return self._challenge
+
+    def credentials(self):
+        # get auth username and password from dockercfg
+        if self._credentials is None:
+            cfg = auth.resolve_authconfig(auth.load_config(), registry=self.registry)
+            username = cfg['username'] if 'username' in cfg else cfg['Username']
+            password = cfg['password'] if 'password' in cfg else cfg['Password']
+            self._credentials = (username, password)
+        return self._credentials
+
+    def token(self, repository, scope='push,pull', auth_url=None):
+        """
+        a jwt for `scope` of the repository, '' if it can not be got
+
+        auth_url: url of the token server, the one the registry challenges
+        with is used if it is None
+        """
+        key = (repository, scope, auth_url)
+        with self._lock:
+            cached = self._tokens.get(key)
+        if cached is not None and cached[1] > time.time():
+            return cached[0]
+        if auth_url is None:
+            need_auth, auth_url = self.challenge()
+            if not need_auth:
+                return ''
+        try:
+            username, password = self.credentials()
+            url = "%s?service=%s&scope=repository:%s:%s&account=%s" % (
+                auth_url, TOKEN_SERVICE, repository, scope, username)
+            response = self._get(url, auth=HTTPBasicAuth(username, password))
+            if response.status_code < 400 and response.json()['token']:
+                data = response.json()
+                expires_in = data.get('expires_in') or DEFAULT_TOKEN_EXPIRES_IN
+                with self._lock:
+                    self._tokens[key] = (data['token'],
+                                         time.time() + expires_in - TOKEN_EXPIRY_MARGIN)
+                return data['token']
+        except Exception as e:
+            warn("can not load registry auth config : %s, need lain login first." % e)
+        return ''
+
+    def forget_token(self, repository, scope='push,pull', auth_url=None):
+        with self._lock:
+            self._tokens.pop((repository, scope, auth_url), None)
+
+    def get(self, path, repository, scope='push,pull'):
+        """GET http://registry/v2/`path` with a token of the repository if it is needed"""
+        url = "http://%s/v2/%s" % (self.registry, path)
+        for retry in (False, True):
+            headers = None
+            if self.challenge()[0]:
+                headers = {'Authorization': 'Bearer %s' % self.token(repository, scope)}
+            r = self._get(url, headers=headers)
+            # the token was revoked or the registry was restarted
+            if r.status_code != 401 or retry:
+                return r
+            self.forget_token(repository, scope)
+            self._challenge = None
+
+    def close(self):
+        self.session.close()
+
+    @timing.timed('registry.tag_list')
+    def tag_list(self, repository):
+        try:
+            return self.get('%s/tags/list' % repository, repository).json()['tags']
+        except Exception:
+            return []
+
+
+# auth header example:
+# WWW-Authenticate: Bearer realm="url",Service="domain"
+def _get_registry_auth_url(response):
+    try:
+        auth_header = response.headers['WWW-Authenticate']
+        params = auth_header.split(',')
+        auth_url = params[0].split('=')[1]
+        return auth_url[1:len(auth_url) - 1]
+    except Exception as e:
+        error("parse registry auth url failed: %s" % str(e))
+        return ''
+
+
+def get_client(registry):
+    """the RegistryClient shared by every caller using `registry`"""
+    with _clients_lock:
+        client = _clients.get(registry)
+        if client is None:
+            client = _clients[registry] = RegistryClient(registry)
+    return client
+
+
+def clear_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
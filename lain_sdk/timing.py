@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timing spans and events of parsing and building
+
+    collector = timing.MemorySink()
+    with timing.collect(collector):
+        LainYaml('lain.yaml').build_release()
+    print(collector.report())
+
+Spans and events are sent to every installed sink. Nothing is recorded
+if no sink is installed, a span is then a shared no-op context manager
+and a `timed` function only pays for checking the sink list.
+"""
+
+import sys
+import json
+import time
+import threading
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+# kind: 'span' or 'event'
+# name: dotted name of the step, e.g. 'docker.build'
+# start: time.time() when the span started or the event happened
+# duration: seconds the span lasted, 0 for events
+# depth: number of spans this one is nested in, in the same thread
+# attrs: dict of extra information, `error` is the exception class name
+#        if the span was left by an exception
+TimingRecord = namedtuple('TimingRecord', 'kind name start duration depth attrs')
+
+_sinks = []
+_local = threading.local()
+
+
+def add_sink(sink):
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def enabled():
+    return bool(_sinks)
+
+
+@contextmanager
+def collect(*sinks):
+    """install `sinks` in this block"""
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield sinks
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+            close = getattr(sink, 'close', None)
+            if close is not None:
+                close()
+
+
+def _emit(record):
+    for sink in list(_sinks):
+        sink.record(record)
+
+
+def _depth():
+    return getattr(_local, 'depth', 0)
+
+
+class _NoopSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span(object):
+
+    __slots__ = ('name', 'attrs', 'start', 'depth')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.depth = _depth()
+        _local.depth = self.depth + 1
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.time() - self.start
+        _local.depth = self.depth
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _emit(TimingRecord('span', self.name, self.start, duration, self.depth, self.attrs))
+        return False
+
+    def set(self, **attrs):
+        """add attrs known only inside the span"""
+        self.attrs.update(attrs)
+
+
+def span(name, **attrs):
+    """context manager timing the block as a span named `name`"""
+    if not _sinks:
+        return _NOOP_SPAN
+    return _Span(name, attrs)
+
+
+def event(name, **attrs):
+    if _sinks:
+        _emit(TimingRecord('event', name, time.time(), 0, _depth(), attrs))
+
+
+def timed(name):
+    """decorator timing every call of the function as a span named `name`"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_attrs(attrs):
+    return ' '.join('%s=%s' % kv for kv in sorted(attrs.items()))
+
+
+def format_record(record):
+    line = '%s%s' % ('  ' * record.depth, record.name)
+    if record.kind == 'span':
+        line = '%-48s %9.3fs' % (line, record.duration)
+    if record.attrs:
+        line = '%s  %s' % (line, _format_attrs(record.attrs))
+    return line
+
+
+class LogSink(object):
+    """write a line for every span and event to `stream`"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def record(self, record):
+        stream = self.stream or sys.stderr
+        stream.write('timing: %s\n' % format_record(record).strip())
+        stream.flush()
+
+
+class JsonSink(object):
+    """append a json line for every span and event to the file at `path`"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        line = json.dumps(record._asdict(), sort_keys=True)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class MemorySink(object):
+    """keep every span and event in `records`"""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def clear(self):
+        with self._lock:
+            del self.records[:]
+
+    def spans(self, name=None):
+        return [r for r in self.records
+                if r.kind == 'span' and (name is None or r.name == name)]
+
+    def summary(self):
+        """{span name: (count, total seconds, max seconds)} in order of first start"""
+        summary = OrderedDict()
+        for r in sorted(self.spans(), key=lambda r: r.start):
+            count, total, longest = summary.get(r.name, (0, 0.0, 0.0))
+            summary[r.name] = (count + 1, total + r.duration, max(longest, r.duration))
+        return summary
+
+    def report(self):
+        """spans and events as a tree in the order they started, then totals by name"""
+        lines = ['timings:']
+        # a parent starts before its children, ties are broken by depth
+        for r in sorted(self.records, key=lambda r: (r.start, r.depth)):
+            lines.append('  %s' % format_record(r))
+        lines += ['', 'totals:',
+                  '  %-46s %6s %10s %10s' % ('span', 'count', 'total', 'max')]
+        summary = self.summary()
+        for name in sorted(summary, key=lambda n: -summary[n][1]):
+            count, total, longest = summary[name]
+            lines.append('  %-46s %6d %9.3fs %9.3fs' % (name, count, total, longest))
+        return '\n'.join(lines)
@@ -3,16 +3,17 @@
 
 import logging
 import os
+import re
 import copy
+import sys
+import threading
 from sys import stderr, stdout
 import errno
 import subprocess
 import shutil
-import requests
-from requests.auth import HTTPBasicAuth
 import time
+from . import timing
 from .yaml.conf import user_config
-from docker import auth
 
 
 # copied from HongQN
@@ -100,6 +101,7 @@ def mkdir_p(path):
             raise
 
 
+@timing.timed('git.meta_version')
 def meta_version(repo_dir, sha1=''):
     if sha1:
         git_cmd = ['git', 'log', '-1', sha1, '--pretty=format:%ct-%H']
@@ -121,56 +123,70 @@ REGISTRY_READ_TIMEOUT = 5
 
 
 def parse_registry_auth(registry):
-    need_auth, auth_url = False, ''
-    registry_url = "http://%s/v2" % registry
-    try:
-        r = requests.get(registry_url, timeout=(
-            REGISTRY_CONNECT_TIMEOUT, REGISTRY_READ_TIMEOUT))
-        need_auth = r.status_code == 401
-        if need_auth:
-            auth_url = _get_registry_auth_url(r)
-        return need_auth, auth_url
-    except Exception:
-        warn("can not access registry : %s" % registry)
-        return False, ''
-
-
-# auth header example:
-# WWW-Authenticate: Bearer realm="url",Service="domain"
-def _get_registry_auth_url(response):
-    try:
-        auth_header = response.headers['WWW-Authenticate']
-        params = auth_header.split(',')
-        auth_url = params[0].split('=')[1]
-        return auth_url[1:len(auth_url) - 1]
-    except Exception as e:
-        error("parse registry auth url failed: %s" % str(e))
-        return ''
+    """(need_auth, auth_url) of the registry, probed once per process"""
+    from .registry import get_client
+    return get_client(registry).challenge()
 
 
 def get_jwt_for_registry(auth_url, registry, appname):
-    # get auth username and password from dockercfg
-    try:
-        cfg = auth.resolve_authconfig(auth.load_config(), registry=registry)
-        username = cfg['username'] if 'username' in cfg else cfg['Username']
-        password = cfg['password'] if 'password' in cfg else cfg['Password']
-        # phase, phase_config = get_phase_config_from_registry(registry)
-        # domain = phase_config.get(user_config.domain_key, '')
-        # only use `lain.local` as service
-        url = "%s?service=%s&scope=repository:%s:push,pull&account=%s" % (
-            auth_url, "lain.local", appname, username)
-        response = requests.get(url, auth=HTTPBasicAuth(username, password))
-        if response.status_code < 400 and response.json()['token']:
-            return response.json()['token']
-    except Exception as e:
-        warn("can not load registry auth config : %s, need lain login first." % e)
-        return ''
+    """
+    a push,pull jwt of the app from the token server at `auth_url`, cached
+    until it expires, the registry is probed for it if `auth_url` is empty
+    """
+    from .registry import get_client
+    return get_client(registry).token(appname, auth_url=auth_url or None)
 
 
 def lain_based_path(path, base='/lain/app'):
     return os.path.normpath(os.path.join(base, path))
 
 
+# an absolute path is normalized already unless it has one of these
+_NOT_NORMALIZED = re.compile(r'(^|/)\.\.?(/|$)|//|/$')
+
+
+def lain_based_paths(paths, base='/lain/app'):
+    """lain_based_path of every path, only the joined paths which are not normalized go to normpath"""
+    ret = []
+    for path in paths:
+        path = os.path.join(base, path)
+        if not path.startswith('/') or _NOT_NORMALIZED.search(path):
+            path = os.path.normpath(path)
+        ret.append(path)
+    return ret
+
+
+class BackgroundTask(object):
+    """
+    func(*args, **kwargs) running in a thread, result() waits for it and
+    returns what it returned or raises what it raised
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(func, args, kwargs),
+                                        name=getattr(func, '__name__', 'background'))
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except BaseException:
+            self._exc_info = sys.exc_info()
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def result(self):
+        # join with a timeout keeps the wait interruptible by ctrl-c
+        while self._thread.is_alive():
+            self._thread.join(1)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
 def get_phase_config_from_registry(registry):
     etc = user_config.get_config()
     for k, v in etc.iteritems():
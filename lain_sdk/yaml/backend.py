@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import yaml
+
+# every yaml load and dump in lain_sdk goes through here.
+# use libyaml based loader and dumpers if PyYAML is built with libyaml,
+# otherwise fall back to the pure python ones. The C classes share their
+# constructors and representers with the python ones, so the loaded data
+# and the dumped text stay the same.
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CDumper as Dumper
+    LIBYAML = True
+except ImportError:
+    from yaml import SafeLoader, SafeDumper, Dumper
+    LIBYAML = False
+
+
+def safe_load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def safe_dump(data, stream=None, **kwds):
+    return yaml.dump_all([data], stream, Dumper=SafeDumper, **kwds)
+
+
+def dump(data, stream=None, **kwds):
+    return yaml.dump_all([data], stream, Dumper=Dumper, **kwds)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from multiprocessing import Pool
+
+from .parser import LainConf, ResourceTemplate
+from .validator import parse_and_validate
+
+DEFAULT_CHUNKSIZE = 8
+
+# index: position of the item in the input of load_many
+# conf: the loaded LainConf, None if failed
+# errors: list of error messages, empty if succeeded, validation errors are
+#         prefixed by the json pointer of the invalid value
+LoadResult = namedtuple('LoadResult', 'index conf errors')
+
+
+def load_one(index, meta_yaml, meta_version, cluster_config=None, validate_meta=True):
+    cluster_config = dict(cluster_config or {})
+    default_image = cluster_config.pop('default_image', None)
+    if validate_meta:
+        conf, errors = parse_and_validate(meta_yaml, meta_version, default_image,
+                                          **cluster_config)
+        return LoadResult(index, conf, [('%s: %s' % (path, msg)) if path else msg
+                                        for path, msg in errors])
+    try:
+        conf = LainConf()
+        conf.load(meta_yaml, meta_version, default_image, **cluster_config)
+        return LoadResult(index, conf, [])
+    except Exception as e:
+        return LoadResult(index, None, [str(e)])
+
+
+def _load_task(task):
+    return load_one(*task)
+
+
+def load_many(items, processes=None, chunksize=DEFAULT_CHUNKSIZE, validate_meta=True):
+    """
+    Parse and validate many lain.yaml across a process pool
+
+    `items` is an iterable of (meta_yaml, meta_version, cluster_config),
+    `cluster_config` takes the keyword arguments of `LainConf.load` and
+    an optional `default_image`.
+
+    Yield a LoadResult for every item as soon as it is done, so results come
+    in completion order, use `LoadResult.index` to match them to the input.
+    A failed item yields a result with its errors instead of aborting the
+    batch.
+
+    `processes` defaults to the number of cpus, 1 loads in this process.
+    """
+    tasks = ((index, meta_yaml, meta_version, cluster_config, validate_meta)
+             for index, (meta_yaml, meta_version, cluster_config) in enumerate(items))
+    return _imap_unordered(_load_task, tasks, processes, chunksize)
+
+
+class _ResourceRenderer(object):
+
+    def __init__(self, resource_appname, resource_meta_version,
+                 resource_meta_template, registry, domains):
+        self.resource_appname = resource_appname
+        self.resource_meta_version = resource_meta_version
+        self.template = ResourceTemplate(resource_meta_template)
+        self.registry = registry
+        self.domains = domains
+
+    def __call__(self, client):
+        client_appname, context = client
+        _, instance_meta = self.template.render_instance(
+            self.resource_appname, self.resource_meta_version, client_appname,
+            context, self.registry, self.domains)
+        return client_appname, instance_meta
+
+
+# renderer of a render_resource_instances worker process
+_worker_renderer = None
+
+
+def _init_worker_renderer(*args):
+    global _worker_renderer
+    _worker_renderer = _ResourceRenderer(*args)
+
+
+def _render_resource_task(client):
+    return _worker_renderer(client)
+
+
+def render_resource_instances(resource_appname, resource_meta_version, resource_meta_template,
+                              clients, registry, domains, processes=1,
+                              chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Render the resource instance of many client apps
+
+    `clients` is an iterable of (client_appname, context). The resource
+    template is parsed and compiled once (once per worker process if
+    `processes` is not 1), then rendered for every client.
+
+    Yield (client_appname, instance_yaml) as soon as each one is rendered.
+    """
+    args = (resource_appname, resource_meta_version, resource_meta_template,
+            registry, domains)
+    if processes == 1:
+        renderer = _ResourceRenderer(*args)
+        return (renderer(client) for client in clients)
+    return _imap_unordered(_render_resource_task, clients, processes, chunksize,
+                           _init_worker_renderer, args)
+
+
+def _imap_unordered(func, tasks, processes, chunksize, initializer=None, initargs=()):
+    if processes == 1:
+        for task in tasks:
+            yield func(task)
+        return
+
+    pool = Pool(processes, initializer, initargs)
+    try:
+        for result in pool.imap_unordered(func, tasks, chunksize):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+from lain_sdk import __version__
+from .conf import PRIVATE_REGISTRY, DOMAIN
+from .parser import LainConf
+from ..util import mkdir_p
+
+DEFAULT_PARSE_CACHE_CAPACITY = 256
+PARSE_CACHE_SUBDIR = 'parse'
+# bump it on incompatible changes of the entries or of LainConf.to_dict
+PARSE_CACHE_FORMAT_VERSION = 2
+
+
+class ParseCache(object):
+    """
+    Content-addressed cache of parsed lain.yaml
+
+    Entries are keyed by the digest of everything `LainConf.load` depends on
+    and by PARSE_CACHE_FORMAT_VERSION, so the same text with the same
+    cluster config is only parsed once. Entries are kept as the json of
+    `LainConf.to_dict`, every hit rebuilds an independent LainConf by
+    `LainConf.from_dict`, which is safe to patch and to reload.
+
+    If `cache_dir` is set (e.g. LAIN_CACHE_DIR), entries are also written
+    under `cache_dir/parse` and shared with other processes using the same
+    directory. Entries are plain data, a broken or forged entry can only
+    give a wrong LainConf, it can not run code.
+    """
+
+    def __init__(self, capacity=DEFAULT_PARSE_CACHE_CAPACITY, cache_dir=None):
+        if capacity < 1:
+            raise Exception('parse cache capacity should be positive: %s' % capacity)
+        self.capacity = capacity
+        self.cache_dir = None
+        if cache_dir is not None:
+            self.cache_dir = os.path.join(cache_dir, PARSE_CACHE_SUBDIR)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(meta_yaml, meta_version, default_image, **cluster_config):
+        # only registry and domains of cluster_config are used by LainConf.load
+        registry = cluster_config.get('registry', PRIVATE_REGISTRY)
+        domains = cluster_config.get('domains', [DOMAIN])
+        payload = json.dumps([PARSE_CACHE_FORMAT_VERSION, __version__, meta_yaml,
+                              meta_version, default_image, registry, domains])
+        return hashlib.sha256(payload).hexdigest()
+
+    def load(self, meta_yaml, meta_version, default_image, **cluster_config):
+        key = self.key(meta_yaml, meta_version, default_image, **cluster_config)
+        data = self._entries.pop(key, None)
+        on_disk = data is None
+        if on_disk:
+            data = self._read_disk(key)
+        if data is not None:
+            try:
+                entry = json.loads(data)
+                conf = LainConf.from_dict(entry['conf'])
+                conf._loaded_from(meta_yaml, default_image, cluster_config,
+                                  entry['proc_sections'])
+            except Exception:
+                # broken entry, e.g. written by hand or by an incompatible version
+                self._discard(key)
+            else:
+                if on_disk:
+                    self.disk_hits += 1
+                self.hits += 1
+                self._put(key, data)
+                return conf
+
+        self.misses += 1
+        conf = LainConf()
+        conf.load(meta_yaml, meta_version, default_image, **cluster_config)
+        data = json.dumps({'conf': conf.to_dict(), 'proc_sections': conf._proc_sections},
+                          separators=(',', ':'))
+        self._put(key, data)
+        self._write_disk(key, data)
+        return conf
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'capacity': self.capacity,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, key, data):
+        self._entries[key] = data
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _discard(self, key):
+        self._entries.pop(key, None)
+        if self.cache_dir is not None:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, '%s.json' % key)
+
+    def _read_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key)) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _write_disk(self, key, data):
+        if self.cache_dir is None:
+            return
+        try:
+            mkdir_p(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            # rename is atomic, readers never see a partial entry
+            os.rename(tmp_path, self._disk_path(key))
+        except (IOError, OSError):
+            pass
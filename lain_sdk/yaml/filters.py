@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compiled proc filters and the matching of procs to nodes
+
+A filter like `constraint:group==default` is compiled once into a
+FilterPredicate. Nodes are indexed by label key and value, so a predicate
+selects its nodes by looking up the index and the filters of a proc are
+matched by intersecting node sets instead of checking every node.
+
+The value of a filter is matched exactly, as a glob if it has `*`, `?` or
+`[`, or as a regular expression if it is written as `/regexp/`. A value
+starting with `~` makes the filter soft, it is ignored if no node is left
+with it, like swarm does.
+"""
+
+import re
+from fnmatch import fnmatchcase
+from collections import namedtuple
+
+FILTER_PATTERN = re.compile(r'(affinity|constraint):(\S+)(==|!=)(\S+)')
+GLOB_CHARS = re.compile(r'[*?[]')
+
+# every node has its name as the value of this label
+NODE_NAME_LABEL = 'node'
+
+# kind: 'constraint' or 'affinity'
+# key: label key
+# op: '==' or '!='
+# value: the value without the soft mark
+# soft: whether the filter is ignored if it leaves no node
+FilterPredicate = namedtuple('FilterPredicate', 'kind key op value soft')
+
+_compiled_filters = {}
+
+
+def compile_filter(text):
+    predicate = _compiled_filters.get(text)
+    if predicate is None:
+        m = FILTER_PATTERN.match(text)
+        if not m:
+            raise Exception('not supported labels desc %s' % (text, ))
+        kind, key, op, value = m.groups()
+        soft = value.startswith('~')
+        if soft:
+            value = value[1:]
+        predicate = _compiled_filters[text] = FilterPredicate(kind, key, op, value, soft)
+    return predicate
+
+
+def compile_filters(texts):
+    return tuple(compile_filter(text) for text in texts)
+
+
+def _value_matcher(value):
+    # function telling whether a label value matches `value`, None if it
+    # matches the exact value only
+    if len(value) > 1 and value.startswith('/') and value.endswith('/'):
+        return re.compile(value[1:-1]).search
+    if GLOB_CHARS.search(value):
+        return lambda v: fnmatchcase(v, value)
+    return None
+
+
+class NodeIndex(object):
+    """
+    Nodes indexed by label key and value
+
+    `nodes` is {node name: {label key: value or list of values}}, a list
+    is for labels with many values per node, e.g. the containers or images
+    of the node for affinity filters.
+    """
+
+    def __init__(self, nodes=None):
+        self._nodes = {}
+        # {label key: {label value: set of node names}}
+        self._index = {}
+        self._all = set()
+        self._cache = {}
+        for name, labels in sorted((nodes or {}).items()):
+            self.add_node(name, labels)
+
+    def __len__(self):
+        return len(self._all)
+
+    def __contains__(self, name):
+        return name in self._all
+
+    def _label_items(self, name, labels):
+        yield NODE_NAME_LABEL, name
+        for key, value in labels.iteritems():
+            if isinstance(value, (list, tuple, set, frozenset)):
+                for v in value:
+                    yield key, str(v)
+            else:
+                yield key, str(value)
+
+    def add_node(self, name, labels):
+        """add the node, or replace its labels if it is in the index already"""
+        self.remove_node(name)
+        self._nodes[name] = labels
+        self._all.add(name)
+        for key, value in self._label_items(name, labels):
+            self._index.setdefault(key, {}).setdefault(value, set()).add(name)
+        self._cache.clear()
+
+    def remove_node(self, name):
+        labels = self._nodes.pop(name, None)
+        if labels is None:
+            return
+        self._all.discard(name)
+        for key, value in self._label_items(name, labels):
+            values = self._index[key]
+            values[value].discard(name)
+            if not values[value]:
+                del values[value]
+            if not values:
+                del self._index[key]
+        self._cache.clear()
+
+    def _nodes_with(self, key, value):
+        # names of the nodes whose label `key` matches `value`
+        values = self._index.get(key, {})
+        matcher = _value_matcher(value)
+        if matcher is None:
+            return values.get(value, set())
+        matched = set()
+        for v, names in values.iteritems():
+            if matcher(v):
+                matched |= names
+        return matched
+
+    def select(self, predicates):
+        """
+        names of the nodes satisfying every predicate, as a frozenset
+
+        Hard predicates are applied before soft ones, soft predicates are
+        applied in order and skipped if they would leave no node.
+        """
+        predicates = tuple(predicates)
+        selected = self._cache.get(predicates)
+        if selected is not None:
+            return selected
+        candidates = self._all
+        for soft in (False, True):
+            for p in predicates:
+                if p.soft != soft:
+                    continue
+                nodes = self._nodes_with(p.key, p.value)
+                narrowed = candidates & nodes if p.op == '==' else candidates - nodes
+                if narrowed or not soft:
+                    candidates = narrowed
+        selected = self._cache[predicates] = frozenset(candidates)
+        return selected
+
+    def match(self, filters):
+        """names of the nodes a proc with `filters` can run on, as a frozenset"""
+        return self.select(compile_filters(filters))
+
+    def match_procs(self, procs):
+        """
+        {proc name: frozenset of node names} for Proc objects or
+        (proc name, filters) pairs, procs with the same filters are only
+        matched once
+        """
+        matched = {}
+        for proc in procs:
+            if isinstance(proc, tuple):
+                name, filters = proc
+            else:
+                name, filters = proc.name, proc.filters
+            matched[name] = self.match(filters)
+        return matched
@@ -2,17 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import re
-import yaml
-from jinja2 import Template
+import hashlib
+from jinja2 import Environment, Template
+from jinja2.utils import LRUCache
 import json
-import copy
 import os
 from enum import Enum
-from os.path import abspath
+from collections import namedtuple
 
+from .. import timing
 from ..mydocker import gen_image_name
+from . import backend
+from .filters import FILTER_PATTERN, compile_filter
 from .conf import PRIVATE_REGISTRY, DOMAIN, DOCKER_APP_ROOT
-from ..util import lain_based_path
+from ..util import lain_based_paths
 
 SOCKET_TYPES = 'tcp udp'
 SocketType = Enum('SocketType', SOCKET_TYPES)
@@ -23,11 +26,20 @@ DEFAULT_SYSTEM_VOLUMES = [
     "/data/lain/entrypoint:/lain/entrypoint:ro", "/etc/localtime:/etc/localtime:ro"]
 VALID_PREPARE_VERSION_PATERN = re.compile(r'^[a-zA-Z0-9]+$')
 INVALID_APPNAMES = ('service', 'resource', 'portal')
-INVALID_VOLUMES = ('/', '/lain', DOCKER_APP_ROOT)
+INVALID_VOLUMES = frozenset(['/', '/lain', DOCKER_APP_ROOT])
 MIN_SETUP_TIME = 0
 MAX_SETUP_TIME = 120
 MIN_KILL_TIMEOUT = 10
 MAX_KILL_TIMEOUT = 60
+TEMPLATE_CACHE_SIZE = 1024
+# a scalar needs jinja only if it has jinja syntax, line breaks which jinja
+# normalizes, or non ascii characters
+NON_LITERAL_PATTERN = re.compile(r'[{\n\r\x0b\x0c\x1c-\x1e]|[^\x00-\x7f]')
+# a path needs simplify_path only if it has `..` or empty parts
+NOT_SIMPLE_PATH_PATTERN = re.compile(r'(^|/)\.\.(/|$)|//')
+
+_jinja_env = Environment()
+_template_cache = LRUCache(TEMPLATE_CACHE_SIZE)
 
 
 def restrict_value(v, minv, maxv):
@@ -83,16 +95,121 @@ def join_path(pathlist):
 
 
 def parse_path(paths):
+    """
+    add DOCKER_APP_ROOT to relative paths and drop `..`, like
+    join_path(simplify_path(split_path(path))) for every path, a trailing `/`
+    and `.` are kept
+    """
     ret = []
     for item in paths:
-        ret.append(join_path(simplify_path(split_path(os.path.join(DOCKER_APP_ROOT,
-                                                                   item)))))
+        path = os.path.join(DOCKER_APP_ROOT, item)
+        if NOT_SIMPLE_PATH_PATTERN.search(path):
+            parts = path.split('/')
+            last = parts.pop()
+            plist = []
+            for part in parts:
+                if part == '..':
+                    if plist:
+                        plist.pop()
+                elif part:
+                    plist.append(part)
+            if last == '..':
+                if plist:
+                    plist.pop()
+            elif last or plist:
+                plist.append(last)
+            path = '/' + '/'.join(plist)
+        ret.append(path)
     return ret
 
 
+def invalid_volumes(paths):
+    """the paths which are one of INVALID_VOLUMES once based on DOCKER_APP_ROOT"""
+    based = lain_based_paths([path.strip() for path in paths], DOCKER_APP_ROOT)
+    return [path for path, abs_path in zip(paths, based) if abs_path in INVALID_VOLUMES]
+
+
 def validate_volume(path):
-    _path = os.path.join(DOCKER_APP_ROOT, path.strip())
-    return not abspath(_path) in INVALID_VOLUMES
+    return not invalid_volumes([path])
+
+
+def _to_data(value):
+    if isinstance(value, _ValueObject):
+        return value.to_dict()
+    elif isinstance(value, Enum):
+        return value.name
+    elif isinstance(value, dict):
+        return dict((k, _to_data(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [_to_data(v) for v in value]
+    return value
+
+
+def _copy_attr(value):
+    if isinstance(value, _ValueObject):
+        return value.__copy__()
+    elif isinstance(value, dict):
+        return dict((k, _copy_attr(v) if isinstance(v, _ValueObject) else v)
+                    for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _copy_meta(value):
+    # lists and dicts of lain.yaml are copied all the way down before they
+    # are kept, so changing a parsed section never changes the yaml it came from
+    if isinstance(value, dict):
+        return dict((k, _copy_meta(v)) for k, v in value.iteritems())
+    elif isinstance(value, list):
+        return [_copy_meta(v) for v in value]
+    return value
+
+
+class _ValueObject(object):
+    # parsed sections of lain.yaml, defaults are set per instance in __init__
+    __slots__ = ()
+
+    def __copy__(self):
+        # containers are copied one level deep and nested value objects are
+        # copied too, so patching the copy never touches the original
+        obj = self.__class__.__new__(self.__class__)
+        for k in self.__slots__:
+            setattr(obj, k, _copy_attr(getattr(self, k)))
+        return obj
+
+    copy = __copy__
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
+
+    def to_dict(self):
+        # plain dict of the public fields, which can be encoded as json or msgpack
+        return dict((k, _to_data(getattr(self, k))) for k in _public_fields(self.__class__))
+
+    @classmethod
+    def from_dict(cls, data):
+        # fields missing in data keep their defaults, unknown ones are ignored
+        obj = cls()
+        for k in _public_fields(cls):
+            if k in data:
+                setattr(obj, k, data[k])
+        return obj
+
+
+_PUBLIC_FIELDS = {}
+
+
+def _public_fields(cls):
+    fields = _PUBLIC_FIELDS.get(cls)
+    if fields is None:
+        fields = _PUBLIC_FIELDS[cls] = tuple(
+            k for k in cls.__slots__ if not k.startswith('_'))
+    return fields
 
 
 class Labels:
@@ -118,7 +235,7 @@ class Labels:
 
 class Filters:
     SECTION_KEYWORDS = Enum('SECTION_KEYWORDS', 'filters')
-    patten = re.compile(r'(affinity|constraint):(\S+)(==|!=)(\S+)')
+    patten = FILTER_PATTERN
 
     def load(self, meta):
         self.filters = []
@@ -138,10 +255,9 @@ class Filters:
             self.filters.append('constraint:group==default')
 
     def parse(self, meta):
-        m = self.patten.match(meta)
-        if m:
-            return meta
-        raise Exception('not supported labels desc %s' % (meta, ))
+        # raise if the filter can not be compiled, see filters.NodeIndex
+        compile_filter(meta)
+        return meta
 
 
 class Ports:
@@ -151,7 +267,7 @@ class Ports:
 
     def load(self, meta):
         self.ports = []
-        self.src_port = []
+        self.src_port = set()
         if isinstance(meta, str):
             src_port, dst_port, proto = self.parse(meta)
             port_mapping = {'srcport': src_port,
@@ -189,7 +305,7 @@ class Ports:
         if src_port in self.src_port:
             raise Exception('cant bind src port to many dst ports %s' %
                             (meta, ))
-        self.src_port.append(src_port)
+        self.src_port.add(src_port)
         dst_port = self.valid_port(dst_port)
         if dst_port < 1 or dst_port > 65535:
             raise Exception('dst port should between %s and %s' % (1, 65535))
@@ -203,10 +319,13 @@ class Ports:
         return port
 
 
-class Port:
+class Port(_ValueObject):
     SECTION_KEYWORDS = Enum('SECTION_KEYWORDS', 'port')
-    port = 80
-    type = SocketType.tcp
+    __slots__ = ('port', 'type')
+
+    def __init__(self):
+        self.port = 80
+        self.type = SocketType.tcp
 
     def load(self, meta):
         '''
@@ -233,49 +352,164 @@ class Port:
         else:
             raise Exception('not supported port desc %s' % (meta, ))
 
+    @classmethod
+    def from_dict(cls, data):
+        port = super(Port, cls).from_dict(data)
+        if 'type' in data:
+            port.type = SocketType[data['type']]
+        return port
 
-class Proc:
-    SECTION_KEYWORDS = Enum('SECTION_KEYWORDS', PROC_TYPES + " proc service")
-    SIMPLE_SCALE_KEYWORDS = Enum(
-        "SIMPLE_SCALE_KEYWORDS", "num_instances cpu memory")
-    name = ''
-    type = ProcType.worker
-    image = ''
-    entrypoint = None
-    cmd = None
-    num_instances = 1
-    cpu = 0
-    memory = '32m'
-    port = {}
-    ports = []
-    mountpoint = []
-    https_only = True
-    healthcheck = ''
-    container_healthcheck = {}
-    user = ''
-    working_dir = ''
-    dns_search = []
-    env = []
-    volumes = []
-    system_volumes = []
-    cloud_volumes = {}
-    secret_files = []  # for proc
-    secret_files_bypass = False
-    service_name = ''
-    allow_clients = ''
-    backup = []
-    logs = []
-    stateful = False
-    setup_time = 0
-    kill_timeout = 10
-
-    def load(self, keyword, meta, appname, meta_version, default_image, **cluster_config):
-        default_image_name = default_image or gen_image_name(
+
+def _unique(items):
+    # items in order, without duplicates
+    seen, unique = set(), []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            unique.append(item)
+    return unique
+
+
+class Mountpoints(_ValueObject):
+    """
+    Mountpoints of a web proc, kept as the explicit ones (`hosts`) plus every
+    path in `paths` under every mountpoint in `bases`, e.g. hosts
+    ['x.com'], bases ['app.lain.local', 'app.lain'] and paths ['/api'] are
+
+        ['x.com', 'app.lain.local/api', 'app.lain/api']
+
+    The expansion happens on iteration, duplicates are dropped. hosts, bases
+    and paths are tuples, a Mountpoints is never modified.
+    """
+    __slots__ = ('hosts', 'bases', 'paths', '_host_set', '_path_set')
+
+    def __init__(self, hosts=(), bases=(), paths=()):
+        self.hosts = tuple(_unique(hosts))
+        self.bases = tuple(_unique(bases))
+        self.paths = tuple(_unique(paths))
+        # for __contains__
+        self._host_set = frozenset(self.hosts)
+        self._path_set = frozenset(self.paths)
+
+    def __iter__(self):
+        for host in self.hosts:
+            yield host
+        if self.paths:
+            hosts = set(host for host in self.hosts if '/' in host)
+            for path in self.paths:
+                for base in self.bases:
+                    mountpoint = base + path
+                    if mountpoint not in hosts:
+                        yield mountpoint
+
+    def expand(self):
+        # list(self), built in one go
+        if not self.paths:
+            return list(self.hosts)
+        expanded = [base + path for path in self.paths for base in self.bases]
+        # only a host with a path can be one of the expanded mountpoints
+        hosts = set(host for host in self.hosts if '/' in host)
+        if hosts:
+            expanded = [mountpoint for mountpoint in expanded if mountpoint not in hosts]
+        return list(self.hosts) + expanded
+
+    def __len__(self):
+        if not self.paths:
+            return len(self.hosts)
+        return len(self.expand())
+
+    def __contains__(self, mountpoint):
+        if mountpoint in self._host_set:
+            return True
+        for base in self.bases:
+            if mountpoint.startswith(base) and mountpoint[len(base):] in self._path_set:
+                return True
+        return False
+
+
+class AppContext(object):
+    """
+    Facts of an app which are the same for all of its procs, built once per
+    LainConf load and passed to every Proc.load
+    """
+    __slots__ = ('appname', 'meta_version', 'default_image', 'app_domain',
+                 'default_mountpoints', 'dns_search')
+
+    def __init__(self, appname, meta_version, default_image=None, **cluster_config):
+        self.appname = appname
+        self.meta_version = meta_version
+        self.default_image = default_image or gen_image_name(
             appname,
             'release',
             meta_version=meta_version,
             docker_reg=cluster_config.get('registry', PRIVATE_REGISTRY)
         )
+        self.app_domain = get_app_domain(appname)
+        # 默认注入的 mountpoint 包括
+        # - [APPDOMAIN.domain for domain in domains]
+        # - APPDOMAIN.lain
+        self.default_mountpoints = ["%s.%s" % (self.app_domain, d)
+                                    for d in cluster_config.get('domains', [DOMAIN])]
+        self.default_mountpoints.append("%s.lain" % (self.app_domain, ))
+        self.dns_search = "%s.lain" % (self.app_domain, )
+
+
+class Proc(_ValueObject):
+    SECTION_KEYWORDS = Enum('SECTION_KEYWORDS', PROC_TYPES + " proc service")
+    SIMPLE_SCALE_KEYWORDS = Enum(
+        "SIMPLE_SCALE_KEYWORDS", "num_instances cpu memory")
+    __slots__ = (
+        'name', 'type', 'image', 'entrypoint', 'cmd', 'num_instances', 'cpu',
+        'memory', 'port', 'ports', 'labels', 'filters', '_mountpoints', '_mountpoint',
+        'https_only', 'healthcheck', 'container_healthcheck', 'user',
+        'working_dir', 'dns_search', 'env', 'volumes', 'system_volumes',
+        'cloud_volumes', 'secret_files', 'secret_files_bypass', 'service_name',
+        'allow_clients', 'backup', 'logs', 'stateful', 'setup_time',
+        'kill_timeout',
+    )
+
+    def __init__(self):
+        self.name = ''
+        self.type = ProcType.worker
+        self.image = ''
+        self.entrypoint = None
+        self.cmd = None
+        self.num_instances = 1
+        self.cpu = 0
+        self.memory = '32m'
+        self.port = {}
+        self.ports = []
+        self.labels = {}
+        self.filters = []
+        self._mountpoints = Mountpoints()
+        # the expanded list handed out by `mountpoint`, None until it is read
+        self._mountpoint = None
+        self.https_only = True
+        self.healthcheck = ''
+        self.container_healthcheck = {}
+        self.user = ''
+        self.working_dir = ''
+        self.dns_search = []
+        self.env = []
+        self.volumes = []
+        self.system_volumes = []
+        self.cloud_volumes = {}
+        self.secret_files = []  # for proc
+        self.secret_files_bypass = False
+        self.service_name = ''
+        self.allow_clients = ''
+        self.backup = []
+        self.logs = []
+        self.stateful = False
+        self.setup_time = 0
+        self.kill_timeout = 10
+
+    @timing.timed('proc.load')
+    def load(self, keyword, meta, appname, meta_version, default_image, app_context=None,
+             **cluster_config):
+        # app_context: AppContext of the app, built from the other arguments if it is None
+        if app_context is None:
+            app_context = AppContext(appname, meta_version, default_image, **cluster_config)
         proc_info = keyword.split('.')
         if len(proc_info) == 2:
             self.name = proc_info[1]
@@ -287,15 +521,15 @@ class Proc:
             self.name = proc_info[0]
             self.type = ProcType[proc_info[0]]  # 放弃meta里面的type定义
 
-        self.image = meta.get('image', default_image_name)
+        self.image = meta.get('image', app_context.default_image)
         self.entrypoint = self.__get_entrypoint(meta)
         self.cmd = self.__get_cmd(meta)
         self.user = meta.get('user', '')
         self.working_dir = meta.get('workdir') or meta.get('working_dir', '')
-        dns_search_meta = meta.get('dns_search', [])
-        app_dns_search = "%s.lain" % get_app_domain(appname)
-        if app_dns_search not in dns_search_meta:
-            dns_search_meta.append(app_dns_search)
+        # copy lists from meta before changing them, meta is never modified
+        dns_search_meta = meta.get('dns_search', [])[:]
+        if app_context.dns_search not in dns_search_meta:
+            dns_search_meta.append(app_context.dns_search)
         self.dns_search = dns_search_meta
         self.cpu = meta.get('cpu', 0)
         self.memory = meta.get('memory', '32m')
@@ -337,59 +571,41 @@ class Proc:
             mountpoint_meta = meta.get('mountpoint', None)
             # TODO: change to "True" in near-future
             self.https_only = meta.get('https_only', False)
-            app_domain = get_app_domain(appname)
-            domains = cluster_config.get('domains', [DOMAIN])
-
-            # 默认注入的 mountpoint 包括
-            # - [APPDOMAIN.domain for domain in domains]
-            # - APPDOMAIN.lain
-            default_mountpoints = []
-            for d in domains:
-                default_mountpoints.append("%s.%s" % (app_domain, d))
-            default_mountpoints.append("%s.lain" % (app_domain, ))
+            default_mountpoints = app_context.default_mountpoints
 
             if self.name == 'web':
                 # ProcName == 'web' 则自动插入 default_mountpoints
                 # - APPNAME.CLUSTER_DOMAIN
                 # - APPNAME.lain
                 if not mountpoint_meta or not isinstance(mountpoint_meta, list):
-                    self.mountpoint = default_mountpoints
-                else:
-                    for mp in default_mountpoints:
-                        if mp not in mountpoint_meta:
-                            mountpoint_meta.append(mp)
-                    self.mountpoint = mountpoint_meta
+                    mountpoint_meta = []
+                mountpoint_meta = mountpoint_meta + default_mountpoints
             else:
                 # ProcName != 'web' 则必须有另外的 mountpoint
                 if not mountpoint_meta or not isinstance(mountpoint_meta, list):
                     raise Exception(
                         'proc (type is web but name is not web) should have own mountpoint.\nkeyword: %s\nmeta: %s' % (keyword, meta))
-                else:
-                    self.mountpoint = mountpoint_meta
-            to_remove = []
-            for mp in self.mountpoint:
-                if mp.startswith('/'):
-                    to_remove.append(mp)
-                    if len(mp) > 1:
-                        for dmp in default_mountpoints:
-                            self.mountpoint.append("%s%s" % (dmp, mp))
-            for mp in to_remove:
-                self.mountpoint.remove(mp)
+            # path 形式的 mountpoint (/api) 挂在每个 default_mountpoint 下，
+            # 不展开存储，"/" 被忽略
+            self.mountpoints = Mountpoints(
+                [mp for mp in mountpoint_meta if not mp.startswith('/')],
+                default_mountpoints,
+                [mp for mp in mountpoint_meta if mp.startswith('/') and len(mp) > 1])
 
         # ProcType.web 的 proc 可以有 healthcheck
         if self.type == ProcType.web:
             healthcheck_meta = meta.get('healthcheck', None)
             self.healthcheck = healthcheck_meta if healthcheck_meta else ''
 
-        self.container_healthcheck = meta.get('container_healthcheck', None)
+        self.container_healthcheck = _copy_meta(meta.get('container_healthcheck', None))
         # TODO 检验env段是否合法
         # - 是否是list
-        self.env = meta.get('env') or self.env
+        self.env = _copy_meta(meta.get('env')) or self.env
 
-        self.volumes, self.backup = [], []
+        volumes, self.backup = [], []
         for volume in meta.get('persistent_dirs') or meta.get('volumes') or []:
             if isinstance(volume, str):
-                self.volumes.append(lain_based_path(volume))
+                volumes.append(volume)
             elif isinstance(volume, dict):
                 if len(volume) == 0:
                     continue
@@ -411,11 +627,11 @@ class Proc:
                             'postRun': setting.get('post_run', ""),
                         }
                         )
-                self.volumes.append(lain_based_path(key))
-        for volume in self.volumes:
-            if not validate_volume(volume):
-                raise Exception('invalid volume: abs volume {} should not in {}'.format(
-                    volume, INVALID_VOLUMES))
+                volumes.append(key)
+        self.volumes = lain_based_paths(volumes)
+        for volume in invalid_volumes(self.volumes):
+            raise Exception('invalid volume: abs volume {} should not in {}'.format(
+                volume, sorted(INVALID_VOLUMES)))
 
         self.logs = []
         logs_meta = meta.get('logs', [])
@@ -457,10 +673,7 @@ class Proc:
             if vol_type not in CloudVolumeType:
                 raise Exception(
                     "cloud volume type %s not supported, only multi and single are valid" % vol_type)
-            vol_dirs = []
-            for vol in vol_info.get('dirs') or []:
-                vol_dirs.append(lain_based_path(vol))
-            cloud_volumes[vol_type] = vol_dirs
+            cloud_volumes[vol_type] = lain_based_paths(vol_info.get('dirs') or [])
         return cloud_volumes
 
     def _load_ports(self, meta):
@@ -491,6 +704,62 @@ class Proc:
         flts.load(meta)
         return flts.filters
 
+    def to_dict(self):
+        data = super(Proc, self).to_dict()
+        # port is keyed by int, which json can not keep
+        data['port'] = [p.to_dict() for p in self.port.itervalues()]
+        data['mountpoint'] = self._expanded_mountpoint()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        proc = super(Proc, cls).from_dict(data)
+        if 'type' in data:
+            proc.type = ProcType[data['type']]
+        if 'port' in data:
+            proc.port = {}
+            for p in data['port']:
+                p = Port.from_dict(p)
+                proc.port[p.port] = p
+        if 'mountpoint' in data:
+            proc.mountpoint = data['mountpoint']
+        return proc
+
+    @property
+    def mountpoint(self):
+        # the expanded mountpoints, expanded on the first access and kept
+        # until the next assignment, so the list can be modified in place
+        if self._mountpoints is None:
+            return None
+        if self._mountpoint is None:
+            self._mountpoint = self._mountpoints.expand()
+        return self._mountpoint
+
+    @mountpoint.setter
+    def mountpoint(self, mountpoints):
+        self.mountpoints = None if mountpoints is None else Mountpoints(mountpoints)
+
+    @property
+    def mountpoints(self):
+        # the factored Mountpoints, iterate it to expand them lazily
+        if self._mountpoint is not None:
+            # the list handed out by `mountpoint` may have been modified
+            return Mountpoints(self._mountpoint)
+        return self._mountpoints
+
+    @mountpoints.setter
+    def mountpoints(self, mountpoints):
+        self._mountpoints = mountpoints
+        self._mountpoint = None
+
+    def _expanded_mountpoint(self):
+        # like `mountpoint`, without keeping the expanded list
+        if self._mountpoint is not None:
+            return list(self._mountpoint)
+        if self._mountpoints is None:
+            return None
+        return self._mountpoints.expand()
+
     def patch(self, payload):
         # 这里仅限于proc自身信息的变化，不可包括meta_version
         self.entrypoint = payload.get('entrypoint', self.entrypoint)
@@ -507,7 +776,7 @@ class Proc:
     def patch_only_simple_scale_meta(self, proc):
         # 仅patch此proc的动态scale的meta信息
         for k in self.SIMPLE_SCALE_KEYWORDS._member_names_:
-            self.__dict__[k] = proc.__dict__[k]
+            setattr(self, k, getattr(proc, k))
 
     def __to_exec_form(self, command_and_params):
         """ 将 shell form(空格分隔) 转变为 exec form(string list)，或者保持 exec form 的格式
@@ -517,7 +786,7 @@ class Proc:
         elif isinstance(command_and_params, basestring):
             command_and_params_list = command_and_params.split()
         elif isinstance(command_and_params, list) and all(isinstance(item, basestring) for item in command_and_params):
-            command_and_params_list = command_and_params
+            command_and_params_list = _copy_meta(command_and_params)
         else:   # None 或者非法输入，如果是非法输入，在 lain build 时会给出警告
             command_and_params_list = []
         return command_and_params_list
@@ -533,8 +802,8 @@ class Proc:
     @property
     def annotation(self):
         data = {}
-        if self.mountpoint is not None:
-            data['mountpoint'] = self.mountpoint
+        if self._mountpoints is not None:
+            data['mountpoint'] = self._expanded_mountpoint()
         if self.https_only is not None:
             data['https_only'] = self.https_only
         if self.service_name:
@@ -550,9 +819,14 @@ class Proc:
         return json.dumps(data)
 
 
-class Prepare:
-    script = []
-    keep = []
+class Prepare(_ValueObject):
+    __slots__ = ('version', 'script', 'keep', 'build_arg')
+
+    def __init__(self):
+        self.version = None
+        self.script = []
+        self.keep = []
+        self.build_arg = []
 
     def load(self, meta):
         if isinstance(meta, list):
@@ -571,8 +845,8 @@ class Prepare:
                         "invalid prepare version: %s\nVALID_PREPARE_VERSION_PATERN: r\"^[a-zA-Z0-9]+$\"" % version)
             self.script = meta.get('script') or []
             self.script = ['( %s )' % s for s in self.script]
-            self.keep = meta.get('keep') or self.keep
-            self.build_arg = meta.get('build_arg') or []
+            self.keep = _copy_meta(meta.get('keep')) or self.keep
+            self.build_arg = _copy_meta(meta.get('build_arg')) or []
         keep_script = ""
         for k in self.keep:
             keep_script += '| grep -v \'\\b%s\\b\' ' % k
@@ -580,10 +854,15 @@ class Prepare:
         self.script.append(clean_script)
 
 
-class Build:
-    base = ''
-    prepare = None
-    script = []
+class Build(_ValueObject):
+    __slots__ = ('base', 'prepare', 'script', 'build_arg', 'volumes')
+
+    def __init__(self):
+        self.base = ''
+        self.prepare = None
+        self.script = []
+        self.build_arg = []
+        self.volumes = None
 
     def load(self, meta):
         base = meta.get('base', None)
@@ -591,24 +870,35 @@ class Build:
             raise Exception('no base in section build')
         self.script = meta.get('script') or []
         self.script = ['( %s )' % s for s in self.script]
-        self.build_arg = meta.get('build_arg') or []
+        self.build_arg = _copy_meta(meta.get('build_arg')) or []
         self.base = base
         prepare = meta.get('prepare')
         if prepare is not None:
             self.prepare = Prepare()
             self.prepare.load(prepare)
 
-        self.volumes = meta.get('volumes')
+        self.volumes = _copy_meta(meta.get('volumes'))
         if self.volumes is not None:
             for v in self.volumes:
                 if not os.path.isabs(v):
                     raise Exception('invalid build.volumes: {}, should be absolute path'.format(v))
 
+    @classmethod
+    def from_dict(cls, data):
+        build = super(Build, cls).from_dict(data)
+        if build.prepare is not None:
+            build.prepare = Prepare.from_dict(build.prepare)
+        return build
+
 
-class Release:
-    script = []
-    dest_base = ''
-    copy = []
+class Release(_ValueObject):
+    # `copy` is the release.copy section, use copy.copy() to copy a Release
+    __slots__ = ('script', 'dest_base', 'copy')
+
+    def __init__(self):
+        self.script = []
+        self.dest_base = ''
+        self.copy = []
 
     def load(self, meta):
         self.script = meta.get('script') or []
@@ -623,96 +913,220 @@ class Release:
                     'dest': c
                 })
             elif isinstance(c, dict):
-                self.copy.append(c)
+                self.copy.append(_copy_meta(c))
             else:
                 pass
 
 
-class Test:
-    script = []
+class Test(_ValueObject):
+    __slots__ = ('script', )
+
+    def __init__(self):
+        self.script = []
 
     def load(self, meta):
         self.script = meta.get('script') or []
         self.script = ['( %s )' % s for s in self.script]
 
 
-class LainConf:
-    appname = ''
-    giturl = ''
-    build = Build()
-    release = Release()
-    test = Test()
-    procs = {}
-    notify = {}
-    use_services = {}
-    use_resources = {}
-
+# sections: top level keys of lain.yaml changed by the reload
+# procs_added, procs_removed, procs_changed: names of the procs
+ReloadReport = namedtuple(
+    'ReloadReport', 'sections procs_added procs_removed procs_changed')
+
+
+class LainConf(_ValueObject):
+    __slots__ = ('appname', 'giturl', 'meta_version', 'build', 'release',
+                 'test', 'procs', 'notify', 'use_services', 'use_resources',
+                 '_load_args', '_meta_yaml', '_section_digests', '_proc_sections')
+
+    def __init__(self):
+        self.appname = ''
+        self.giturl = ''
+        self.meta_version = None
+        self.build = Build()
+        self.release = Release()
+        self.test = Test()
+        self.procs = {}
+        self.notify = {}
+        self.use_services = {}
+        self.use_resources = {}
+        # (default_image, cluster_config) of the last load, used by reload
+        self._load_args = (None, {})
+        # text of the last load, digested by the first reload only
+        self._meta_yaml = None
+        self._section_digests = None
+        # {proc section key: [names of procs loaded from it]}
+        self._proc_sections = {}
+
+    @timing.timed('lain_conf.load')
     def load(self, meta_yaml, meta_version, default_image, **cluster_config):
-        meta = yaml.safe_load(meta_yaml)
+        self._load_meta(backend.safe_load(meta_yaml), meta_version, default_image,
+                        cluster_config, {})
+        # digesting every section costs about a third of a load, only reload
+        # needs the digests, they are made from the text the first time
+        self._meta_yaml = meta_yaml
+
+    def load_meta(self, meta, meta_version, default_image, **cluster_config):
+        # meta: lain.yaml already loaded as dict, it is not modified
+        self._load_meta(meta, meta_version, default_image, cluster_config, {})
+        # the caller may change meta later, it is digested now
+        self._section_digests = section_digests(meta)
+
+    @timing.timed('lain_conf.reload')
+    def reload(self, meta_yaml, meta_version=None):
+        """
+        Load a new version of lain.yaml with the default_image and cluster
+        config of the last load, only the sections changed since then are
+        loaded again. Nothing changes if the new lain.yaml is invalid.
+
+        :return: ReloadReport
+        """
+        meta = backend.safe_load(meta_yaml)
+        if meta_version is None:
+            meta_version = self.meta_version
+        digests = section_digests(meta)
+        last_digests = self._digests()
+        unchanged = set(k for k, d in digests.iteritems()
+                        if last_digests.get(k) == d)
+
+        reuse = {}
+        for key in unchanged:
+            if key in ('build', 'release', 'test'):
+                reuse[key] = getattr(self, key)
+        # procs depend on appname and meta_version too
+        if meta.get('appname', None) == self.appname and meta_version == self.meta_version:
+            for key in unchanged:
+                if key in self._proc_sections:
+                    reuse[key] = [self.procs[name] for name in self._proc_sections[key]]
+
+        default_image, cluster_config = self._load_args
+        conf = LainConf()
+        conf._load_meta(meta, meta_version, default_image, cluster_config, reuse)
+        conf._meta_yaml = meta_yaml
+        conf._section_digests = digests
+
+        report = ReloadReport(
+            sections=sorted(k for k in set(digests) | set(last_digests)
+                            if k not in unchanged),
+            procs_added=sorted(set(conf.procs) - set(self.procs)),
+            procs_removed=sorted(set(self.procs) - set(conf.procs)),
+            procs_changed=sorted(name for name, proc in conf.procs.iteritems()
+                                 if name in self.procs and proc is not self.procs[name]),
+        )
+        for k in self.__slots__:
+            setattr(self, k, getattr(conf, k))
+        return report
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuild a LainConf from `to_dict` without parsing lain.yaml again.
+        The load arguments are not kept, so reload() of a rebuilt LainConf
+        loads every section with the default cluster config.
+        """
+        conf = super(LainConf, cls).from_dict(data)
+        if 'build' in data:
+            conf.build = Build.from_dict(data['build'])
+        if 'release' in data:
+            conf.release = Release.from_dict(data['release'])
+        if 'test' in data:
+            conf.test = Test.from_dict(data['test'])
+        if 'procs' in data:
+            conf.procs = dict((name, Proc.from_dict(p))
+                              for name, p in data['procs'].iteritems())
+        return conf
+
+    def _loaded_from(self, meta_yaml, default_image, cluster_config, proc_sections):
+        # what load() keeps for reload(), for a conf rebuilt by from_dict
+        self._load_args = (default_image, _used_cluster_config(cluster_config))
+        self._meta_yaml = meta_yaml
+        self._section_digests = None
+        self._proc_sections = proc_sections
+
+    def _digests(self):
+        # {top level key: digest} of the last loaded lain.yaml, {} if nothing was loaded
+        if self._section_digests is None:
+            if self._meta_yaml is None:
+                self._section_digests = {}
+            else:
+                self._section_digests = section_digests(backend.safe_load(self._meta_yaml))
+        return self._section_digests
+
+    @timing.timed('lain_conf.load_meta')
+    def _load_meta(self, meta, meta_version, default_image, cluster_config, reuse):
+        # reuse: {section key: loaded section} of the sections unchanged since the last load
+        cluster_config = _used_cluster_config(cluster_config)
+        self._load_args = (default_image, cluster_config)
+        self._meta_yaml = None
+        self._section_digests = None
         self.meta_version = meta_version
         self.appname = meta.get('appname', None)
         self.giturl = meta.get('giturl', None)
-        if self.appname is None:
-            raise Exception('invalid lain conf: no appname')
-        if self.appname in INVALID_APPNAMES:
-            raise Exception('invalid lain conf: appname {} should not in {}'.format(
-                self.appname, INVALID_APPNAMES))
-        self.procs = self._load_procs(meta, self.appname, meta_version, default_image,
-                                      registry=cluster_config.get('registry', PRIVATE_REGISTRY),
-                                      domains=cluster_config.get('domains', [DOMAIN]))
-        self.build = self._load_build(meta)
-        self.release = self._load_release(meta)
+        check_appname(self.appname)
+        app_context = AppContext(self.appname, meta_version, default_image, **cluster_config)
+        self.procs, self._proc_sections = self._load_procs(meta, app_context, reuse)
+        self.build = reuse.get('build') or self._load_build(meta)
+        self.release = reuse.get('release') or self._load_release(meta)
         if self.build.volumes is not None and self.release.script != []:
             raise Exception('invalid lain.yaml: release.script is not supported')
-        self.test = self._load_test(meta)
+        self.test = reuse.get('test') or self._load_test(meta)
         self.notify = self._load_notify(meta)
 
+        self.use_services = {}
         use_services_meta = meta.get('use_services', None)
         if use_services_meta:
             self.use_services = self._load_use_services(use_services_meta)
 
+        self.use_resources = {}
         use_resources_meta = meta.get('use_resources', None)
         if use_resources_meta:
             self.use_resources = self._load_use_resources(use_resources_meta)
 
-    def _load_procs(self, meta, appname, meta_version, default_image, **cluster_config):
-        _procs = {}
-
-        def _proc_load(key, meta, **cluster_config):
-            _proc = Proc()
-            _proc.load(key, meta, appname, meta_version, default_image,
-                       registry=cluster_config.get('registry', PRIVATE_REGISTRY),
-                       domains=cluster_config.get('domains', [DOMAIN]))
-
-            # TODO 更多错误校验
-            if _proc.name in _procs.keys():
-                raise Exception("duplicated proc name %s" % (_proc.name, ))
-            _procs[_proc.name] = _proc
+    def _load_procs(self, meta, app_context, reuse):
+        # return ({proc name: Proc}, {proc section key: [proc names]})
+        _procs, _proc_sections = {}, {}
         for key in meta.keys():
             if not is_section(key, Proc):
                 continue
-            if key.startswith("service."):
-                _key = key.split(".")
-                if len(_key) > 2 or _key[1] == "":
-                    raise Exception("invalid service keyword: %s" % key)
-
-                _service_worker_key = "proc.%s" % _key[1]
-                _service_worker_meta = copy.deepcopy(meta[key])
-                _service_portal_key = "portal.portal-%s" % _key[1]
-                _service_portal_meta = _service_worker_meta.pop('portal')
-                _service_portal_meta['service_name'] = _key[1]
-
-                _proc_load(_service_worker_key,
-                           _service_worker_meta, **cluster_config)
-                _proc_load(_service_portal_key,
-                           _service_portal_meta, **cluster_config)
+            if key in reuse:
+                procs = reuse[key]
             else:
-                _proc_load(key, meta[key], **cluster_config)
-        return _procs
+                procs = self._load_proc_section(key, meta[key], app_context)
+            # TODO 更多错误校验
+            for _proc in procs:
+                if _proc.name in _procs:
+                    raise Exception("duplicated proc name %s" % (_proc.name, ))
+                _procs[_proc.name] = _proc
+            _proc_sections[key] = [_proc.name for _proc in procs]
+        return _procs, _proc_sections
+
+    def _load_proc_section(self, key, meta, app_context):
+        def _proc_load(key, meta):
+            _proc = Proc()
+            _proc.load(key, meta, app_context.appname, app_context.meta_version,
+                       app_context.default_image, app_context=app_context)
+            return _proc
+
+        if key.startswith("service."):
+            _key = key.split(".")
+            if len(_key) > 2 or _key[1] == "":
+                raise Exception("invalid service keyword: %s" % key)
+
+            # only the top level dicts are copied, Proc.load copies what it keeps
+            _service_worker_key = "proc.%s" % _key[1]
+            _service_worker_meta = dict(meta)
+            _service_portal_key = "portal.portal-%s" % _key[1]
+            _service_portal_meta = dict(_service_worker_meta.pop('portal'))
+            _service_portal_meta['service_name'] = _key[1]
+
+            return [_proc_load(_service_worker_key, _service_worker_meta),
+                    _proc_load(_service_portal_key, _service_portal_meta)]
+        return [_proc_load(key, meta)]
 
     def _load_use_services(self, meta):
         if isinstance(meta, dict):
-            return meta
+            return dict((k, _copy_meta(v)) for k, v in meta.iteritems())
         else:
             return {}
 
@@ -721,9 +1135,9 @@ class LainConf:
             use_resources = {}
             try:
                 for k, v in meta.iteritems():
-                    tmp_v = copy.deepcopy(v)
-                    use_resources[k] = {'services': tmp_v.pop('services')}
-                    use_resources[k]['context'] = tmp_v
+                    context = dict((ck, _copy_meta(cv)) for ck, cv in v.iteritems())
+                    use_resources[k] = {'services': context.pop('services')}
+                    use_resources[k]['context'] = context
             except Exception:
                 raise Exception("invalid resource defination: %s" % meta)
             return use_resources
@@ -734,28 +1148,63 @@ class LainConf:
         meta = meta.get('build', None)
         if meta is None:
             raise Exception("no build section in lain.yaml")
-        self.build.load(meta)
-        return self.build
+        build = Build()
+        build.load(meta)
+        return build
 
     def _load_release(self, meta):
         meta = meta.get('release', None)
+        release = Release()
         if meta is not None:
-            self.release.load(meta)
-        return self.release
+            release.load(meta)
+        return release
 
     def _load_test(self, meta):
         meta = meta.get('test', None)
+        test = Test()
         if meta is not None:
-            self.test.load(meta)
-        return self.test
+            test.load(meta)
+        return test
 
     def _load_notify(self, meta):
         meta = meta.get('notify', None)
         if meta is not None:
-            return meta
+            return _copy_meta(meta)
         return {}
 
 
+def _used_cluster_config(cluster_config):
+    # the items of cluster_config used by LainConf.load, with their defaults
+    return {
+        'registry': cluster_config.get('registry', PRIVATE_REGISTRY),
+        'domains': cluster_config.get('domains', [DOMAIN]),
+    }
+
+
+def section_digests(meta):
+    # {top level key: digest of its content}
+    return dict((k, hashlib.sha1(_canonical_repr(v)).digest())
+                for k, v in meta.iteritems())
+
+
+def _canonical_repr(node):
+    # repr which does not depend on the order of dict items
+    if isinstance(node, dict):
+        return '{%s}' % ', '.join(sorted(
+            '%r: %s' % (k, _canonical_repr(v)) for k, v in node.iteritems()))
+    elif isinstance(node, list):
+        return '[%s]' % ', '.join(_canonical_repr(v) for v in node)
+    return repr(node)
+
+
+def check_appname(appname):
+    if appname is None:
+        raise Exception('invalid lain conf: no appname')
+    if appname in INVALID_APPNAMES:
+        raise Exception('invalid lain conf: appname {} should not in {}'.format(
+            appname, INVALID_APPNAMES))
+
+
 def get_app_domain(appname):
     try:
         app_domain_list = appname.split('.')
@@ -773,62 +1222,145 @@ def resource_instance_name(resource_appname, client_appname):
 def render_resource_instance_meta(
         resource_appname, resource_meta_version, resource_meta_template,
         client_appname, context, registry, domains):
+    _, instance_meta = render_resource_instance(
+        resource_appname, resource_meta_version, resource_meta_template,
+        client_appname, context, registry, domains)
+    return instance_meta
+
+
+def render_resource_instance(
+        resource_appname, resource_meta_version, resource_meta_template,
+        client_appname, context, registry, domains):
+    """
+    Render the resource template for a client app with a single yaml parse
+    and a single yaml dump
+
+    The rendered lain.yaml is validated by loading it as the instance
+    itself, renamed to resource.RESOURCE.CLIENT and with the release image
+    of the resource as default image, where render_resource_instance_meta
+    loaded the template appname without a default image before renaming.
+    The appname of the template is still checked, and nothing else checked
+    by the load depends on the appname or the default image, so the same
+    templates are accepted; the LainConf returned describes the instance.
+
+    :return: (LainConf of the resource instance, lain.yaml of the resource instance)
+    """
     # 用 use_resources 里的变量渲染 resource 模板
     instance_yaml = render_instance_yaml(resource_meta_template, context)
-    instance_meta = yaml.dump(instance_yaml, default_flow_style=False)
-    resource_config = LainConf()
-    resource_config.load(
-        instance_meta, resource_meta_version, None,
-        registry=registry, domains=domains
-    )
+    return build_resource_instance(
+        resource_appname, resource_meta_version, instance_yaml,
+        client_appname, registry, domains)
+
+
+def build_resource_instance(resource_appname, resource_meta_version, instance_yaml,
+                            client_appname, registry, domains):
+    check_appname(instance_yaml.get('appname', None))
     # 将 appname 替换成 resource instance appname
-    instance_appname = resource_instance_name(resource_appname, client_appname)
-    instance_yaml['appname'] = instance_appname
+    instance_yaml['appname'] = resource_instance_name(resource_appname, client_appname)
     # 将 apptype 的 key 删除
     instance_yaml.pop('apptype', None)
+    # 直接从渲染结果构建 LainConf 进行校验，LainConf 不会修改 instance_yaml
+    default_image = gen_image_name(resource_appname, 'release',
+                                   meta_version=resource_meta_version,
+                                   docker_reg=registry)
+    instance_config = LainConf()
+    instance_config.load_meta(instance_yaml, resource_meta_version, default_image,
+                              registry=registry, domains=domains)
     # return 最终的 yaml dump
-    return yaml.dump(instance_yaml, default_flow_style=False)
+    return instance_config, backend.dump(instance_yaml, default_flow_style=False)
+
+
+class ResourceTemplate(object):
+    """
+    Resource template parsed and compiled once, to be rendered for many clients
+
+    Literal scalars are rendered at compile time, the others are compiled to
+    jinja templates. Every render returns a new tree, the compiled one is
+    shared.
+    """
+
+    def __init__(self, resource_meta_template):
+        self.source = resource_meta_template
+        self._compiled = _compile_node(backend.safe_load(resource_meta_template))
+
+    def render(self, context):
+        return _render_compiled(self._compiled, context)
+
+    def render_instance(self, resource_appname, resource_meta_version,
+                        client_appname, context, registry, domains):
+        """
+        :return: (LainConf of the resource instance, lain.yaml of the resource instance)
+        """
+        return build_resource_instance(
+            resource_appname, resource_meta_version, self.render(context),
+            client_appname, registry, domains)
+
+
+def _compile_node(node):
+    if type(node) == dict:
+        return dict((k, _compile_node(v)) for k, v in node.iteritems())
+    elif type(node) == list:
+        return [_compile_node(v) for v in node]
+    source = str(node)
+    if NON_LITERAL_PATTERN.search(source) is not None:
+        return get_jinja_template(source)
+    return _maybe_int(source)
+
+
+def _render_compiled(node, context):
+    if type(node) == dict:
+        return dict((k, _render_compiled(v, context)) for k, v in node.iteritems())
+    elif type(node) == list:
+        return [_render_compiled(v, context) for v in node]
+    elif isinstance(node, Template):
+        return _maybe_int(str(node.render(**context)))
+    return node
 
 
 def render_instance_yaml(resource_meta_template, context):
-    instance_yaml = yaml.safe_load(resource_meta_template)
-    for key in instance_yaml:
-        if type(instance_yaml[key]) == dict:
-            iterate_parse_yaml_dict(instance_yaml[key], context)
-        elif type(instance_yaml[key]) == list:
-            iterate_parse_yaml_list(instance_yaml[key], context)
-        else:
-            instance_yaml[key] = get_jinja_render_value(
-                instance_yaml[key], context)
+    instance_yaml = backend.safe_load(resource_meta_template)
+    _render_node(instance_yaml, context)
     return instance_yaml
 
 
-def iterate_parse_yaml_dict(dict_yaml, context):
-    for key in dict_yaml:
-        if type(dict_yaml[key]) == dict:
-            iterate_parse_yaml_dict(dict_yaml[key], context)
-        elif type(dict_yaml[key]) == list:
-            iterate_parse_yaml_list(dict_yaml[key], context)
+def _render_node(node, context):
+    # render every scalar under a dict or list in place
+    keys = node.iterkeys() if type(node) == dict else xrange(len(node))
+    for key in keys:
+        value = node[key]
+        if type(value) == dict or type(value) == list:
+            _render_node(value, context)
         else:
-            dict_yaml[key] = get_jinja_render_value(dict_yaml[key], context)
+            node[key] = get_jinja_render_value(value, context)
+
+
+def iterate_parse_yaml_dict(dict_yaml, context):
+    _render_node(dict_yaml, context)
 
 
 def iterate_parse_yaml_list(list_yaml, context):
-    for index in range(len(list_yaml)):
-        if type(list_yaml[index]) == list:
-            iterate_parse_yaml_list(list_yaml[index], context)
-        elif type(list_yaml[index]) == dict:
-            iterate_parse_yaml_dict(list_yaml[index], context)
-        else:
-            list_yaml[index] = get_jinja_render_value(
-                list_yaml[index], context)
+    _render_node(list_yaml, context)
+
+
+def get_jinja_template(source):
+    template = _template_cache.get(source)
+    if template is None:
+        template = _jinja_env.from_string(source)
+        _template_cache[source] = template
+    return template
 
 
 def get_jinja_render_value(value, context):
-    template = Template(str(value))
-    update_value = str(template.render(**context))
+    update_value = str(value)
+    # literals render to themselves, skip jinja for them
+    if NON_LITERAL_PATTERN.search(update_value) is not None:
+        template = get_jinja_template(update_value)
+        update_value = str(template.render(**context))
+    return _maybe_int(update_value)
+
+
+def _maybe_int(value):
     try:
-        update_value = int(update_value)
+        return int(value)
     except Exception:
-        pass
-    return update_value
+        return value
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from .parser import Ports, SocketType
+
+# proto: 'tcp' or 'udp'
+# port: the src port both procs map
+# owner: (appname, procname) which holds the port
+# claimant: (appname, procname) which can not get it
+PortConflict = namedtuple('PortConflict', 'proto port owner claimant')
+
+
+class PortRegistry(object):
+    """
+    Cluster wide index of the src ports of proc `ports` mappings
+
+    A bitmap over min_port..max_port is kept for every proto, bit i is set
+    if min_port + i is used. Checking a port is O(1), the first free port
+    is found by bit operations on the bitmap. Apps are added again when
+    they change and removed one by one, the other apps are not touched.
+
+        registry = PortRegistry()
+        conflicts = registry.add_conf(conf)
+        port = registry.allocate('hello', 'web')
+    """
+
+    def __init__(self, min_port=Ports.MIN_PORT, max_port=Ports.MAX_PORT):
+        self.min_port = min_port
+        self.max_port = max_port
+        self._bitmaps = dict((proto, 0) for proto in SocketType._member_names_)
+        # {(proto, port): (appname, procname)}
+        self._owners = {}
+        # {appname: set((proto, port))}
+        self._apps = {}
+
+    @classmethod
+    def from_confs(cls, confs, **kwargs):
+        """:return: (PortRegistry of all the confs, [PortConflict])"""
+        registry = cls(**kwargs)
+        conflicts = []
+        for conf in confs:
+            conflicts.extend(registry.add_conf(conf))
+        return registry, conflicts
+
+    def __len__(self):
+        return len(self._owners)
+
+    def _bit(self, port):
+        if port < self.min_port or port > self.max_port:
+            raise Exception('src port should between %s and %s' %
+                            (self.min_port, self.max_port))
+        return 1 << (port - self.min_port)
+
+    def _bitmap(self, proto):
+        try:
+            return self._bitmaps[proto]
+        except KeyError:
+            raise Exception('not supported proto %s' % (proto, ))
+
+    def is_free(self, port, proto='tcp'):
+        return not self._bitmap(proto) & self._bit(port)
+
+    def owner(self, port, proto='tcp'):
+        """:return: (appname, procname) holding the port, None if it is free"""
+        return self._owners.get((proto, port))
+
+    def first_free(self, proto='tcp', start=None):
+        """:return: the lowest free port not lower than `start`, None if all are used"""
+        offset = 0 if start is None else max(start - self.min_port, 0)
+        # set the bits below start, then the lowest clear bit is the answer
+        used = self._bitmap(proto) | ((1 << offset) - 1)
+        free = ~used & (used + 1)
+        port = self.min_port + free.bit_length() - 1
+        if port > self.max_port:
+            return None
+        return port
+
+    def claim(self, port, proto, appname, procname):
+        """mark `port` used by the proc, raise if another proc holds it"""
+        bit = self._bit(port)
+        owner = self._owners.get((proto, port))
+        if owner is not None and owner != (appname, procname):
+            raise Exception('src port %s/%s is used by %s.%s' % (port, proto, owner[0], owner[1]))
+        self._bitmaps[proto] = self._bitmap(proto) | bit
+        self._owners[(proto, port)] = (appname, procname)
+        self._apps.setdefault(appname, set()).add((proto, port))
+
+    def release(self, port, proto='tcp'):
+        owner = self._owners.pop((proto, port), None)
+        if owner is None:
+            return
+        self._bitmaps[proto] &= ~self._bit(port)
+        ports = self._apps[owner[0]]
+        ports.discard((proto, port))
+        if not ports:
+            del self._apps[owner[0]]
+
+    def allocate(self, appname, procname, proto='tcp', start=None):
+        """claim the first free port for the proc and return it"""
+        port = self.first_free(proto, start)
+        if port is None:
+            raise Exception('no free src port between %s and %s for %s' %
+                            (self.min_port, self.max_port, proto))
+        self.claim(port, proto, appname, procname)
+        return port
+
+    def app_ports(self, appname):
+        """:return: sorted [(proto, port)] used by the app"""
+        return sorted(self._apps.get(appname, ()))
+
+    def conflicts(self, conf):
+        """[PortConflict] which add_conf(conf) would report, nothing is claimed"""
+        return self._plan(conf)[1]
+
+    def add_conf(self, conf):
+        """
+        claim the ports of every proc of the conf, ports held by other apps
+        or by another proc of the conf are reported instead. Adding an app
+        which is already in the registry replaces its ports.
+
+        :return: [PortConflict]
+        """
+        claims, conflicts = self._plan(conf)
+        self.remove_app(conf.appname)
+        for proto, port, procname in claims:
+            self.claim(port, proto, conf.appname, procname)
+        return conflicts
+
+    def remove_app(self, appname):
+        """release every port of the app, return them as sorted [(proto, port)]"""
+        ports = self.app_ports(appname)
+        for proto, port in ports:
+            self.release(port, proto)
+        return ports
+
+    def _plan(self, conf):
+        # ([(proto, port, procname)] to claim, [PortConflict])
+        claims, conflicts, claimed = [], [], {}
+        for proto, port, procname in _conf_ports(conf):
+            self._bitmap(proto)
+            self._bit(port)
+            owner = claimed.get((proto, port))
+            if owner is None:
+                owner = self._owners.get((proto, port))
+                # ports of the app itself are released before claiming
+                if owner is not None and owner[0] == conf.appname:
+                    owner = None
+            if owner is not None:
+                conflicts.append(PortConflict(proto, port, owner, (conf.appname, procname)))
+            else:
+                claimed[(proto, port)] = (conf.appname, procname)
+                claims.append((proto, port, procname))
+        return claims, conflicts
+
+
+def _conf_ports(conf):
+    for procname in sorted(conf.procs):
+        for mapping in conf.procs[procname].ports:
+            yield mapping['proto'], mapping['srcport'], procname
@@ -3,18 +3,18 @@
 
 import os
 
-import yaml
+from . import backend
 from ..util import get_cfd
 
 
 def load_yaml(path):
     with open(path) as f:
-        return yaml.safe_load(f.read())
+        return backend.safe_load(f.read())
 
 
 def write_yaml(path, dic):
     with open(path, 'w') as f:
-        f.write(yaml.dump(dic))
+        f.write(backend.dump(dic))
 
 
 def load_template(filename):
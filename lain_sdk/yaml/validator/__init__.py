@@ -1,12 +1,94 @@
 # -*- coding: utf-8 -*-
 
 import jsonschema
+from . import codegen
 from .schema import schema
+from .. import backend
+from ..parser import LainConf
+
+# the schema is checked and the validator is built once, jsonschema.validate
+# does both on every call
+validator_class = jsonschema.validators.validator_for(schema)
+validator_class.check_schema(schema)
+validator = validator_class(schema)
+
+_compiled_iter_errors = None
+
+
+def iter_errors(source_data):
+    """
+    Same errors in the same order as validator.iter_errors, using the
+    validator compiled by codegen, which is built on the first call
+    """
+    global _compiled_iter_errors
+    if _compiled_iter_errors is None:
+        _compiled_iter_errors = validator.iter_errors
+        if validator_class is jsonschema.Draft4Validator:
+            try:
+                _compiled_iter_errors = codegen.load(schema)
+            except codegen.UnsupportedSchema:
+                pass
+    return _compiled_iter_errors(source_data)
 
 
 def validate(source_data):
+    # same result as jsonschema.validate, which raises the first error
     try:
-        jsonschema.validate(source_data, schema)
-        return True, 'ok'
+        for error in iter_errors(source_data):
+            return False, str(error)
     except Exception as e:
         return False, str(e)
+    return True, 'ok'
+
+
+def validate_all(source_data):
+    """
+    Validate lain.yaml against the schema and collect every error
+
+    :return: [(json pointer of the invalid value, error message)],
+             empty if valid, an error the validator raises has an empty pointer
+    """
+    try:
+        errors = sorted(iter_errors(source_data),
+                        key=lambda error: (list(error.absolute_path), error.message))
+    except Exception as e:
+        return [('', str(e))]
+    return [(json_pointer(error.absolute_path), error.message) for error in errors]
+
+
+def validate_many(source_datas):
+    """
+    Validate many lain.yaml with the same validator
+
+    :return: a list of validate_all results, in the order of source_datas
+    """
+    return [validate_all(source_data) for source_data in source_datas]
+
+
+def parse_and_validate(meta_yaml, meta_version, default_image=None, **cluster_config):
+    """
+    Load lain.yaml once, validate it and build the LainConf from the same
+    loaded dict
+
+    :return: (LainConf, []) if valid, (None, [(json pointer, error message)])
+             otherwise, parse errors have an empty pointer
+    """
+    try:
+        meta = backend.safe_load(meta_yaml)
+        errors = validate_all(meta)
+    except Exception as e:
+        return None, [('', str(e))]
+    if errors:
+        return None, errors
+    conf = LainConf()
+    try:
+        conf.load_meta(meta, meta_version, default_image, **cluster_config)
+    except Exception as e:
+        return None, [('', str(e))]
+    return conf, []
+
+
+def json_pointer(path):
+    # RFC 6901, e.g. ['web', 'port', 0] -> '/web/port/0'
+    return ''.join('/' + unicode(p).replace('~', '~0').replace('/', '~1')
+                   for p in path)
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compile the lain.yaml schema into plain python validation functions
+
+Every schema node becomes a function which returns the list of
+jsonschema.ValidationError of an instance, with the same messages, paths
+and order as Draft4Validator.iter_errors. Keywords are checked in the
+iteration order of the schema dicts, like jsonschema does, and nodes made
+of simple keywords only are checked inline before calling their function.
+
+The generated module is cached on disk, keyed by the schema, schema.py,
+the python and jsonschema versions and GENERATOR_VERSION.
+"""
+
+import os
+import sys
+import marshal
+import stat
+import hashlib
+import tempfile
+
+import jsonschema
+from jsonschema import _utils
+from jsonschema.exceptions import ValidationError
+
+from ...util import mkdir_p
+
+# bump it when the generated code changes
+GENERATOR_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'lain-sdk-%s' % os.getuid())
+SCHEMA_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.py')
+
+# keywords of Draft4Validator supported by the generator, schemas using any
+# other one are left to jsonschema. format does nothing without a format
+# checker, which lain_sdk never sets.
+SUPPORTED_KEYWORDS = frozenset([
+    'type', 'properties', 'patternProperties', 'additionalProperties', 'items',
+    'required', 'pattern', 'minimum', 'maximum', 'oneOf', 'anyOf', 'allOf',
+    'enum', 'format',
+])
+# keywords which can be checked by an inline expression
+SIMPLE_KEYWORDS = frozenset(['type', 'pattern', 'minimum', 'maximum', 'items'])
+
+TYPE_EXPRS = {
+    'object': 'isinstance(%(v)s, dict)',
+    'array': 'isinstance(%(v)s, list)',
+    'string': 'isinstance(%(v)s, basestring)',
+    'integer': '(isinstance(%(v)s, (int, long)) and not isinstance(%(v)s, bool))',
+    'number': '(isinstance(%(v)s, _Number) and not isinstance(%(v)s, bool))',
+    'boolean': 'isinstance(%(v)s, bool)',
+    'null': '%(v)s is None',
+}
+
+
+class UnsupportedSchema(Exception):
+    pass
+
+
+def cache_key(schema):
+    with open(SCHEMA_SOURCE, 'rb') as f:
+        schema_source = f.read()
+    # repr keeps the iteration order of the schema dicts, which decides the
+    # order of errors
+    payload = repr((GENERATOR_VERSION, jsonschema.__version__, sys.version,
+                    schema_source, schema))
+    return hashlib.sha1(payload).hexdigest()
+
+
+def load(schema, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the iter_errors function of the compiled schema, generated or
+    loaded from `cache_dir`. Raise UnsupportedSchema if the schema can not
+    be compiled.
+
+    `cache_dir` keeps the generated module and its code object, the code
+    object is what gets loaded.
+    """
+    key = cache_key(schema)
+    name = '_lain_validator_%s' % key
+    path = os.path.join(cache_dir, name)
+    code = _read_code(cache_dir, path + '.code')
+    if code is None:
+        source = generate(schema, key)
+        code = compile(source, path + '.py', 'exec')
+        if _write(cache_dir, path + '.py', source):
+            _write(cache_dir, path + '.code', marshal.dumps(code))
+    namespace = {'__name__': name}
+    exec(code, namespace)
+    namespace['bind'](schema)
+    return namespace['iter_errors']
+
+
+def generate(schema, key=''):
+    return _Generator(schema).generate(key)
+
+
+def _is_private(path):
+    # only load code written by the current user
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _read_code(cache_dir, path):
+    if not (_is_private(cache_dir) and _is_private(path)):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return marshal.loads(f.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+
+def _write(cache_dir, path, data):
+    try:
+        mkdir_p(cache_dir)
+        os.chmod(cache_dir, 0o700)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # rename is atomic, readers never see a partial file
+        os.rename(tmp_path, path)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class _Generator(object):
+    # every node gets two functions: _ok<id> tells if an instance is valid,
+    # _v<id> returns its errors. _v is only called if _ok is false.
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.paths = []         # schema path of every node, index is the node id
+        self.node_ids = {}      # {id(node): node id}
+        self.patterns = []      # regex sources, index is the pattern id
+        self.pattern_ids = {}
+        self.constants = []     # frozensets of property names
+        self.pending = []
+        self.functions = []
+
+    def generate(self, key):
+        self.node(self.schema, ())
+        while self.pending:
+            node_id, node, path = self.pending.pop(0)
+            self.functions.append(self.ok_function(node_id, node, path))
+            self.functions.append(self.errors_function(node_id, node, path))
+
+        lines = [
+            '# -*- coding: utf-8 -*-',
+            '# generated by lain_sdk.yaml.validator.codegen, do not edit',
+            '# key: %s' % key,
+            '',
+            'import re',
+            'from numbers import Number as _Number',
+            'from lain_sdk.yaml.validator.codegen import (',
+            '    _error, _descend, _one_of, _any_of, _types_msg, _extras_msg, _ensure_list)',
+            '',
+            'SCHEMA_PATHS = %r' % (self.paths, ),
+            '_S = None',
+            '',
+        ]
+        for i, pattern in enumerate(self.patterns):
+            lines.append('_P%d = re.compile(%r).search' % (i, pattern))
+        for i, names in enumerate(self.constants):
+            lines.append('_K%d = frozenset(%r)' % (i, sorted(names)))
+        lines += [
+            '',
+            '',
+            'def bind(schema):',
+            '    global _S',
+            '    _S = []',
+            '    for path in SCHEMA_PATHS:',
+            '        node = schema',
+            '        for k in path:',
+            '            node = node[k]',
+            '        _S.append(node)',
+            '',
+            '',
+            'def iter_errors(instance):',
+            '    if _ok0(instance):',
+            '        return iter(())',
+            '    return iter(_v0(instance))',
+        ]
+        for function in self.functions:
+            lines += ['', ''] + function
+        return '\n'.join(lines) + '\n'
+
+    def node(self, node, path):
+        if not isinstance(node, dict):
+            raise UnsupportedSchema('schema at %s is not an object' % (path, ))
+        node_id = self.node_ids.get(id(node))
+        if node_id is None:
+            for k in ('$ref', 'id'):
+                if k in node:
+                    raise UnsupportedSchema('%s is not supported' % k)
+            for k in node:
+                if k in jsonschema.Draft4Validator.VALIDATORS and k not in SUPPORTED_KEYWORDS:
+                    raise UnsupportedSchema('%s is not supported' % k)
+            node_id = len(self.paths)
+            self.node_ids[id(node)] = node_id
+            self.paths.append(path)
+            self.pending.append((node_id, node, path))
+        return node_id
+
+    def pattern(self, pattern):
+        pattern_id = self.pattern_ids.get(pattern)
+        if pattern_id is None:
+            pattern_id = self.pattern_ids[pattern] = len(self.patterns)
+            self.patterns.append(pattern)
+        return '_P%d' % pattern_id
+
+    def constant(self, names):
+        if names not in self.constants:
+            self.constants.append(names)
+        return '_K%d' % self.constants.index(names)
+
+    def keywords(self, node):
+        # (keyword, value) checked by Draft4Validator, in its order
+        return [(k, v) for k, v in node.iteritems()
+                if k in jsonschema.Draft4Validator.VALIDATORS and k != 'format']
+
+    def ok_expr(self, node, path, v, depth=0):
+        # expression which is true if `v` is valid against node, inlined if
+        # node has simple keywords only
+        node_id = self.node(node, path)
+        keywords = self.keywords(node)
+        if any(k not in SIMPLE_KEYWORDS for k, _ in keywords):
+            return '_ok%d(%s)' % (node_id, v)
+        exprs = []
+        for k, value in keywords:
+            if k == 'type':
+                exprs.append(self.type_expr(value, v))
+            elif k == 'pattern':
+                exprs.append('(not isinstance(%s, basestring) or %s(%s) is not None)'
+                             % (v, self.pattern(value), v))
+            elif k in ('minimum', 'maximum'):
+                exprs.append('(not %s or %s %s %r)' % (
+                    TYPE_EXPRS['number'] % {'v': v}, v, self.compare_op(node, k), value))
+            elif k == 'items':
+                if not isinstance(value, dict):
+                    return '_ok%d(%s)' % (node_id, v)
+                item = '_x%d' % depth
+                exprs.append('(not isinstance(%s, list) or all(%s for %s in %s))' % (
+                    v, self.ok_expr(value, path + (k, ), item, depth + 1), item, v))
+        return '(%s)' % ' and '.join(exprs) if exprs else 'True'
+
+    def type_expr(self, types, v):
+        exprs = []
+        for t in _utils.ensure_list(types):
+            if t not in TYPE_EXPRS:
+                raise UnsupportedSchema('type %r is not supported' % (t, ))
+            exprs.append(TYPE_EXPRS[t] % {'v': v})
+        return '(%s)' % ' or '.join(exprs)
+
+    def compare_op(self, node, k):
+        # operator of a valid value
+        if k == 'minimum':
+            return '>' if node.get('exclusiveMinimum', False) else '>='
+        return '<' if node.get('exclusiveMaximum', False) else '<='
+
+    def ok_function(self, node_id, node, path):
+        body = []
+        for k, value in self.keywords(node):
+            if k == 'type':
+                body.append('if not %s:' % self.type_expr(value, 'instance'))
+            elif k == 'pattern':
+                body.append('if isinstance(instance, basestring) and %s(instance) is None:'
+                            % self.pattern(value))
+            elif k in ('minimum', 'maximum'):
+                body.append('if %s and not instance %s %r:' % (
+                    TYPE_EXPRS['number'] % {'v': 'instance'}, self.compare_op(node, k), value))
+            elif k == 'required':
+                if not value:
+                    continue
+                body.append('if isinstance(instance, dict) and not (%s):'
+                            % ' and '.join('%r in instance' % (name, ) for name in value))
+            elif k == 'enum':
+                body.append('if instance not in _S[%d][%r]:' % (node_id, k))
+            elif k == 'properties':
+                body.append('if isinstance(instance, dict):')
+                body.append('    pass')
+                for name, subschema in value.iteritems():
+                    ok = self.ok_expr(subschema, path + (k, name), 'instance[%r]' % (name, ))
+                    body.append('    if %r in instance and not %s:' % (name, ok))
+                    body.append('        return False')
+                continue
+            elif k == 'patternProperties':
+                body.append('if isinstance(instance, dict):')
+                body.append('    pass')
+                for pattern, subschema in value.iteritems():
+                    ok = self.ok_expr(subschema, path + (k, pattern), 'value')
+                    body.append('    for key, value in instance.iteritems():')
+                    body.append('        if %s(key) and not %s:' % (self.pattern(pattern), ok))
+                    body.append('            return False')
+                continue
+            elif k == 'additionalProperties':
+                if isinstance(value, dict):
+                    ok = 'not %s' % self.ok_expr(value, path + (k, ), 'instance[key]')
+                elif not value:
+                    ok = 'True'
+                else:
+                    continue
+                body.append('if isinstance(instance, dict):')
+                body.append('    for key in instance:')
+                body.append('        if %s and %s:' % (self.extra_condition(node), ok))
+                body.append('            return False')
+                continue
+            elif k == 'items':
+                body.append('if isinstance(instance, list):')
+                if isinstance(value, dict):
+                    ok = self.ok_expr(value, path + (k, ), 'item')
+                    body.append('    for item in instance:')
+                    body.append('        if not %s:' % ok)
+                    body.append('            return False')
+                else:
+                    body.append('    pass')
+                    for index, subschema in enumerate(value):
+                        ok = self.ok_expr(subschema, path + (k, index), 'instance[%d]' % index)
+                        body.append('    if len(instance) > %d and not %s:' % (index, ok))
+                        body.append('        return False')
+                continue
+            elif k in ('oneOf', 'anyOf', 'allOf'):
+                body.append('if not %s:' % self.combined_ok_expr(k, value, path))
+            body.append('    return False')
+        lines = ['def _ok%d(instance):' % node_id]
+        lines += ['    ' + line for line in body]
+        lines.append('    return True')
+        return lines
+
+    def combined_ok_expr(self, k, subschemas, path):
+        exprs = [self.ok_expr(subschema, path + (k, i), 'instance')
+                 for i, subschema in enumerate(subschemas)]
+        if k == 'oneOf':
+            return '(%s) == 1' % ' + '.join('(1 if %s else 0)' % e for e in exprs)
+        return '(%s)' % (' or ' if k == 'anyOf' else ' and ').join(exprs)
+
+    def extra_condition(self, node):
+        # condition of an additional property named `key`
+        condition = 'key not in %s' % self.constant(frozenset(node.get('properties', {})))
+        patterns = '|'.join(node.get('patternProperties', {}))
+        if patterns:
+            condition += ' and not %s(key)' % self.pattern(patterns)
+        return condition
+
+    def check(self, body, indent, node, path, value, descend_args):
+        # descend the errors of value against node, if it is invalid
+        pad = ' ' * indent
+        body.append('%sif not %s:' % (pad, self.ok_expr(node, path, value)))
+        body.append('%s    sub = _v%d(%s)' % (pad, self.node(node, path), value))
+        body.append('%s    _descend(errors, sub, %s)' % (pad, descend_args))
+
+    def errors_function(self, node_id, node, path):
+        body = []
+        node_ref = '_S[%d]' % node_id
+        for k, value in self.keywords(node):
+            error_args = '%s, %r, instance' % (node_ref, k)
+            if k == 'type':
+                body.append('if not %s:' % self.type_expr(value, 'instance'))
+                body.append('    _error(errors, _types_msg(instance, _ensure_list(%s[%r])), %s)'
+                            % (node_ref, k, error_args))
+            elif k == 'pattern':
+                body.append('if isinstance(instance, basestring) and %s(instance) is None:'
+                            % self.pattern(value))
+                body.append('    _error(errors, %r %% (instance, ), %s)'
+                            % ('%%r does not match %s' % _escape(repr(value)), error_args))
+            elif k in ('minimum', 'maximum'):
+                op = self.compare_op(node, k)
+                cmp = {
+                    '>': 'less than or equal to', '>=': 'less than',
+                    '<': 'greater than or equal to', '<=': 'greater than',
+                }[op]
+                body.append('if %s and not instance %s %r:' % (
+                    TYPE_EXPRS['number'] % {'v': 'instance'}, op, value))
+                body.append('    _error(errors, %r %% (instance, ), %s)'
+                            % ('%%r is %s the %s of %s' % (cmp, k, _escape(repr(value))), error_args))
+            elif k == 'required':
+                body.append('if isinstance(instance, dict):')
+                body.append('    pass')
+                for name in value:
+                    body.append('    if %r not in instance:' % (name, ))
+                    body.append('        _error(errors, %r, %s)'
+                                % ('%r is a required property' % (name, ), error_args))
+            elif k == 'enum':
+                body.append('if instance not in %s[%r]:' % (node_ref, k))
+                body.append('    _error(errors, "%%r is not one of %%r" %% (instance, %s[%r]), %s)'
+                            % (node_ref, k, error_args))
+            elif k == 'properties':
+                body.append('if isinstance(instance, dict):')
+                body.append('    pass')
+                for name, subschema in value.iteritems():
+                    body.append('    if %r in instance:' % (name, ))
+                    self.check(body, 8, subschema, path + (k, name),
+                               'instance[%r]' % (name, ), '%r, %r, %r' % (k, name, name))
+            elif k == 'patternProperties':
+                body.append('if isinstance(instance, dict):')
+                body.append('    pass')
+                for pattern, subschema in value.iteritems():
+                    body.append('    for key, value in instance.iteritems():')
+                    body.append('        if %s(key):' % self.pattern(pattern))
+                    self.check(body, 12, subschema, path + (k, pattern),
+                               'value', '%r, key, %r' % (k, pattern))
+            elif k == 'additionalProperties':
+                body.append('if isinstance(instance, dict):')
+                body.append('    extras = [key for key in instance if %s]' % self.extra_condition(node))
+                if isinstance(value, dict):
+                    body.append('    for key in set(extras):')
+                    self.check(body, 8, value, path + (k, ), 'instance[key]', '%r, key' % k)
+                elif not value:
+                    body.append('    if extras:')
+                    body.append('        _error(errors, "Additional properties are not allowed '
+                                '(%%s %%s unexpected)" %% _extras_msg(set(extras)), %s)'
+                                % error_args)
+            elif k == 'items':
+                body.append('if isinstance(instance, list):')
+                if isinstance(value, dict):
+                    body.append('    for index, item in enumerate(instance):')
+                    self.check(body, 8, value, path + (k, ), 'item', '%r, index' % k)
+                else:
+                    body.append('    pass')
+                    for index, subschema in enumerate(value):
+                        body.append('    if len(instance) > %d:' % index)
+                        self.check(body, 8, subschema, path + (k, index),
+                                   'instance[%d]' % index, '%r, %d, %d' % (k, index, index))
+            elif k == 'allOf':
+                for index, subschema in enumerate(value):
+                    self.check(body, 0, subschema, path + (k, index), 'instance',
+                               '%r, None, %d' % (k, index))
+            elif k in ('oneOf', 'anyOf'):
+                ids = [self.node(subschema, path + (k, i)) for i, subschema in enumerate(value)]
+                body.append('if not %s:' % self.combined_ok_expr(k, value, path))
+                body.append('    _%s(errors, instance, (%s, ), %s)' % (
+                    {'oneOf': 'one_of', 'anyOf': 'any_of'}[k],
+                    ', '.join('_v%d' % i for i in ids), node_ref))
+        lines = ['def _v%d(instance):' % node_id,
+                 '    # %r' % (path, ),
+                 '    errors = []']
+        lines += ['    ' + line for line in body]
+        lines.append('    return errors')
+        return lines
+
+
+def _escape(text):
+    # text in a message which is formatted again by the generated code
+    return text.replace('%', '%%')
+
+
+# runtime helpers of the generated code, they do what Draft4Validator does
+# for the errors of a keyword
+
+_types_msg = _utils.types_msg
+_ensure_list = _utils.ensure_list
+_extras_msg = _utils.extras_msg
+
+
+def _error(errors, message, node, keyword, instance, context=()):
+    errors.append(ValidationError(
+        message, validator=keyword, validator_value=node[keyword],
+        instance=instance, schema=node, schema_path=(keyword, ), context=context))
+
+
+def _descend(errors, sub, keyword, path=None, schema_path=None):
+    for error in sub:
+        if path is not None:
+            error.path.appendleft(path)
+        if schema_path is not None:
+            error.schema_path.appendleft(schema_path)
+        error.schema_path.appendleft(keyword)
+        errors.append(error)
+
+
+def _one_of(errors, instance, functions, node):
+    all_errors = []
+    for index, function in enumerate(functions):
+        sub = function(instance)
+        if not sub:
+            first_valid = index
+            break
+        for error in sub:
+            error.schema_path.appendleft(index)
+        all_errors.extend(sub)
+    else:
+        _error(errors, '%r is not valid under any of the given schemas' % (instance, ),
+               node, 'oneOf', instance, all_errors)
+        return
+
+    subschemas = node['oneOf']
+    more_valid = [subschemas[i] for i in range(first_valid + 1, len(functions))
+                  if not functions[i](instance)]
+    if more_valid:
+        more_valid.append(subschemas[first_valid])
+        reprs = ', '.join(repr(schema) for schema in more_valid)
+        _error(errors, '%r is valid under each of %s' % (instance, reprs),
+               node, 'oneOf', instance)
+
+
+def _any_of(errors, instance, functions, node):
+    all_errors = []
+    for index, function in enumerate(functions):
+        sub = function(instance)
+        if not sub:
+            return
+        for error in sub:
+            error.schema_path.appendleft(index)
+        all_errors.extend(sub)
+    _error(errors, '%r is not valid under any of the given schemas' % (instance, ),
+           node, 'anyOf', instance, all_errors)
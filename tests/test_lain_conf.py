@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
 import json
+import copy
+import pickle
 import yaml
 import pytest
 from unittest import TestCase
+from jinja2 import Template
 from lain_sdk.yaml.parser import (
-    LainConf, ProcType, Proc,
+    LainConf, ProcType, Proc, ReloadReport, AppContext,
     just_simple_scale,
-    render_resource_instance_meta, DEFAULT_SYSTEM_VOLUMES,
+    render_resource_instance_meta, render_resource_instance,
+    get_jinja_render_value,
+    DEFAULT_SYSTEM_VOLUMES,
     DOMAIN,
     MIN_SETUP_TIME, MAX_SETUP_TIME, MIN_KILL_TIMEOUT, MAX_KILL_TIMEOUT
 )
@@ -1959,6 +1964,105 @@ def test_resource_instance_meta_render_full():
     assert mysqlproxy_proc.image == 'myregistry.lain.org/proxy:release-1234567-abc'
 
 
+def test_resource_instance_render_single_pass():
+    registry = 'registry.lain.local'
+    domains = ['lain.local']
+    context = {'memory': '128M'}
+    instance_config, instance_meta = render_resource_instance(
+        'redis', REDIS_RESOURCE_META_VERSION, REDIS_RESOURCE_META,
+        'hello', context, registry, domains
+    )
+    assert instance_meta == render_resource_instance_meta(
+        'redis', REDIS_RESOURCE_META_VERSION, REDIS_RESOURCE_META,
+        'hello', context, registry, domains
+    )
+    instance_yaml = yaml.safe_load(instance_meta)
+    assert instance_yaml['appname'] == 'resource.redis.hello'
+    assert 'apptype' not in instance_yaml
+    assert instance_yaml['service.redis']['memory'] == '128M'
+    assert 'dns_search' not in instance_yaml['service.redis']
+
+    resource_default_image = '{}/{}:release-{}'.format(
+        registry, 'redis', REDIS_RESOURCE_META_VERSION)
+    reloaded_config = LainConf()
+    reloaded_config.load(instance_meta, REDIS_RESOURCE_META_VERSION,
+                         resource_default_image, registry=registry, domains=domains)
+    assert instance_config.appname == 'resource.redis.hello'
+    assert sorted(instance_config.procs.keys()) == sorted(reloaded_config.procs.keys())
+    for name, proc in instance_config.procs.items():
+        assert proc.image == reloaded_config.procs[name].image
+        assert proc.memory == reloaded_config.procs[name].memory
+        assert proc.dns_search == reloaded_config.procs[name].dns_search
+        assert proc.annotation == reloaded_config.procs[name].annotation
+
+
+def test_resource_instance_loaded_as_instance():
+    registry = 'registry.lain.local'
+    template = REDIS_RESOURCE_META + '''
+web:
+  cmd: ./admin
+  mountpoint:
+    - /admin
+'''
+    instance_config, _ = render_resource_instance(
+        'redis', REDIS_RESOURCE_META_VERSION, template, 'hello', {}, registry,
+        ['lain.local'])
+    web = instance_config.procs['web']
+    # the release image of the resource and the domain of the instance
+    assert web.image == '{}/redis:release-{}'.format(registry, REDIS_RESOURCE_META_VERSION)
+    assert web.mountpoint == ['hello.redis.resource.lain.local',
+                              'hello.redis.resource.lain',
+                              'hello.redis.resource.lain.local/admin',
+                              'hello.redis.resource.lain/admin']
+    assert web.dns_search == ['hello.redis.resource.lain']
+    # the appname of the template is checked, not the one of the instance
+    with pytest.raises(Exception) as e:
+        render_resource_instance(
+            'redis', REDIS_RESOURCE_META_VERSION,
+            template.replace('appname: redis', 'appname: resource'),
+            'hello', {}, registry, ['lain.local'])
+    assert 'should not in' in str(e.value)
+
+
+def test_resource_instance_render_without_appname():
+    with pytest.raises(Exception) as e:
+        render_resource_instance(
+            'redis', REDIS_RESOURCE_META_VERSION,
+            REDIS_RESOURCE_META.replace('appname: redis', ''),
+            'hello', {}, 'registry.lain.local', ['lain.local'])
+    assert 'invalid lain conf: no appname' in str(e.value)
+
+
+def test_lain_conf_load_meta_keeps_meta(validation_yaml):
+    meta = yaml.safe_load(validation_yaml)
+    meta['web']['mountpoint'] = ['/api', 'a.com']
+    meta['web']['dns_search'] = ['x.lain']
+    want = yaml.safe_dump(meta)
+    app_conf = LainConf()
+    app_conf.load_meta(meta, '123456-abcdefg', None, domains=['lain.local'])
+    assert yaml.safe_dump(meta) == want
+    assert app_conf.procs['web'].dns_search == ['x.lain', 'for-validate.lain']
+    assert 'for-validate.lain.local/api' in app_conf.procs['web'].mountpoint
+
+
+@pytest.mark.parametrize("value", [
+    1, True, None, 1.5, '', ' 12 ', '-5', 'abc\n', 'a\r\nb', 'a\n\n', 'x\x0by',
+    '{ a }', '} {', '#', '{# comment #}x', 'tab\there', u'abc', [1, 2],
+    '{{ memory }}', '{{ num_instances|default(1)|int(1) }}',
+    '{% if memory %}{{ memory }}{% endif %}\n',
+])
+def test_jinja_render_value_same_as_template(value):
+    context = {'memory': '128M', 'num_instances': '2'}
+    want = str(Template(str(value)).render(**context))
+    try:
+        want = int(want)
+    except Exception:
+        pass
+    assert get_jinja_render_value(value, context) == want
+    # cached templates render the same
+    assert get_jinja_render_value(value, context) == want
+
+
 def test_build_section_with_old_prepare(old_prepare_yaml):
     app_meta_version = '123456-abcdefg'
     app_conf = LainConf()
@@ -2030,3 +2134,236 @@ def test_release(release_yaml):
                   domains=['registry.lain.local', 'lain.local'])
     assert app_conf.release.copy == [
         {'dest': '/usr/bin/hello', 'src': 'hello'}, {'dest': 'hi', 'src': 'hi'}]
+
+
+def test_lain_conf_defaults_not_shared(release_yaml, validation_yaml):
+    app_meta_version = '123456-abcdefg'
+    release_conf = LainConf()
+    release_conf.load(release_yaml, app_meta_version, None)
+    validation_conf = LainConf()
+    validation_conf.load(validation_yaml, app_meta_version, None)
+    assert release_conf.build is not validation_conf.build
+    assert release_conf.build.base != validation_conf.build.base
+    assert LainConf().build.base == ''
+    assert LainConf().procs == {}
+    assert Proc().port == {}
+    with pytest.raises(AttributeError):
+        Proc().unknown_attribute = 1
+
+
+def test_lain_conf_copy(validation_yaml):
+    app_meta_version = '123456-abcdefg'
+    app_conf = LainConf()
+    app_conf.load(validation_yaml, app_meta_version, None)
+    conf_copy = app_conf.copy()
+    assert conf_copy.appname == app_conf.appname
+    assert conf_copy.procs is not app_conf.procs
+    assert conf_copy.procs['web'] is not app_conf.procs['web']
+    assert conf_copy.procs['web'].annotation == app_conf.procs['web'].annotation
+    assert conf_copy.release.copy == app_conf.release.copy
+    assert conf_copy.release is not app_conf.release
+
+    conf_copy.procs['web'].patch({'cpu': 2, 'port': 8080})
+    conf_copy.procs['web'].env.append('ENV_C=envc')
+    assert app_conf.procs['web'].cpu == 0
+    assert app_conf.procs['web'].port.keys() == [8000]
+    assert app_conf.procs['web'].env == []
+
+
+def test_lain_conf_reload(validation_yaml):
+    app_meta_version = '123456-abcdefg'
+    app_conf = LainConf()
+    app_conf.load(validation_yaml, app_meta_version, 'for-validate:release',
+                  domains=['lain.local'])
+    web, x1, echo = app_conf.procs['web'], app_conf.procs['x1-y'], app_conf.procs['echo']
+    build = app_conf.build
+
+    new_yaml = validation_yaml.replace('memory: 256m', 'memory: 512m').replace(
+        'cmd: ./proxy\n  port: 10000\n\nservice.echo', 'cmd: ./proxy\n  port: 10001\n\nservice.echo')
+    new_yaml += '\nproc.worker:\n  cmd: ./worker\n'
+    report = app_conf.reload(new_yaml)
+    assert report == ReloadReport(
+        sections=['portal.portal-x1', 'proc.worker', 'web'],
+        procs_added=['worker'], procs_removed=[],
+        procs_changed=['portal-x1', 'web'])
+    assert app_conf.procs['web'] is not web
+    assert app_conf.procs['web'].memory == '512m'
+    assert app_conf.procs['portal-x1'].port.keys() == [10001]
+    assert app_conf.procs['x1-y'] is x1
+    assert app_conf.procs['echo'] is echo
+    assert app_conf.build is build
+    assert app_conf.procs['worker'].image == 'for-validate:release'
+    assert 'lain.local' in app_conf.procs['web'].annotation
+
+    # every proc depends on meta_version
+    report = app_conf.reload(validation_yaml, 'another-version')
+    assert report.procs_removed == ['worker']
+    assert sorted(report.procs_changed) == sorted(app_conf.procs.keys())
+    assert app_conf.meta_version == 'another-version'
+    assert app_conf.build is build
+
+    unchanged = app_conf.reload(validation_yaml)
+    assert unchanged == ReloadReport([], [], [], [])
+
+
+def test_lain_conf_reload_invalid(validation_yaml):
+    app_meta_version = '123456-abcdefg'
+    app_conf = LainConf()
+    app_conf.load(validation_yaml, app_meta_version, None)
+    procs = dict(app_conf.procs)
+    with pytest.raises(Exception):
+        app_conf.reload(validation_yaml.replace('build:', 'build_typo:'))
+    assert app_conf.procs == procs
+    assert app_conf.build.base == 'centos:7.1.1503'
+    assert app_conf.reload(validation_yaml).sections == []
+
+
+def test_lain_conf_reload_digests_lazily(validation_yaml, monkeypatch):
+    from lain_sdk.yaml import parser
+    digested = []
+    section_digests = parser.section_digests
+    monkeypatch.setattr(parser, 'section_digests',
+                        lambda meta: digested.append(meta) or section_digests(meta))
+    app_conf = LainConf()
+    app_conf.load(validation_yaml, '123456-abcdefg', None)
+    assert digested == []
+    # changes of the conf are not taken for changes of lain.yaml
+    app_conf.procs['web'].env.append('B=2')
+
+    copied = copy.copy(app_conf)
+    pickled = pickle.loads(pickle.dumps(app_conf))
+    for conf in (app_conf, copied, pickled):
+        assert conf.reload(validation_yaml) == ReloadReport([], [], [], [])
+    new_yaml = validation_yaml.replace('memory: 256m', 'memory: 512m')
+    assert app_conf.reload(new_yaml).sections == ['web']
+
+    # a meta given by the caller is digested by the load, it may change later
+    meta = yaml.safe_load(validation_yaml)
+    app_conf.load_meta(meta, '123456-abcdefg', None)
+    meta['web']['memory'] = '1g'
+    assert app_conf.reload(validation_yaml) == ReloadReport([], [], [], [])
+
+
+def test_lain_conf_factored_mountpoints():
+    meta_yaml = '''
+appname: hello
+build:
+  base: golang
+  script:
+    - go build -o hello
+web:
+  cmd: hello
+  mountpoint:
+    - /api
+    - a.com
+    - /
+    - /api
+    - a.com/x
+web.admin:
+  cmd: admin
+  mountpoint:
+    - /admin
+'''
+    domains = ['d%d.local' % i for i in range(50)]
+    conf = LainConf()
+    conf.load(meta_yaml, '123456-abcdefg', None, domains=domains)
+    defaults = ['hello.%s' % d for d in domains] + ['hello.lain']
+
+    web = conf.procs['web']
+    assert web.mountpoints.hosts == tuple(['a.com', 'a.com/x'] + defaults)
+    assert web.mountpoints.paths == ('/api', )
+    expected = ['a.com', 'a.com/x'] + defaults + ['%s/api' % d for d in defaults]
+    assert len(web.mountpoints) == len(expected)
+    assert 'hello.d7.local/api' in web.mountpoints
+    assert 'hello.d7.local/admin' not in web.mountpoints
+    assert json.loads(web.annotation)['mountpoint'] == expected
+    assert web.mountpoint == expected
+    # the list is kept, changes made in place are not lost
+    assert web.mountpoint is web.mountpoint
+    web.mountpoint.append('b.com')
+    web.mountpoint.remove('a.com')
+    expected = expected[1:] + ['b.com']
+    assert web.mountpoint == expected
+    assert 'b.com' in web.mountpoints and 'a.com' not in web.mountpoints
+    assert json.loads(web.annotation)['mountpoint'] == expected
+
+    admin = conf.procs['admin']
+    assert admin.mountpoint == ['%s/admin' % d for d in defaults]
+
+    copied = Proc.from_dict(web.to_dict())
+    assert copied.mountpoint == expected
+    web.mountpoint = ['c.com']
+    assert json.loads(web.annotation)['mountpoint'] == ['c.com']
+
+
+def test_lain_conf_independent_of_meta():
+    meta = yaml.safe_load('''
+appname: hello
+build:
+  base: golang
+  script:
+    - go build -o hello
+  volumes:
+    - /data
+notify:
+  slack: '#hello'
+use_services:
+  echo:
+    - echo
+service.echo:
+  cmd: [./echo, -v]
+  env:
+    - A=a
+  container_healthcheck:
+    cmd: [curl, localhost]
+  port: 1234
+  portal:
+    allow_clients: '**'
+    cmd: ./proxy
+    port: 4321
+use_resources:
+  redis:
+    memory: 128M
+    services:
+      - redis
+''')
+    expected = copy.deepcopy(meta)
+    conf = LainConf()
+    conf.load_meta(meta, '123456-abcdefg', None)
+    assert meta == expected
+    assert conf.procs['portal-echo'].service_name == 'echo'
+    assert conf.use_resources['redis'] == {'services': ['redis'],
+                                           'context': {'memory': '128M'}}
+
+    # changing the conf leaves the meta alone
+    echo = conf.procs['echo']
+    echo.env.append('B=2')
+    echo.cmd.append('-q')
+    echo.container_healthcheck['cmd'].append('-f')
+    conf.build.volumes.append('/cache')
+    conf.notify['slack'] = '#other'
+    conf.use_services['echo'].append('echo2')
+    conf.use_resources['redis']['services'].append('redis2')
+    assert meta == expected
+
+
+def test_app_context(validation_yaml):
+    domains = ['lain.local', 'lain.cloud']
+    context = AppContext('a.hello', '123456-abcdefg', None,
+                         registry='registry.lain.local', domains=domains)
+    assert context.default_image == 'registry.lain.local/a.hello:release-123456-abcdefg'
+    assert context.app_domain == 'hello.a'
+    assert context.default_mountpoints == ['hello.a.lain.local', 'hello.a.lain.cloud',
+                                           'hello.a.lain']
+    assert context.dns_search == 'hello.a.lain'
+
+    # procs loaded with a shared context are the same as ones loaded alone
+    conf = LainConf()
+    conf.load(validation_yaml, '123456-abcdefg', None, domains=domains)
+    meta = yaml.safe_load(validation_yaml)
+    context = AppContext(conf.appname, '123456-abcdefg', None, domains=domains)
+    for key in ('web', 'proc.x1-y'):
+        alone, shared = Proc(), Proc()
+        alone.load(key, meta[key], conf.appname, '123456-abcdefg', None, domains=domains)
+        shared.load(key, meta[key], conf.appname, '123456-abcdefg', None, app_context=context)
+        assert alone.to_dict() == shared.to_dict() == conf.procs[alone.name].to_dict()
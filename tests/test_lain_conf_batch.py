@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lain_sdk.yaml.batch import load_many, render_resource_instances
+from lain_sdk.yaml.parser import (
+    ResourceTemplate, render_instance_yaml, render_resource_instance_meta)
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+INVALID_META = '''
+appname: broken
+web:
+  cmd: hello
+'''
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_load_many_reports_per_item_errors(processes, validation_yaml, release_yaml):
+    cluster_config = {'registry': 'registry.lain.local', 'domains': ['lain.local']}
+    items = [
+        (validation_yaml, META_VERSION, cluster_config),
+        (INVALID_META, META_VERSION, cluster_config),
+        (release_yaml, META_VERSION, dict(cluster_config, default_image='hello:release')),
+        ('appname: [', META_VERSION, None),
+    ]
+    results = sorted(load_many(items, processes=processes, chunksize=1),
+                     key=lambda r: r.index)
+    assert [r.index for r in results] == [0, 1, 2, 3]
+
+    assert results[0].errors == []
+    assert results[0].conf.appname == 'for-validate'
+    assert results[0].conf.procs['web'].image == \
+        'registry.lain.local/for-validate:release-%s' % META_VERSION
+
+    assert results[1].conf is None
+    assert "'build' is a required property" in results[1].errors[0]
+
+    assert results[2].errors == []
+    assert results[2].conf.procs['web'].image == 'hello:release'
+
+    assert results[3].conf is None
+    assert len(results[3].errors) == 1
+
+
+def test_load_many_without_validation():
+    items = [(INVALID_META, META_VERSION, None)]
+    result = list(load_many(items, processes=1, validate_meta=False))[0]
+    assert result.conf is None
+    assert result.errors == ['no build section in lain.yaml']
+
+
+RESOURCE_META = '''
+appname: redis
+apptype: resource
+build:
+  base: golang
+  script:
+    - go build -o hello
+service.redis:
+  cmd: redis -p 3333
+  port: 3333
+  memory: "{{ memory|default('64M') }}"
+  num_instances: "{{ num_instances|default(1)|int(1) }}"
+  portal:
+    image: myregistry.lain.org/proxy:release-1234567-abc
+    cmd: ./proxy
+'''
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_render_resource_instances(processes):
+    registry, domains = 'registry.lain.local', ['lain.local']
+    clients = [('hello', {'memory': '128M'}),
+               ('world', {'num_instances': 3}),
+               ('foo.bar', {})]
+    rendered = dict(render_resource_instances(
+        'redis', META_VERSION, RESOURCE_META, clients, registry, domains,
+        processes=processes, chunksize=1))
+    assert sorted(rendered.keys()) == ['foo.bar', 'hello', 'world']
+    for client_appname, context in clients:
+        assert rendered[client_appname] == render_resource_instance_meta(
+            'redis', META_VERSION, RESOURCE_META, client_appname, context,
+            registry, domains)
+
+
+def test_resource_template_render_many():
+    template = ResourceTemplate(RESOURCE_META)
+    first = template.render({'memory': '128M', 'num_instances': '2'})
+    second = template.render({})
+    assert first['service.redis']['memory'] == '128M'
+    assert first['service.redis']['num_instances'] == 2
+    assert first['service.redis']['port'] == 3333
+    assert second['service.redis']['memory'] == '64M'
+    assert second['service.redis']['num_instances'] == 1
+    assert first['service.redis'] is not second['service.redis']
+    assert first == render_instance_yaml(RESOURCE_META, {'memory': '128M', 'num_instances': '2'})
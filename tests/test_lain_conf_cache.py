@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import json
+from lain_sdk.yaml.cache import ParseCache
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def test_parse_cache_hit_returns_independent_conf(validation_yaml):
+    cache = ParseCache()
+    first = cache.load(validation_yaml, META_VERSION, None)
+    second = cache.load(validation_yaml, META_VERSION, None)
+    assert cache.stats['misses'] == 1
+    assert cache.stats['hits'] == 1
+    assert first is not second
+    assert second.appname == 'for-validate'
+    assert sorted(second.procs.keys()) == sorted(first.procs.keys())
+    assert second.procs['web'].annotation == first.procs['web'].annotation
+
+    second.procs['web'].patch({'cpu': 4, 'num_instances': 3})
+    third = cache.load(validation_yaml, META_VERSION, None)
+    assert third.procs['web'].cpu == 0
+    assert third.procs['web'].num_instances == 1
+
+
+def test_parse_cache_key(validation_yaml):
+    key = ParseCache.key(validation_yaml, META_VERSION, None,
+                         registry='registry.lain.local', domains=['lain.local'])
+    assert key == ParseCache.key(validation_yaml, META_VERSION, None,
+                                 registry='registry.lain.local', domains=['lain.local'])
+    assert key != ParseCache.key(validation_yaml, META_VERSION, None,
+                                 registry='registry.lain.local', domains=['lain.cloud'])
+    assert key != ParseCache.key(validation_yaml, 'another-version', None,
+                                 registry='registry.lain.local', domains=['lain.local'])
+    assert key != ParseCache.key(validation_yaml, META_VERSION, 'hello:release',
+                                 registry='registry.lain.local', domains=['lain.local'])
+
+
+def test_parse_cache_lru_eviction(validation_yaml, release_yaml, healthcheck_yaml):
+    cache = ParseCache(capacity=2)
+    cache.load(validation_yaml, META_VERSION, None)
+    cache.load(release_yaml, META_VERSION, None)
+    cache.load(validation_yaml, META_VERSION, None)
+    cache.load(healthcheck_yaml, META_VERSION, None)
+    assert len(cache) == 2
+    assert cache.stats['evictions'] == 1
+    # release_yaml was the least recently used one
+    cache.load(validation_yaml, META_VERSION, None)
+    assert cache.stats['hits'] == 2
+    cache.load(release_yaml, META_VERSION, None)
+    assert cache.stats['misses'] == 4
+
+
+def test_parse_cache_shared_on_disk(tmpdir, validation_yaml):
+    cache_dir = tmpdir.mkdir('lain-cache').strpath
+    conf = ParseCache(cache_dir=cache_dir).load(
+        validation_yaml, META_VERSION, None, domains=['lain.local'])
+
+    another = ParseCache(cache_dir=cache_dir)
+    cached = another.load(validation_yaml, META_VERSION, None, domains=['lain.local'])
+    assert another.stats['disk_hits'] == 1
+    assert another.stats['misses'] == 0
+    assert json.loads(cached.procs['web'].annotation) == \
+        json.loads(conf.procs['web'].annotation)
+
+
+def test_parse_cache_ignores_broken_disk_entry(tmpdir, validation_yaml):
+    cache_dir = tmpdir.mkdir('lain-cache')
+    key = ParseCache.key(validation_yaml, META_VERSION, None)
+    cache_dir.mkdir('parse').join('%s.json' % key).write('broken')
+    cache = ParseCache(cache_dir=cache_dir.strpath)
+    conf = cache.load(validation_yaml, META_VERSION, None)
+    assert conf.appname == 'for-validate'
+    assert cache.stats['misses'] == 1
+    assert cache.stats['disk_hits'] == 0
+
+
+def test_parse_cache_disk_entry_is_data(tmpdir, validation_yaml):
+    cache_dir = tmpdir.mkdir('lain-cache')
+    key = ParseCache.key(validation_yaml, META_VERSION, None)
+    entry = cache_dir.mkdir('parse').join('%s.json' % key)
+    # a pickle which would run a command if it was unpickled
+    entry.write("cos\nsystem\n(S'touch %s'\ntR." % tmpdir.join('pwned').strpath)
+    cache = ParseCache(cache_dir=cache_dir.strpath)
+    assert cache.load(validation_yaml, META_VERSION, None).appname == 'for-validate'
+    assert not tmpdir.join('pwned').exists()
+    assert json.loads(entry.read())['conf']['appname'] == 'for-validate'
+
+
+def test_parse_cache_key_has_format_version(validation_yaml, monkeypatch):
+    from lain_sdk.yaml import cache
+    key = ParseCache.key(validation_yaml, META_VERSION, None)
+    monkeypatch.setattr(cache, 'PARSE_CACHE_FORMAT_VERSION', cache.PARSE_CACHE_FORMAT_VERSION + 1)
+    assert ParseCache.key(validation_yaml, META_VERSION, None) != key
+
+
+def test_parse_cache_hit_reloads_like_a_load(validation_yaml):
+    cache = ParseCache()
+    cache.load(validation_yaml, META_VERSION, None, domains=['lain.local'])
+    conf = cache.load(validation_yaml, META_VERSION, None, domains=['lain.local'])
+    web = conf.procs['web']
+    new_yaml = validation_yaml.replace('memory: 256m', 'memory: 512m')
+    report = conf.reload(new_yaml)
+    assert report.sections == ['web']
+    assert report.procs_changed == ['web']
+    assert conf.procs['web'] is not web
+    assert 'lain.local' in conf.procs['web'].annotation
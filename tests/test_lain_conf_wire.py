@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pytest
+from lain_sdk.yaml import wire
+from lain_sdk.yaml.parser import LainConf, ProcType, SocketType
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def _load(meta_yaml):
+    conf = LainConf()
+    conf.load(meta_yaml, META_VERSION, None, domains=['lain.local'])
+    return conf
+
+
+def _assert_same_conf(decoded, conf):
+    assert decoded.to_dict() == conf.to_dict()
+    assert sorted(decoded.procs.keys()) == sorted(conf.procs.keys())
+    for name, proc in conf.procs.iteritems():
+        assert json.loads(decoded.procs[name].annotation) == json.loads(proc.annotation)
+        assert decoded.procs[name].type == proc.type
+        assert sorted(decoded.procs[name].port.keys()) == sorted(proc.port.keys())
+
+
+def test_lain_conf_to_dict_round_trip(validation_yaml, new_prepare_yaml, healthcheck_yaml):
+    for meta_yaml in (validation_yaml, new_prepare_yaml, healthcheck_yaml):
+        conf = _load(meta_yaml)
+        decoded = LainConf.from_dict(conf.to_dict())
+        _assert_same_conf(decoded, conf)
+
+
+def test_lain_conf_json_round_trip(validation_yaml):
+    conf = _load(validation_yaml)
+    decoded = wire.loads_json(wire.dumps_json(conf))
+    _assert_same_conf(decoded, conf)
+    web = decoded.procs['web']
+    assert web.type == ProcType.web
+    assert web.port[8000].type == SocketType.tcp
+    assert web.image == conf.procs['web'].image
+    assert decoded.procs['x1-y'].backup == conf.procs['x1-y'].backup
+    assert decoded.procs['x1-y'].filters == ['constraint:group==default']
+    assert decoded.build.prepare.keep == ['bundle']
+    assert decoded.release.copy == conf.release.copy
+
+    # decoded conf is independent and can be patched
+    decoded.procs['web'].patch({'cpu': 2, 'port': 8080})
+    assert decoded.procs['web'].port.keys() == [8080]
+    assert conf.procs['web'].cpu == 0
+
+
+def test_lain_conf_msgpack_round_trip(validation_yaml):
+    if wire.msgpack is None:
+        pytest.skip('msgpack is not installed')
+    conf = _load(validation_yaml)
+    decoded = wire.loads_msgpack(wire.dumps_msgpack(conf))
+    _assert_same_conf(decoded, conf)
+
+
+def test_lain_conf_wire_format_version(validation_yaml):
+    payload = json.loads(wire.dumps_json(_load(validation_yaml)))
+    assert payload['version'] == wire.WIRE_FORMAT_VERSION
+    payload['version'] = wire.WIRE_FORMAT_VERSION + 1
+    with pytest.raises(Exception):
+        wire.loads_json(json.dumps(payload))
+
+
+def test_lain_conf_wire_default_encoding(validation_yaml, monkeypatch):
+    conf = _load(validation_yaml)
+    if wire.msgpack is not None:
+        data = wire.dumps(conf)
+        assert data == wire.dumps_msgpack(conf)
+        _assert_same_conf(wire.loads(data), conf)
+    # JSON without msgpack, and JSON is read either way
+    data = wire.dumps_json(conf)
+    _assert_same_conf(wire.loads(data), conf)
+    monkeypatch.setattr(wire, 'msgpack', None)
+    assert wire.dumps(conf) == data
@@ -1,7 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from lain_sdk.yaml.parser import parse_path
+import os
+import random
+
+from lain_sdk.util import lain_based_path, lain_based_paths
+from lain_sdk.yaml.parser import (parse_path, split_path, simplify_path, join_path,
+                                  invalid_volumes, INVALID_VOLUMES, DOCKER_APP_ROOT)
+
+PATH_PARTS = ['a', 'lain', 'app', '.', '..', '', ' ', ' b ', '.a', '...']
+
+
+def random_paths(rng, count):
+    paths = []
+    while len(paths) < count:
+        path = '/'.join(rng.choice(PATH_PARTS) for _ in range(rng.randint(0, 6)))
+        # split_path never ends for paths starting with //
+        if not os.path.join(DOCKER_APP_ROOT, path).startswith('//'):
+            paths.append(path)
+    return paths
 
 
 class TestLainParser:
@@ -16,3 +33,21 @@ class TestLainParser:
                                 '/lain/app/', '/lain/app/ ', '/lain/app/waht/',
                                 '/lain/app/  hello', '/lain/app/   /hello',
                                 '/hello', '/hello']
+
+    def test_parse_path_as_split_and_simplify(self):
+        paths = random_paths(random.Random(0), 5000)
+        expected = [join_path(simplify_path(split_path(os.path.join(DOCKER_APP_ROOT, p))))
+                    for p in paths]
+        assert parse_path(paths) == expected
+
+    def test_lain_based_paths_as_normpath(self):
+        paths = random_paths(random.Random(1), 5000) + ['//a', '///a/./b']
+        assert lain_based_paths(paths) == [lain_based_path(p) for p in paths]
+        assert lain_based_paths(paths, 'base') == [lain_based_path(p, 'base') for p in paths]
+
+    def test_invalid_volumes(self):
+        paths = random_paths(random.Random(2), 5000)
+        expected = [p for p in paths
+                    if os.path.abspath(os.path.join(DOCKER_APP_ROOT, p.strip())) in INVALID_VOLUMES]
+        assert expected
+        assert invalid_volumes(paths) == expected
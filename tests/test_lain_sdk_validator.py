@@ -3,7 +3,10 @@
 
 import pytest
 import yaml
-from lain_sdk.yaml.validator import validate
+from lain_sdk.yaml.validator import (
+    validate, validate_all, validate_many, json_pointer, validator, codegen,
+    parse_and_validate)
+from lain_sdk.yaml.validator.schema import schema
 
 
 def test_lain_yaml_validator_smoke(validation_yaml):
@@ -83,3 +86,139 @@ def test_memory_format(data, want):
     lain_config = yaml.safe_load(data)
     valid, msg = validate(lain_config)
     assert valid == want
+
+
+def test_validate_same_as_jsonschema(validation_yaml):
+    import jsonschema
+    lain_config = yaml.safe_load(validation_yaml)
+    lain_config['web']['memory'] = 128
+    valid, msg = validate(lain_config)
+    assert not valid
+    with pytest.raises(jsonschema.ValidationError) as e:
+        jsonschema.validate(lain_config, schema)
+    assert msg == str(e.value)
+
+
+def test_validate_all(validation_yaml):
+    lain_config = yaml.safe_load(validation_yaml)
+    assert validate_all(lain_config) == []
+
+    lain_config['web']['memory'] = 128
+    lain_config['proc.x1-y']['cmd'] = 1
+    lain_config['build'].pop('base')
+    errors = validate_all(lain_config)
+    assert [path for path, _ in errors] == ['/build', '/proc.x1-y/cmd', '/web/memory']
+    assert "'base' is a required property" in errors[0][1]
+
+
+def test_validate_many(validation_yaml):
+    valid = yaml.safe_load(validation_yaml)
+    invalid = yaml.safe_load(validation_yaml)
+    invalid['appname'] = 'invalid_appname'
+    results = validate_many([valid, invalid, valid])
+    assert results[0] == results[2] == []
+    assert [path for path, _ in results[1]] == ['/appname']
+
+
+def test_validate_non_string_key(validation_yaml):
+    # patternProperties match keys with re, which raises for an int key
+    data = yaml.safe_load('appname: a\nbuild: {base: x, script: [a]}\n8080: {cmd: x}\n')
+    assert validate(data) == (False, 'expected string or buffer')
+    assert validate_all(data) == [('', 'expected string or buffer')]
+    valid = yaml.safe_load(validation_yaml)
+    assert validate_many([valid, data, valid]) == [[], [('', 'expected string or buffer')], []]
+
+
+def test_json_pointer():
+    assert json_pointer([]) == ''
+    assert json_pointer(['web', 'port', 0]) == '/web/port/0'
+    assert json_pointer(['a/b', 'c~d']) == '/a~1b/c~0d'
+
+
+INVALID_CASES = [
+    ('appname', 'invalid_appname'),
+    ('appname', 1),
+    ('giturl', None),
+    ('unknown', 'value'),
+    ('web', 'not a proc'),
+    ('proc.x1-y', {'cmd': 1, 'memory': '12x', 'setup_time': 1000}),
+    ('service.echo', {'cmd': ['a', 1], 'portal': {'service_name': 1, 'unknown': 1}}),
+    ('build', {'script': 'echo', 'prepare': {'version': 'v 1', 'keep': 'x'}}),
+    ('release', {'dest_base': 1, 'copy': [None, {'src': 1}], 'script': [1]}),
+    ('use_resources', {'redis': {'services': [1], 'memory': [], 'x_y': 1}}),
+    ('use_services', {'bad name': ['a'], 'hello': ['-']}),
+]
+
+
+@pytest.mark.parametrize("key, value", INVALID_CASES)
+def test_compiled_validator_same_errors(tmpdir, validation_yaml, key, value):
+    compiled_iter_errors = codegen.load(schema, cache_dir=tmpdir.strpath)
+
+    def errors(iter_errors, data):
+        return [(e.message, list(e.path), list(e.schema_path), e.validator, str(e),
+                 [c.message for c in e.context])
+                for e in iter_errors(data)]
+
+    lain_config = yaml.safe_load(validation_yaml)
+    assert errors(compiled_iter_errors, lain_config) == []
+    lain_config[key] = value
+    want = errors(validator.iter_errors, lain_config)
+    assert want
+    assert errors(compiled_iter_errors, lain_config) == want
+
+
+def test_compiled_validator_cache(tmpdir, monkeypatch):
+    cache_dir = tmpdir.join('cache')
+    codegen.load(schema, cache_dir=cache_dir.strpath)
+    key = codegen.cache_key(schema)
+    assert sorted(f.basename for f in cache_dir.listdir()) == [
+        '_lain_validator_%s.code' % key, '_lain_validator_%s.py' % key]
+
+    # loaded from the cache
+    cache_dir.join('_lain_validator_%s.py' % key).remove()
+    iter_errors = codegen.load(schema, cache_dir=cache_dir.strpath)
+    assert list(iter_errors({'appname': 'hello', 'build': {'base': 'a', 'script': []}})) == []
+    assert len(cache_dir.listdir()) == 1
+
+    # a broken entry is generated again
+    cache_dir.join('_lain_validator_%s.code' % key).write('broken')
+    codegen.load(schema, cache_dir=cache_dir.strpath)
+    assert len(cache_dir.listdir()) == 2
+
+    monkeypatch.setattr(codegen, 'GENERATOR_VERSION', codegen.GENERATOR_VERSION + 1)
+    assert codegen.cache_key(schema) != key
+    codegen.load(schema, cache_dir=cache_dir.strpath)
+    assert len(cache_dir.listdir()) == 4
+
+
+def test_compiled_validator_unsupported_schema(tmpdir):
+    with pytest.raises(codegen.UnsupportedSchema):
+        codegen.load({'type': 'object', 'properties': {'a': {'$ref': '#'}}},
+                     cache_dir=tmpdir.strpath)
+    with pytest.raises(codegen.UnsupportedSchema):
+        codegen.load({'type': 'array', 'uniqueItems': True}, cache_dir=tmpdir.strpath)
+
+
+def test_parse_and_validate(validation_yaml):
+    conf, errors = parse_and_validate(validation_yaml, '123456-abcdefg', None,
+                                      domains=['lain.local'])
+    assert errors == []
+    assert conf.appname == 'for-validate'
+    assert sorted(conf.procs.keys()) == ['echo', 'portal-echo', 'portal-x1', 'web', 'x1-y']
+
+    conf, errors = parse_and_validate(
+        validation_yaml.replace('memory: 256m', 'memory: 256'), '123456-abcdefg')
+    assert conf is None
+    assert errors == [('/web/memory', "256 is not of type 'string'")]
+
+    conf, errors = parse_and_validate('appname: [', '123456-abcdefg')
+    assert conf is None
+    assert [path for path, _ in errors] == ['']
+
+    # valid against the schema, but rejected by LainConf
+    conf, errors = parse_and_validate(
+        'appname: portal\nbuild:\n  base: golang\n  script: []\n', '123456-abcdefg')
+    assert conf is None
+    assert len(errors) == 1
+    assert errors[0][0] == ''
+    assert 'appname portal should not in' in errors[0][1]
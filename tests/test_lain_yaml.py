@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import threading
+
+from lain_sdk import lain_yaml, mydocker
 from lain_sdk.lain_yaml import LainYaml
 
 YAML = 'tests/lain.yaml'
@@ -28,6 +31,7 @@ class TestLainYaml:
         assert y.procs['web'].cmd == ['hello']
         assert y.procs['web'].setup_time == 40
         assert y.procs['web'].kill_timeout == 30
+        assert not [k for k in vars(y) if k.startswith('_') and k != '_pushes']
 
     def test_prepare_act(self):
         y = LainYaml(ignore_prepare=True)
@@ -46,3 +50,51 @@ class TestLainYaml:
         assert len(y.img_names) == 4
         assert len(y.img_temps) == 4
         assert len(y.img_builders) == 4
+
+
+PREPARE_YAML = '''
+appname: hello
+build:
+  base: golang
+  prepare:
+    version: "0"
+    script:
+      - go get
+  script:
+    - go build -o hello
+web:
+  cmd: hello
+'''
+
+
+def test_ensure_proper_shared_image(monkeypatch):
+    local_listed, push_allowed = threading.Event(), threading.Event()
+    calls = []
+
+    def registry_tags(registry, appname):
+        # returns only once the local lookup runs too
+        calls.append(('registry', local_listed.wait(5)))
+        return ['prepare-0-100', 'release-1-abc']
+
+    def daemon_tags(registry, appname):
+        local_listed.set()
+        return ['prepare-0-200']
+
+    def push(name):
+        push_allowed.wait(5)
+        calls.append(('push', name))
+        return 0
+    monkeypatch.setattr(lain_yaml, 'PRIVATE_REGISTRY', 'registry.lain.local')
+    monkeypatch.setattr(mydocker, 'get_tag_list_in_registry', registry_tags)
+    monkeypatch.setattr(mydocker, 'get_tag_list_in_docker_daemon', daemon_tags)
+    monkeypatch.setattr(mydocker, 'push', push)
+
+    y = LainYaml(ignore_prepare=True)
+    y.load(PREPARE_YAML)
+    # the local image is newer, it is pushed in the background
+    assert y.ensure_proper_shared_image() == 'registry.lain.local/hello:prepare-0-200'
+    assert calls == [('registry', True)]
+    push_allowed.set()
+    y.wait_pushes()
+    assert calls[1:] == [('push', 'registry.lain.local/hello:prepare-0-200')]
+    assert y._pushes == []
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import pytest
+from lain_sdk.lain_yaml import LainYaml
+from lain_sdk.phases import Phase, run_phases, check_phases, DONE, FAILED, CANCELLED
+
+YAML = 'tests/lain.yaml'
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.order = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def phase(self, name, ok=True, delay=0.05):
+        def func():
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(delay)
+            with self.lock:
+                self.running -= 1
+                self.order.append(name)
+            if ok == 'raise':
+                raise ValueError(name)
+            return ok, name
+        return func
+
+
+def graph(recorder, failing=()):
+    # meta and the build chain are independent, release and test share build
+    def phase(name, *requires):
+        ok = 'raise' if name in failing else True
+        return Phase(name, recorder.phase(name, ok), requires)
+    return [phase('prepare'), phase('build', 'prepare'), phase('release', 'build'),
+            phase('test', 'build'), phase('meta')]
+
+
+def test_run_phases_in_order():
+    recorder = Recorder()
+    results = run_phases(graph(recorder))
+    assert recorder.max_running == 1
+    assert recorder.order == ['prepare', 'build', 'release', 'test', 'meta']
+    assert all(r.status == DONE for r in results.values())
+    assert results['release'].value == 'release'
+
+
+def test_run_phases_parallel():
+    recorder = Recorder()
+    results = run_phases(graph(recorder), parallel=2)
+    assert recorder.max_running == 2
+    assert all(r.status == DONE for r in results.values())
+    order = recorder.order
+    assert order.index('prepare') < order.index('build') < order.index('release')
+    assert order.index('build') < order.index('test')
+
+
+def test_run_phases_failure_cancels_dependents():
+    recorder = Recorder()
+    results = run_phases(graph(recorder, failing=['prepare']), parallel=3)
+    assert results['prepare'].status == FAILED
+    assert isinstance(results['prepare'].error, ValueError)
+    assert [results[n].status for n in ('build', 'release', 'test')] == [CANCELLED] * 3
+    assert results['meta'].status == DONE
+    assert sorted(recorder.order) == ['meta', 'prepare']
+
+    results = run_phases([Phase('build', lambda: (False, None), ()),
+                          Phase('release', lambda: (True, None), ('build', ))])
+    assert results['build'].status == FAILED
+    assert results['build'].error is None
+    assert results['release'].status == CANCELLED
+
+
+def test_check_phases():
+    func = lambda: (True, None)
+    check_phases([Phase('a', func, ()), Phase('b', func, ('a', ))])
+    with pytest.raises(Exception):
+        check_phases([Phase('a', func, ()), Phase('a', func, ())])
+    with pytest.raises(Exception):
+        check_phases([Phase('a', func, ('c', ))])
+    with pytest.raises(Exception):
+        check_phases([Phase('a', func, ('b', )), Phase('b', func, ('a', ))])
+    with pytest.raises(Exception):
+        run_phases([Phase('a', func, ())], parallel=0)
+
+
+def test_lain_yaml_phase_graph():
+    y = LainYaml(ignore_prepare=True)
+    y.load(open(YAML).read())
+
+    def requires(phases):
+        return [(p.name, p.requires) for p in phases]
+    assert requires(y.phase_graph(['release'])) == [('build', ()), ('release', ('build', ))]
+    assert requires(y.phase_graph(['meta', 'release', 'test'])) == [
+        ('build', ()), ('release', ('build', )), ('test', ('build', )), ('meta', ())]
+    with pytest.raises(Exception):
+        y.phase_graph(['deploy'])
+
+
+def test_run_phases_exit():
+    def prepare():
+        exit(1)
+    results = run_phases([Phase('prepare', prepare, ()),
+                          Phase('build', lambda: (True, None), ('prepare', ))], parallel=2)
+    assert results['prepare'].status == FAILED
+    assert isinstance(results['prepare'].error, SystemExit)
+    assert results['build'].status == CANCELLED
+
+
+def test_lain_yaml_phase_graph_without_prepare():
+    y = LainYaml(ignore_prepare=True)
+    y.load(open(YAML).read())
+    assert y.build.prepare is None
+    with pytest.raises(Exception):
+        y.phase_graph(['prepare', 'release'])
+    assert [p.name for p in y.phase_graph(['release'], use_prepare=True)] == ['build', 'release']
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from lain_sdk.yaml.parser import LainConf
+from lain_sdk.yaml.ports import PortConflict, PortRegistry
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def load(appname, procs):
+    lines = ['appname: %s' % appname, 'build:', '  base: golang',
+             '  script:', '    - go build']
+    for procname, ports in procs:
+        lines += ['worker.%s:' % procname, '  cmd: run', '  ports:']
+        lines += ['    "%s": {}' % p for p in ports]
+    conf = LainConf()
+    conf.load('\n'.join(lines), META_VERSION, None)
+    return conf
+
+
+def test_port_registry_conflicts_across_apps():
+    hello = load('hello', [('a', ['9500:80/tcp', '9501:81/udp']), ('b', ['9502:82'])])
+    world = load('world', [('c', ['9500:80/tcp', '9501:81/tcp'])])
+    registry, conflicts = PortRegistry.from_confs([hello, world])
+    assert conflicts == [PortConflict('tcp', 9500, ('hello', 'a'), ('world', 'c'))]
+    assert registry.owner(9501, 'udp') == ('hello', 'a')
+    assert registry.owner(9501, 'tcp') == ('world', 'c')
+    assert not registry.is_free(9502)
+    assert registry.is_free(9502, 'udp')
+    assert len(registry) == 4
+
+    # ports of the same app do not conflict with its previous version
+    assert registry.conflicts(hello) == []
+    # but two procs of one app can not map the same src port
+    both = load('both', [('x', ['9600:80']), ('y', ['9600:80'])])
+    assert registry.add_conf(both) == [PortConflict('tcp', 9600, ('both', 'x'), ('both', 'y'))]
+
+
+def test_port_registry_incremental_update():
+    registry = PortRegistry()
+    registry.add_conf(load('hello', [('a', ['9500:80', '9501:81'])]))
+    assert registry.add_conf(load('hello', [('a', ['9501:81', '9503:83'])])) == []
+    assert registry.app_ports('hello') == [('tcp', 9501), ('tcp', 9503)]
+    assert registry.is_free(9500)
+    assert registry.remove_app('hello') == [('tcp', 9501), ('tcp', 9503)]
+    assert len(registry) == 0
+    assert registry.app_ports('hello') == []
+
+
+def test_port_registry_allocate():
+    registry = PortRegistry(min_port=9500, max_port=9503)
+    registry.claim(9500, 'tcp', 'hello', 'a')
+    registry.claim(9502, 'tcp', 'hello', 'a')
+    assert registry.first_free() == 9501
+    assert registry.first_free(start=9502) == 9503
+    assert registry.first_free('udp') == 9500
+    assert registry.allocate('world', 'b') == 9501
+    assert registry.allocate('world', 'b') == 9503
+    assert registry.first_free() is None
+    with pytest.raises(Exception):
+        registry.allocate('world', 'b')
+    with pytest.raises(Exception):
+        registry.claim(9500, 'tcp', 'world', 'b')
+    with pytest.raises(Exception):
+        registry.is_free(9600)
+    with pytest.raises(Exception):
+        registry.first_free('sctp')
+    registry.release(9502)
+    assert registry.first_free() == 9502
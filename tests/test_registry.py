@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from fixtures.registry import StandInRegistry
+from lain_sdk import registry as registry_module
+from lain_sdk import mydocker, util
+from lain_sdk.registry import RegistryClient, get_client, clear_clients
+
+CREDENTIALS = ('lain', 'secret')
+TAGS = {'hello': ['release-1-abc', 'prepare-0-1'], 'other': ['release-2-def']}
+
+
+@pytest.fixture
+def registry():
+    with StandInRegistry(TAGS, credentials=CREDENTIALS) as registry:
+        yield registry
+    clear_clients()
+
+
+def test_registry_client_caches_challenge_and_token(registry):
+    client = RegistryClient(registry.address, CREDENTIALS)
+    assert client.tag_list('hello') == TAGS['hello']
+    assert registry.requests == ['/v2', '/token', '/v2/hello/tags/list']
+    registry.reset_counts()
+
+    assert client.tag_list('hello') == TAGS['hello']
+    assert client.tag_list('hello') == TAGS['hello']
+    assert registry.requests == ['/v2/hello/tags/list'] * 2
+    # the connection is kept alive
+    assert registry.connections == 0
+    assert client.round_trips == 5
+
+    # tokens are per repository
+    registry.reset_counts()
+    assert client.tag_list('other') == TAGS['other']
+    assert registry.requests == ['/token', '/v2/other/tags/list']
+    assert client.tag_list('unknown') == []
+
+
+def test_registry_client_token_expires(registry, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(registry_module.time, 'time', lambda: now[0])
+    registry.expires_in = 60
+    client = RegistryClient(registry.address, CREDENTIALS)
+    token = client.token('hello')
+    assert token
+    now[0] += 50
+    assert client.token('hello') == token
+    # renewed a few seconds before it expires
+    now[0] += 6
+    assert client.token('hello') != token
+    assert registry.requests == ['/v2', '/token', '/token']
+
+
+def test_registry_client_revoked_token(registry):
+    client = RegistryClient(registry.address, CREDENTIALS)
+    assert client.tag_list('hello') == TAGS['hello']
+    registry.revoke_tokens()
+    registry.reset_counts()
+    assert client.tag_list('hello') == TAGS['hello']
+    assert registry.requests == ['/v2/hello/tags/list', '/v2', '/token', '/v2/hello/tags/list']
+
+
+def test_registry_client_wrong_credentials(registry):
+    client = RegistryClient(registry.address, ('lain', 'wrong'))
+    assert client.token('hello') == ''
+    assert client.tag_list('hello') == []
+
+
+def test_registry_client_without_auth():
+    with StandInRegistry(TAGS, auth=False) as registry:
+        client = get_client(registry.address)
+        assert util.parse_registry_auth(registry.address) == (False, '')
+        assert mydocker.get_tag_list_in_registry(registry.address, 'hello') == TAGS['hello']
+        assert mydocker.get_tag_list_in_registry(registry.address, 'hello') == TAGS['hello']
+        assert registry.requests == ['/v2'] + ['/v2/hello/tags/list'] * 2
+        assert get_client(registry.address) is client
+        assert client.round_trips == 3
+    clear_clients()
+
+
+def test_registry_client_unreachable():
+    with StandInRegistry(TAGS) as registry:
+        address = registry.address
+    client = RegistryClient(address, CREDENTIALS)
+    assert client.challenge() == (False, '')
+    assert client.tag_list('hello') == []
+    assert client.token('hello') == ''
+    assert client.challenge() == (False, '')
+    # the failed probe is kept, only the tags were requested again
+    assert client.round_trips == 2
+
+
+def test_get_jwt_for_registry_uses_auth_url(registry):
+    with StandInRegistry(TAGS, credentials=CREDENTIALS) as token_server:
+        registry_module._clients[registry.address] = RegistryClient(registry.address, CREDENTIALS)
+        token = util.get_jwt_for_registry('%s/token' % token_server.url, registry.address, 'hello')
+        assert token and token_server.requests == ['/token']
+        assert registry.requests == []
+        # without auth_url the token server the registry challenges with is used
+        assert util.get_jwt_for_registry('', registry.address, 'hello')
+        assert registry.requests == ['/v2', '/token']
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import json
+from StringIO import StringIO
+
+import pytest
+from lain_sdk import timing
+from lain_sdk.yaml.parser import LainConf
+
+META_VERSION = '1428553798-7142797e64bb7b4d057455ef13de6be156ae81cc'
+
+
+def test_timing_disabled_records_nothing():
+    assert not timing.enabled()
+    assert timing.span('nothing') is timing.span('else')
+    with timing.span('nothing') as span:
+        span.set(key='value')
+    timing.event('nothing')
+
+    calls = []
+    func = timing.timed('func')(lambda x: calls.append(x) or x)
+    assert func(1) == 1
+    assert calls == [1]
+
+
+def test_timing_nested_spans_and_events():
+    collector = timing.MemorySink()
+    with timing.collect(collector):
+        assert timing.enabled()
+        with timing.span('outer', app='hello') as outer:
+            timing.event('started')
+            with timing.span('inner'):
+                pass
+            outer.set(result='ok')
+        with pytest.raises(ValueError):
+            with timing.span('failed'):
+                raise ValueError('failed')
+    assert not timing.enabled()
+
+    records = dict((r.name, r) for r in collector.records)
+    assert records['outer'].depth == 0
+    assert records['outer'].attrs == {'app': 'hello', 'result': 'ok'}
+    assert records['started'].kind == 'event'
+    assert records['started'].depth == 1
+    assert records['inner'].depth == 1
+    assert records['inner'].duration <= records['outer'].duration
+    assert records['failed'].attrs == {'error': 'ValueError'}
+    assert records['failed'].depth == 0
+
+    report = collector.report()
+    assert report.index('outer') < report.index('started') < report.index('inner')
+    assert collector.summary()['outer'][0] == 1
+
+
+def test_timing_json_and_log_sinks(tmpdir):
+    path = tmpdir.join('timings.json').strpath
+    stream = StringIO()
+    with timing.collect(timing.JsonSink(path), timing.LogSink(stream)):
+        with timing.span('docker.build', image='hello:build'):
+            pass
+    lines = open(path).read().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record['name'] == 'docker.build'
+    assert record['attrs'] == {'image': 'hello:build'}
+    assert stream.getvalue().startswith('timing: docker.build ')
+    assert 'image=hello:build' in stream.getvalue()
+
+
+def test_timing_lain_conf_load(validation_yaml):
+    collector = timing.MemorySink()
+    with timing.collect(collector):
+        conf = LainConf()
+        conf.load(validation_yaml, META_VERSION, None)
+    assert len(collector.spans('lain_conf.load')) == 1
+    # a service section loads a proc and a portal
+    assert len(collector.spans('proc.load')) == len(conf.procs)
+    assert all(r.depth == 2 for r in collector.spans('proc.load'))
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+import yaml
+import pytest
+from lain_sdk.yaml import backend
+
+
+def test_backend_safe_load_same_as_pyyaml(validation_yaml, release_yaml, new_prepare_yaml):
+    for text in (validation_yaml, release_yaml, new_prepare_yaml):
+        assert backend.safe_load(text) == yaml.load(text, Loader=yaml.SafeLoader)
+
+
+def test_backend_safe_load_rejects_python_tags():
+    with pytest.raises(yaml.YAMLError):
+        backend.safe_load('!!python/object/apply:os.system ["true"]')
+
+
+def test_backend_dump_same_as_pyyaml(validation_yaml):
+    data = backend.safe_load(validation_yaml)
+    assert backend.dump(data, default_flow_style=False) == \
+        yaml.dump(data, Dumper=yaml.Dumper, default_flow_style=False)
+    assert backend.safe_dump(data, default_flow_style=False) == \
+        yaml.safe_dump(data, default_flow_style=False)